@@ -0,0 +1,21 @@
+#!/bin/sh
+set -e
+
+case "$1" in
+  test)
+    python manage.py test
+    ;;
+  serve)
+    # Production: несколько процессов gunicorn, DEBUG выключен
+    export DJANGO_DEBUG="${DJANGO_DEBUG:-0}"
+    # Кэш связей в памяти процесса не согласован между воркерами, по умолчанию используется общий файловый
+    export FRIENDSHIP_CACHE_BACKEND="${FRIENDSHIP_CACHE_BACKEND:-django.core.cache.backends.filebased.FileBasedCache}"
+    export FRIENDSHIP_CACHE_LOCATION="${FRIENDSHIP_CACHE_LOCATION:-/tmp/friendship-cache}"
+    python manage.py migrate --noinput
+    exec gunicorn --config gunicorn.conf.py "${APP_MODULE:-vk_internship.wsgi:application}"
+    ;;
+  *)
+    python manage.py migrate
+    exec python manage.py runserver 0.0.0.0:8000
+    ;;
+esac
@@ -0,0 +1,115 @@
+"""Асинхронные версии эндпоинтов чтения для ASGI (vk_internship.asgi).
+
+Ответы совпадают с синхронными DRF-представлениями; запросы к базе идут через async ORM, поэтому
+один воркер обслуживает много медленных соединений одновременно.
+"""
+from asgiref.sync import sync_to_async
+from django.http import HttpResponse
+from django.utils.cache import get_conditional_response
+from django.views import View
+from rest_framework import status
+from rest_framework.exceptions import APIException, ValidationError
+
+from friendship.pagination import SortedIdsPagination
+from friendship.services import get_incoming_request_ids, get_outgoing_request_ids, get_user_friend_ids, \
+    aget_relationship_counts, aget_relationship_versions, aget_relationship_status
+from friendship.views import FriendshipRequestsListView, _etag, _user_fields
+from user.models import User
+from vk_internship.renderers import render_json
+
+
+async def _auser_page(page, fields) -> list[dict]:
+    """Асинхронный friendship.views._user_page"""
+    if fields == ('id',) or not page:
+        return [{'id': user_id} for user_id in page]
+    return [row async for row in User.objects.filter(id__in=page).order_by('id').values(*fields)]
+
+
+class AsyncView(View):
+    """Асинхронное представление: исключения DRF отдаются так же, как rest_framework.views.exception_handler"""
+
+    async def dispatch(self, request, *args, **kwargs):
+        try:
+            return await super().dispatch(request, *args, **kwargs)
+        except APIException as error:
+            detail = error.detail if isinstance(error.detail, (list, dict)) else {'detail': error.detail}
+            return render_json(detail, error.status_code)
+
+    async def conditional(self, request, versions, build_response) -> HttpResponse:
+        """Асинхронный вариант friendship.views._conditional"""
+        if versions is None:
+            return await build_response()
+        etag = _etag(request, versions)
+        response = get_conditional_response(request, etag=etag)
+        if response is None:
+            response = await build_response()
+            if response.status_code != status.HTTP_200_OK:
+                return response
+        response['ETag'] = etag
+        return response
+
+
+class AsyncFriendshipsListView(AsyncView):
+    """Асинхронная версия FriendshipsListView"""
+
+    async def get(self, request, user_id: int) -> HttpResponse:
+        fields = _user_fields(request)
+        counts = await aget_relationship_counts(user_id)
+
+        async def build_response():
+            # Кэш связей и загрузка промаха синхронные
+            friend_ids = await sync_to_async(get_user_friend_ids)(user_id, counts['relationship_version']) \
+                if counts else []
+            paginator = SortedIdsPagination()
+            page = paginator.paginate_ids(friend_ids, request)
+            data = {'friends': await _auser_page(page, fields), **paginator.get_links()}
+            if paginator.include_count(request):
+                data['count'] = counts['friends_count'] if counts else 0
+            return render_json(data)
+
+        return await self.conditional(request, counts and (counts['relationship_version'],), build_response)
+
+
+class AsyncFriendshipRequestsListView(AsyncView):
+    """Асинхронная версия FriendshipRequestsListView"""
+
+    async def get(self, request, user_id: int, requests_type: str) -> HttpResponse:
+        requests_type = FriendshipRequestsListView.get_requests_type(requests_type)
+        fields = _user_fields(request)
+        counts = await aget_relationship_counts(user_id)
+
+        async def build_response():
+            load_ids = get_incoming_request_ids if requests_type == 'incoming' else get_outgoing_request_ids
+            user_ids = await sync_to_async(load_ids)(user_id, counts['relationship_version']) if counts else []
+            paginator = SortedIdsPagination()
+            page = paginator.paginate_ids(user_ids, request)
+            data = {
+                'requests_users': await _auser_page(page, fields),
+                'requests_type': requests_type,
+                **paginator.get_links(),
+            }
+            if paginator.include_count(request, default=True):
+                data['count'] = counts[f'{requests_type}_requests_count'] if counts else 0
+            return render_json(data)
+
+        return await self.conditional(request, counts and (counts['relationship_version'],), build_response)
+
+
+class AsyncFriendshipStatusView(AsyncView):
+    """Асинхронная версия FriendshipStatusView"""
+
+    async def get(self, request, user_id: int, target_user_id: int) -> HttpResponse:
+        if user_id == target_user_id:
+            raise ValidationError('user_id must not be equal to target_user_id')
+
+        versions = await aget_relationship_versions([user_id, target_user_id])
+        versions = (versions[user_id], versions[target_user_id]) if len(versions) == 2 else None
+
+        async def build_response():
+            relationship = await aget_relationship_status(user_id, target_user_id)
+            return render_json({
+                'status': relationship.name,
+                'message': relationship.value,
+            })
+
+        return await self.conditional(request, versions, build_response)
@@ -0,0 +1,435 @@
+"""Синтетический бенчмарк API: генерация графа со степенным распределением и прогон всех эндпоинтов"""
+import asyncio
+import json
+import os
+import random
+import statistics
+import time
+import tracemalloc
+from concurrent.futures import ThreadPoolExecutor
+from dataclasses import dataclass, field
+from io import BytesIO
+from itertools import islice
+
+from django.core.handlers.asgi import ASGIHandler
+from django.core.handlers.wsgi import WSGIHandler
+from django.db import connection, transaction
+from django.test import Client
+from rest_framework.renderers import JSONRenderer
+
+from friendship import cache as relationship_cache, notifications, recommendations
+from friendship.models import Friendship, FriendAdjacency, FriendRequests
+from friendship.services import repair_counters
+from user.models import User
+from user.serializers import UserSerializer
+from vk_internship.renderers import FastJSONRenderer
+
+# Количество строк в одном bulk_create
+WRITE_BATCH_SIZE = 1000
+# Разница латентности меньше этого значения считается шумом и не проверяется порогом
+LATENCY_NOISE_MS = 1.0
+# Метрики, рост которых сверх порога считается регрессией
+GATED_METRICS = ('p95_ms', 'queries_per_call')
+
+
+@dataclass
+class GraphState:
+    """Сгенерированный граф; списки изменяются сценариями, чтобы действия попадали в существующие связи"""
+    user_ids: list[int]
+    friendships: list[tuple[int, int]]
+    requests: list[tuple[int, int]]
+    rng: random.Random
+    created_users: int = field(default=0)
+
+    def user(self) -> int:
+        return self.rng.choice(self.user_ids)
+
+    def pair(self) -> tuple[int, int]:
+        user_id, target_user_id = self.rng.sample(self.user_ids, 2)
+        return user_id, target_user_id
+
+    def friendship(self) -> tuple[int, int]:
+        return self.rng.choice(self.friendships) if self.friendships else self.pair()
+
+    def pop(self, items: list) -> tuple[int, int]:
+        if not items:
+            return self.pair()
+        return items.pop(self.rng.randrange(len(items)))
+
+
+def _bulk_create(model, objects):
+    objects = iter(objects)
+    while batch := list(islice(objects, WRITE_BATCH_SIZE)):
+        model.objects.bulk_create(batch)
+
+
+def generate(users: int, average_degree: int, request_ratio: float, seed: int = 0) -> GraphState:
+    """Граф предпочтительного присоединения (Барабаши — Альберт) прямо в моделях.
+
+    Каждый новый пользователь связывается с average_degree / 2 существующими, выбранными с вероятностью,
+    пропорциональной степени. Доля request_ratio связей становится запросами в случайном направлении.
+    """
+    rng = random.Random(seed)
+    with transaction.atomic():
+        _bulk_create(User, (User(username=f'user{index}', username_normalized=f'user{index}') for index in range(users)))
+    user_ids = list(User.objects.order_by('id').values_list('id', flat=True))
+
+    edges_per_user = max(1, average_degree // 2)
+    # Каждый пользователь встречается в списке 1 + степень раз
+    endpoints = []
+    edges = []
+    for index, user_id in enumerate(user_ids):
+        chosen = set()
+        while len(chosen) < min(edges_per_user, index):
+            chosen.add(rng.choice(endpoints))
+        for target_user_id in chosen:
+            edges.append((user_id, target_user_id))
+            endpoints.append(target_user_id)
+            endpoints.append(user_id)
+        endpoints.append(user_id)
+
+    friendships = []
+    requests = []
+    for user_id, target_user_id in edges:
+        if rng.random() < request_ratio:
+            requests.append((user_id, target_user_id) if rng.random() < 0.5 else (target_user_id, user_id))
+        else:
+            friendships.append(Friendship.ordered(user_id, target_user_id))
+
+    with transaction.atomic():
+        _bulk_create(Friendship, (Friendship(user1_id=user1, user2_id=user2) for user1, user2 in friendships))
+        _bulk_create(FriendAdjacency, (
+            FriendAdjacency(owner_id=owner, friend_id=friend)
+            for user1, user2 in friendships
+            for owner, friend in ((user1, user2), (user2, user1))
+        ))
+        _bulk_create(FriendRequests, (
+            FriendRequests(request_from_id=request_from, request_to_id=request_to) for request_from, request_to in requests
+        ))
+    repair_counters()
+    for start in range(0, len(user_ids), WRITE_BATCH_SIZE):
+        recommendations.rebuild(user_ids[start:start + WRITE_BATCH_SIZE])
+    relationship_cache.clear()
+    return GraphState(user_ids, friendships, requests, rng)
+
+
+def _create_user(state: GraphState):
+    state.created_users += 1
+    return 'POST', '/api/users/', {'username': f'bench{state.created_users}'}
+
+
+def _request_action(state: GraphState):
+    match state.rng.choice(('send_request', 'accept_request', 'decline_request', 'cancel_request')):
+        case 'send_request':
+            user_id, target_user_id = state.pair()
+            return 'POST', f'/api/friendships/requests/{user_id}-{target_user_id}/send_request/', None
+        case 'cancel_request':
+            request_from, request_to = state.pop(state.requests)
+            return 'POST', f'/api/friendships/requests/{request_from}-{request_to}/cancel_request/', None
+        case action:
+            request_from, request_to = state.pop(state.requests)
+            return 'POST', f'/api/friendships/requests/{request_to}-{request_from}/{action}/', None
+
+
+def _requests_batch(state: GraphState):
+    operations = []
+    for _ in range(20):
+        user_id, target_user_id = state.pair()
+        operations.append({'user_id': user_id, 'target_user_id': target_user_id, 'action': 'send_request'})
+    return 'POST', '/api/friendships/requests/batch/', {'operations': operations}
+
+
+def _targets(state: GraphState, size: int = 50):
+    user_id = state.user()
+    targets = state.rng.sample(state.user_ids, min(size + 1, len(state.user_ids)))
+    return {'user_id': user_id, 'target_ids': [target for target in targets if target != user_id][:size]}
+
+
+def _delete_friend(state: GraphState):
+    user1, user2 = state.pop(state.friendships)
+    return 'POST', f'/api/friendships/delete/{user1}-{user2}/', None
+
+
+# Сценарий для каждого маршрута API: функция от состояния графа, возвращающая (метод, путь, тело JSON)
+SCENARIOS = {
+    'api/users/': _create_user,
+    'api/users/search/': lambda state: (
+        'GET', f'/api/users/search/?q=user{state.rng.randrange(100)}&user_id={state.user()}', None,
+    ),
+    'api/users/<int:user_id>/': lambda state: ('GET', f'/api/users/{state.user()}/', None),
+    'api/friendships/requests/batch/': _requests_batch,
+    'api/friendships/requests/<int:user_id>-<int:target_user_id>/<str:action>/': _request_action,
+    'api/friendships/requests/<int:user_id>/<str:requests_type>/': lambda state: (
+        'GET', f'/api/friendships/requests/{state.user()}/{state.rng.choice(("incoming", "outgoing"))}/', None,
+    ),
+    'api/friendships/delete/<int:user_id>-<int:target_user_id>/': _delete_friend,
+    'api/friendships/status/<int:user_id>-<int:target_user_id>/': lambda state: (
+        'GET', '/api/friendships/status/{}-{}/'.format(*state.pair()), None,
+    ),
+    'api/friendships/status/batch/': lambda state: ('POST', '/api/friendships/status/batch/', _targets(state)),
+    'api/friendships/cache/stats/': lambda state: ('GET', '/api/friendships/cache/stats/', None),
+    'api/friendships/mutual/batch/': lambda state: ('POST', '/api/friendships/mutual/batch/', _targets(state)),
+    'api/friendships/<int:user_id>-<int:target_user_id>/mutual/': lambda state: (
+        'GET', '/api/friendships/{}-{}/mutual/'.format(*state.friendship()), None,
+    ),
+    'api/friendships/path/<int:user_id>-<int:target_user_id>/': lambda state: (
+        'GET', '/api/friendships/path/{}-{}/?fields=id'.format(*state.pair()), None,
+    ),
+    'api/friendships/<int:user_id>/counts/': lambda state: ('GET', f'/api/friendships/{state.user()}/counts/', None),
+    'api/friendships/<int:user_id>/recommendations/': lambda state: (
+        'GET', f'/api/friendships/{state.user()}/recommendations/', None,
+    ),
+    'api/friendships/<int:user_id>/': lambda state: ('GET', f'/api/friendships/{state.user()}/?count=true', None),
+    'api/friendships/events/': lambda state: ('GET', '/api/friendships/events/?since=0&limit=100', None),
+    'api/async/users/<int:user_id>/': lambda state: ('GET', f'/api/async/users/{state.user()}/', None),
+    'api/async/friendships/requests/<int:user_id>/<str:requests_type>/': lambda state: (
+        'GET', f'/api/async/friendships/requests/{state.user()}/{state.rng.choice(("incoming", "outgoing"))}/', None,
+    ),
+    'api/async/friendships/status/<int:user_id>-<int:target_user_id>/': lambda state: (
+        'GET', '/api/async/friendships/status/{}-{}/'.format(*state.pair()), None,
+    ),
+    'api/async/friendships/<int:user_id>/': lambda state: (
+        'GET', f'/api/async/friendships/{state.user()}/?count=true', None,
+    ),
+}
+
+# Эндпоинты чтения, у которых есть синхронная и асинхронная версии (путь асинхронной — с префиксом /api/async/)
+CONCURRENCY_ROUTES = (
+    'api/users/<int:user_id>/',
+    'api/friendships/requests/<int:user_id>/<str:requests_type>/',
+    'api/friendships/status/<int:user_id>-<int:target_user_id>/',
+    'api/friendships/<int:user_id>/',
+)
+
+
+class _QueryCounter:
+    def __init__(self):
+        self.count = 0
+
+    def __call__(self, execute, sql, params, many, context):
+        self.count += 1
+        return execute(sql, params, many, context)
+
+
+def _percentile(values: list[float], percent: int) -> float:
+    if len(values) == 1:
+        return values[0]
+    return statistics.quantiles(values, n=100, method='inclusive')[percent - 1]
+
+
+def run(state: GraphState, calls: int, routes=None) -> dict[str, dict]:
+    """Прогон calls вызовов каждого маршрута через тестовый клиент Django"""
+    client = Client()
+    counter = _QueryCounter()
+    results = {}
+    for route, scenario in SCENARIOS.items():
+        if routes and route not in routes:
+            continue
+        latencies = []
+        queries = 0
+        errors = 0
+        started = time.perf_counter()
+        for _ in range(calls):
+            method, path, data = scenario(state)
+            counter.count = 0
+            call_started = time.perf_counter()
+            with connection.execute_wrapper(counter):
+                if data is None:
+                    response = client.generic(method, path)
+                else:
+                    response = client.generic(method, path, json.dumps(data), content_type='application/json')
+            latencies.append((time.perf_counter() - call_started) * 1000)
+            queries += counter.count
+            errors += response.status_code >= 500
+        elapsed = time.perf_counter() - started
+        results[route] = {
+            'calls': calls,
+            'errors': errors,
+            'throughput_rps': calls / elapsed if elapsed else 0.0,
+            'p50_ms': _percentile(latencies, 50),
+            'p95_ms': _percentile(latencies, 95),
+            'p99_ms': _percentile(latencies, 99),
+            'queries_per_call': queries / calls,
+        }
+    return results
+
+
+def compare(results: dict[str, dict], baseline: dict[str, dict], threshold: float) -> list[str]:
+    """Регрессии относительно базовых результатов: рост p95 или запросов на вызов больше чем на threshold"""
+    regressions = []
+    for route, result in results.items():
+        if route not in baseline:
+            continue
+        for metric in GATED_METRICS:
+            current, previous = result[metric], baseline[route][metric]
+            if metric.endswith('_ms') and current - previous < LATENCY_NOISE_MS:
+                continue
+            if current > previous * (1 + threshold):
+                regressions.append(f'{route}: {metric} {previous:.2f} -> {current:.2f}')
+        if result['errors'] > baseline[route]['errors']:
+            regressions.append(f'{route}: errors {baseline[route]["errors"]} -> {result["errors"]}')
+    return regressions
+
+
+def measure_serialization(rows: int = 10_000, repeat: int = 5) -> dict[str, float]:
+    """Время выборки и рендеринга rows пользователей: ModelSerializer + JSONRenderer против values() + orjson.
+
+    Возвращает лучшее из repeat измерений в миллисекундах для каждого способа.
+    """
+    def model_serializer():
+        return JSONRenderer().render(UserSerializer(User.objects.order_by('id')[:rows], many=True).data)
+
+    def values_rows():
+        return FastJSONRenderer().render(list(User.objects.order_by('id').values('id', 'username')[:rows]))
+
+    if model_serializer() != values_rows():
+        raise RuntimeError('values() + FastJSONRenderer output differs from UserSerializer')
+    results = {'rows': min(rows, User.objects.count())}
+    for name, render in (('model_serializer_ms', model_serializer), ('values_orjson_ms', values_rows)):
+        timings = []
+        for _ in range(repeat):
+            started = time.perf_counter()
+            render()
+            timings.append((time.perf_counter() - started) * 1000)
+        results[name] = min(timings)
+    return results
+
+
+def _wsgi_get(handler: WSGIHandler, path: str) -> int:
+    path, _, query = path.partition('?')
+    statuses = []
+    environ = {
+        'REQUEST_METHOD': 'GET', 'PATH_INFO': path, 'QUERY_STRING': query, 'SCRIPT_NAME': '',
+        'SERVER_NAME': 'testserver', 'SERVER_PORT': '80', 'HTTP_HOST': 'testserver', 'SERVER_PROTOCOL': 'HTTP/1.1',
+        'wsgi.input': BytesIO(), 'wsgi.url_scheme': 'http', 'wsgi.errors': BytesIO(),
+    }
+    response = handler(environ, lambda status, headers: statuses.append(int(status.split()[0])))
+    b''.join(response)
+    response.close()
+    return statuses[0]
+
+
+async def _asgi_get(handler: ASGIHandler, path: str, client_delay: float) -> int:
+    path, _, query = path.partition('?')
+    scope = {
+        'type': 'http', 'asgi': {'version': '3.0'}, 'http_version': '1.1', 'method': 'GET', 'scheme': 'http',
+        'path': path, 'raw_path': path.encode(), 'query_string': query.encode(), 'root_path': '',
+        'headers': [(b'host', b'testserver')], 'client': ('127.0.0.1', 0), 'server': ('testserver', 80),
+    }
+    statuses = []
+
+    async def receive():
+        # Медленный клиент: тело запроса приходит с задержкой, воркер в это время обслуживает другие соединения
+        await asyncio.sleep(client_delay)
+        return {'type': 'http.request', 'body': b'', 'more_body': False}
+
+    async def send(message):
+        if message['type'] == 'http.response.start':
+            statuses.append(message['status'])
+
+    await handler(scope, receive, send)
+    return statuses[0]
+
+
+def measure_concurrency(state: GraphState, connections: int = 50, requests_per_connection: int = 10,
+                        client_delay_ms: float = 20.0, threads: int | None = None) -> dict[str, dict]:
+    """Пропускная способность одного воркера на эндпоинтах чтения при connections одновременных медленных клиентах.
+
+    sync — WSGI-обработчик в пуле из threads потоков, как воркер gunicorn с настройкой threads (по умолчанию
+    GUNICORN_THREADS, см. gunicorn.conf.py): медленный клиент занимает поток на время задержки.
+    async — ASGI-обработчик с async-представлениями: все соединения обслуживаются в одном цикле событий.
+    """
+    if threads is None:
+        threads = int(os.environ.get('GUNICORN_THREADS', 1))
+    client_delay = client_delay_ms / 1000
+    total = connections * requests_per_connection
+    paths = [SCENARIOS[state.rng.choice(CONCURRENCY_ROUTES)](state)[1] for _ in range(total)]
+    results = {}
+
+    handler = WSGIHandler()
+
+    def wsgi_request(path: str) -> bool:
+        time.sleep(client_delay)
+        return _wsgi_get(handler, path) >= 500
+
+    started = time.perf_counter()
+    # Больше threads запросов одновременно воркер не обрабатывает, остальные клиенты ждут в очереди пула
+    with ThreadPoolExecutor(max_workers=min(threads, connections), thread_name_prefix='wsgi') as executor:
+        errors = sum(executor.map(wsgi_request, paths))
+    elapsed = time.perf_counter() - started
+    results['sync'] = {'requests': total, 'errors': errors, 'throughput_rps': total / elapsed, 'threads': threads}
+
+    async def run_connections():
+        handler = ASGIHandler()
+
+        async def connection_loop(index: int) -> int:
+            return sum([
+                await _asgi_get(handler, paths[position].replace('/api/', '/api/async/', 1), client_delay) >= 500
+                for position in range(index, total, connections)
+            ])
+
+        return sum(await asyncio.gather(*(connection_loop(index) for index in range(connections))))
+
+    started = time.perf_counter()
+    errors = asyncio.run(run_connections())
+    elapsed = time.perf_counter() - started
+    results['async'] = {'requests': total, 'errors': errors, 'throughput_rps': total / elapsed}
+    return results
+
+
+def measure_notification_streams(state: GraphState, connections: int = 1000) -> dict:
+    """Память на одно неактивное SSE-соединение и задержка доставки уведомления во все соединения.
+
+    Потоки открываются в одном цикле событий, как в ASGI-воркере; память считается через tracemalloc.
+    """
+    user_ids = [state.user() for _ in range(connections)]
+
+    async def run_streams():
+        started = [asyncio.Event() for _ in range(connections)]
+        delivered = {}
+        disconnect = asyncio.Event()
+
+        async def receive():
+            await disconnect.wait()
+            return {'type': 'http.disconnect'}
+
+        def sender(index: int):
+            async def send(message):
+                if message['type'] == 'http.response.start':
+                    started[index].set()
+                elif message.get('body', b'').startswith(b'event:'):
+                    delivered[index] = time.perf_counter()
+            return send
+
+        tracemalloc.start()
+        before = tracemalloc.get_traced_memory()[0]
+        tasks = [
+            asyncio.ensure_future(notifications.stream(
+                {'type': 'http', 'method': 'GET', 'path': f'/api/async/friendships/{user_id}/notifications/'},
+                receive, sender(index), user_id,
+            ))
+            for index, user_id in enumerate(user_ids)
+        ]
+        await asyncio.gather(*(event.wait() for event in started))
+        bytes_per_connection = (tracemalloc.get_traced_memory()[0] - before) / connections
+        tracemalloc.stop()
+
+        # Публикация из другого потока, как из синхронного обработчика запроса
+        broker = notifications.get_broker()
+        published = time.perf_counter()
+        await asyncio.to_thread(lambda: [
+            broker.dispatch(user_id, notifications.REQUEST_CREATED, {'user_id': 0, 'target_user_id': user_id})
+            for user_id in set(user_ids)
+        ])
+        while len(delivered) < connections and time.perf_counter() - published < 10:
+            await asyncio.sleep(0.001)
+        disconnect.set()
+        await asyncio.gather(*tasks)
+        return {
+            'connections': connections,
+            'bytes_per_connection': bytes_per_connection,
+            'delivered': len(delivered),
+            'delivery_ms': (max(delivered.values(), default=published) - published) * 1000,
+        }
+
+    return asyncio.run(run_streams())
@@ -0,0 +1,130 @@
+"""Кэш множеств связей пользователя (друзья, входящие и исходящие запросы).
+
+Множества хранятся как отсортированные массивы id (array('q')) в отдельном алиасе
+кэша Django (settings.FRIENDSHIP_CACHE_ALIAS). Размер и время жизни записей задаются
+настройками этого алиаса (MAX_ENTRIES, TIMEOUT), поэтому в тестах работает locmem,
+а в продакшене можно подключить общий бэкенд.
+
+Ключи включают relationship_version пользователя, которую каждая мутация в
+friendship.services увеличивает в своей транзакции. Записи не удаляются: после
+изменения читатели обращаются к ключу новой версии, а старые вытесняются по LRU и TTL.
+Версия читается до загрузки множества, а промахи загружаются из основной базы, поэтому
+под ключом версии лежат связи не старее этой версии, и запоздалая запись параллельного
+читателя попадает под уже неактуальный ключ. Пишущие транзакции читают связи своими
+запросами, а не через кэш, поэтому незакоммиченная версия в ключ не попадает.
+"""
+import threading
+from array import array
+from bisect import bisect_left
+from typing import Callable, Iterable
+
+from django.conf import settings
+from django.core.cache import caches
+
+from vk_internship.db.replicas import primary
+
+FRIENDS = 'friends'
+INCOMING = 'incoming'
+OUTGOING = 'outgoing'
+
+# Максимальное количество пользователей в одном запросе при пакетной загрузке
+LOAD_BATCH_SIZE = 500
+
+
+class CacheStats:
+    """Счётчики попаданий и промахов кэша в рамках процесса"""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+
+    def record(self, hit: bool):
+        with self._lock:
+            if hit:
+                self.hits += 1
+            else:
+                self.misses += 1
+
+    def record_many(self, hits: int, misses: int):
+        with self._lock:
+            self.hits += hits
+            self.misses += misses
+
+    def reset(self):
+        with self._lock:
+            self.hits = 0
+            self.misses = 0
+
+    def as_dict(self) -> dict:
+        total = self.hits + self.misses
+        return {
+            'hits': self.hits,
+            'misses': self.misses,
+            'hit_ratio': self.hits / total if total else 0.0,
+        }
+
+
+stats = CacheStats()
+
+
+def _cache():
+    return caches[settings.FRIENDSHIP_CACHE_ALIAS]
+
+
+def _key(kind: str, user_id: int, version: int) -> str:
+    return f'friendship:{kind}:{user_id}:{version}'
+
+
+def get_ids(kind: str, user_id: int, version: int | None, loader: Callable[[], Iterable[int]]) -> array:
+    """Отсортированный массив id связей пользователя версии связей version.
+
+    При промахе загружается через loader; без версии (пользователя нет) загружается мимо кэша.
+    """
+    key = _key(kind, user_id, version)
+    ids = _cache().get(key) if version is not None else None
+    stats.record(ids is not None)
+    if ids is None:
+        with primary():
+            ids = array('q', sorted(loader()))
+        if version is not None:
+            _cache().set(key, ids)
+    return ids
+
+
+def get_many_ids(kind: str, versions: dict[int, int | None],
+                 loader: Callable[[list[int]], Iterable[tuple[int, int]]]) -> dict[int, array]:
+    """Массивы id связей для нескольких пользователей по их версиям связей {user_id: version}.
+
+    Промахи загружаются через loader пачками по LOAD_BATCH_SIZE пользователей;
+    loader возвращает пары (user_id, id связи).
+    """
+    keys = {_key(kind, user_id, version): user_id for user_id, version in versions.items() if version is not None}
+    result = {keys[key]: ids for key, ids in _cache().get_many(keys).items()}
+    missing = [user_id for user_id in versions if user_id not in result]
+    stats.record_many(len(result), len(missing))
+
+    for start in range(0, len(missing), LOAD_BATCH_SIZE):
+        batch = missing[start:start + LOAD_BATCH_SIZE]
+        loaded = {user_id: [] for user_id in batch}
+        with primary():
+            for user_id, related_id in loader(batch):
+                loaded[user_id].append(related_id)
+        loaded = {user_id: array('q', sorted(ids)) for user_id, ids in loaded.items()}
+        _cache().set_many({
+            _key(kind, user_id, versions[user_id]): ids
+            for user_id, ids in loaded.items() if versions[user_id] is not None
+        })
+        result.update(loaded)
+    return result
+
+
+def contains(ids: array, value: int) -> bool:
+    """Проверка вхождения в отсортированный массив бинарным поиском"""
+    index = bisect_left(ids, value)
+    return index < len(ids) and ids[index] == value
+
+
+def clear():
+    _cache().clear()
+    stats.reset()
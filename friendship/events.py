@@ -0,0 +1,116 @@
+"""Журнал изменений связей (FriendshipEvent) для потребителей вне пути запроса.
+
+События описывают состояние пары после изменения: «запрос существует», «дружбы нет» и т.п.
+Потребитель применяет их идемпотентно, начиная с сохранённого курсора (номера последнего
+обработанного события), поэтому повторы и сжатие журнала не нарушают его состояние.
+
+Импорт графа и изменения на шардах пишут события известного типа (record). Изменения в основной
+базе (friendship.services) пишут их после коммита, вне пишущей транзакции (record_states): тип
+события определяется по состоянию пары в момент записи, поэтому события разных транзакций одной
+пары не описывают более старое состояние после более нового. Событие, не записанное из-за сбоя
+процесса между коммитом и записью, не восстанавливается: потребителю нужна полная пересинхронизация.
+"""
+from datetime import datetime
+
+from django.db import transaction
+from django.db.models import Exists, OuterRef
+
+from friendship.models import FriendRequests, Friendship, FriendshipEvent
+
+# Максимальное количество событий в одном ответе since()
+MAX_BATCH_SIZE = 10_000
+COMPACT_BATCH_SIZE = 10_000
+# Максимальное количество событий в одном UPDATE при записи состояний
+RECORD_BATCH_SIZE = 10_000
+
+_FAMILIES = (
+    (FriendshipEvent.Type.REQUEST_CREATED, FriendshipEvent.Type.REQUEST_DELETED),
+    (FriendshipEvent.Type.FRIENDSHIP_CREATED, FriendshipEvent.Type.FRIENDSHIP_DELETED),
+)
+
+
+def record(event_type: FriendshipEvent.Type, pairs):
+    """Запись событий event_type для пар (user_id, target_user_id) одним INSERT"""
+    FriendshipEvent.objects.bulk_create(
+        [FriendshipEvent(type=event_type, user_id=user_id, target_user_id=target_user_id) for user_id, target_user_id in pairs],
+    )
+
+
+def record_states(requests=(), friendships=()):
+    """Запись событий с состоянием запросов (request_from, request_to) и пар дружбы (user1 < user2) сейчас.
+
+    На семейство — вставка с типом «создан» и один UPDATE на «удалён» для пар, которых нет. Транзакция
+    начинается со вставки, которая блокирует запись до коммита, поэтому состояние между ними не меняется.
+    """
+    families = [
+        (family, model, columns, list(pairs))
+        for family, model, columns, pairs in zip(
+            _FAMILIES, (FriendRequests, Friendship), (('request_from', 'request_to'), ('user1', 'user2')),
+            (requests, friendships),
+        )
+        if pairs
+    ]
+    if not families:
+        return
+    with transaction.atomic():
+        for (created, deleted), model, (first, second), pairs in families:
+            ids = [event.id for event in FriendshipEvent.objects.bulk_create([
+                FriendshipEvent(type=created, user_id=user_id, target_user_id=target_user_id)
+                for user_id, target_user_id in pairs
+            ])]
+            exists = Exists(model.objects.filter(**{first: OuterRef('user_id'), second: OuterRef('target_user_id')}))
+            for start in range(0, len(ids), RECORD_BATCH_SIZE):
+                FriendshipEvent.objects.filter(id__in=ids[start:start + RECORD_BATCH_SIZE]).exclude(exists) \
+                    .update(type=deleted)
+
+
+def since(cursor: int, limit: int) -> tuple[list[dict], int, bool]:
+    """События с номером больше cursor: (события, новый курсор, есть ли ещё события)"""
+    rows = list(
+        FriendshipEvent.objects.filter(id__gt=cursor).order_by('id')
+        .values_list('id', 'type', 'user_id', 'target_user_id')[:limit + 1]
+    )
+    events = [
+        {
+            'sequence': sequence,
+            'type': FriendshipEvent.Type(event_type).name.lower(),
+            'user_id': user_id,
+            'target_user_id': target_user_id,
+        }
+        for sequence, event_type, user_id, target_user_id in rows[:limit]
+    ]
+    return events, events[-1]['sequence'] if events else cursor, len(rows) > limit
+
+
+def last_sequence() -> int:
+    """Номер последнего события (0, если журнал пуст)"""
+    return FriendshipEvent.objects.order_by('-id').values_list('id', flat=True).first() or 0
+
+
+def compact(before: datetime, batch_size: int = COMPACT_BATCH_SIZE) -> int:
+    """Сжатие журнала: из событий старше before удаляются те, после которых есть событие той же пары.
+
+    Последнее событие каждой пары остаётся, поэтому потребитель с любым курсором, включая 0,
+    приходит к тому же состоянию. Возвращает количество удалённых событий.
+    """
+    deleted = 0
+    start = 0
+    while True:
+        with transaction.atomic():
+            batch = list(FriendshipEvent.objects.filter(id__gt=start).order_by('id')
+                         .values_list('id', 'created_at')[:batch_size])
+            if not batch:
+                return deleted
+            end = batch[-1][0]
+            for family in _FAMILIES:
+                newer = FriendshipEvent.objects.filter(
+                    user_id=OuterRef('user_id'), target_user_id=OuterRef('target_user_id'),
+                    type__in=family, id__gt=OuterRef('id'),
+                )
+                deleted += FriendshipEvent.objects.filter(
+                    id__gt=start, id__lte=end, type__in=family, created_at__lt=before,
+                ).filter(Exists(newer)).delete()[0]
+        # События идут по времени: пачка, дошедшая до before, последняя
+        if batch[-1][1] >= before:
+            return deleted
+        start = end
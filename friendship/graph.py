@@ -0,0 +1,97 @@
+"""Операции над графом дружбы и отсортированными массивами id пользователей."""
+import time
+from array import array
+from bisect import bisect_left
+from typing import Callable, Iterable, NamedTuple
+
+
+def intersect_sorted(first, second) -> array:
+    """Пересечение двух отсортированных массивов id без повторов.
+
+    Если один массив намного меньше другого, элементы меньшего ищутся в большем
+    бинарным поиском (O(m log n)), иначе массивы сливаются линейно (O(m + n)).
+    """
+    if len(first) > len(second):
+        first, second = second, first
+    result = array('q')
+    if not first:
+        return result
+
+    if len(first) * max(len(second).bit_length(), 1) < len(first) + len(second):
+        low = 0
+        for value in first:
+            low = bisect_left(second, value, low)
+            if low == len(second):
+                break
+            if second[low] == value:
+                result.append(value)
+        return result
+
+    i = j = 0
+    while i < len(first) and j < len(second):
+        if first[i] < second[j]:
+            i += 1
+        elif first[i] > second[j]:
+            j += 1
+        else:
+            result.append(first[i])
+            i += 1
+            j += 1
+    return result
+
+
+class PathSearch(NamedTuple):
+    """Результат поиска пути: path — цепочка id от начала до цели или None, если пути не найдено;
+    exhausted — поиск остановлен бюджетом, и путь в пределах глубины может существовать"""
+    path: list[int] | None
+    exhausted: bool
+    visited: int
+
+
+def shortest_path(source: int, target: int, load_neighbors: Callable[[list[int]], dict[int, Iterable[int]]],
+                  max_depth: int, max_visited: int, deadline: float) -> PathSearch:
+    """Кратчайший путь двунаправленным поиском в ширину длиной не больше max_depth.
+
+    На каждом шаге расширяется меньший из двух фронтов; соседи всего фронта загружаются одним
+    вызовом load_neighbors. Поиск прекращается, если посещено больше max_visited пользователей
+    или наступил момент deadline (по time.monotonic()).
+    """
+    if source == target:
+        return PathSearch([source], False, 1)
+    # Для каждой стороны: пользователь -> от кого он достигнут
+    parents = ({source: None}, {target: None})
+    frontiers = ([source], [target])
+    for _ in range(max_depth):
+        side = 0 if len(frontiers[0]) <= len(frontiers[1]) else 1
+        own, other = parents[side], parents[1 - side]
+        neighbors = load_neighbors(frontiers[side])
+        frontier = []
+        for user_id in frontiers[side]:
+            for friend_id in neighbors[user_id]:
+                if friend_id in own:
+                    continue
+                own[friend_id] = user_id
+                if friend_id in other:
+                    forward, backward = (own, other) if side == 0 else (other, own)
+                    return PathSearch(_join(forward, backward, friend_id), False, len(own) + len(other))
+                frontier.append(friend_id)
+            if len(own) + len(other) > max_visited or time.monotonic() > deadline:
+                return PathSearch(None, True, len(own) + len(other))
+        if not frontier:
+            break
+        frontiers = (frontier, frontiers[1]) if side == 0 else (frontiers[0], frontier)
+    return PathSearch(None, False, len(parents[0]) + len(parents[1]))
+
+
+def _join(forward: dict, backward: dict, meeting: int) -> list[int]:
+    path = []
+    user_id = meeting
+    while user_id is not None:
+        path.append(user_id)
+        user_id = forward[user_id]
+    path.reverse()
+    user_id = backward[meeting]
+    while user_id is not None:
+        path.append(user_id)
+        user_id = backward[user_id]
+    return path
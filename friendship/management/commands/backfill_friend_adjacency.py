@@ -0,0 +1,36 @@
+from django.core.management.base import BaseCommand, CommandError
+from django.db import transaction
+
+from friendship import cache as relationship_cache, sharding
+from friendship.models import Friendship, FriendAdjacency
+
+
+class Command(BaseCommand):
+    help = 'Заполнение таблицы FriendAdjacency по существующим записям Friendship'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--batch-size', type=int, default=1000, help='Количество пар дружбы в одной транзакции')
+
+    def handle(self, *args, **options):
+        if sharding.enabled():
+            raise CommandError('Not supported with sharded relationships (SQLITE_SHARDS)')
+        batch_size = options['batch_size']
+        last_id = 0
+        total = 0
+        while True:
+            batch = list(
+                Friendship.objects.filter(id__gt=last_id).order_by('id').values_list('id', 'user1_id', 'user2_id')[:batch_size]
+            )
+            if not batch:
+                break
+            edges = []
+            for _, user1, user2 in batch:
+                edges.append(FriendAdjacency(owner_id=user1, friend_id=user2))
+                edges.append(FriendAdjacency(owner_id=user2, friend_id=user1))
+            with transaction.atomic():
+                FriendAdjacency.objects.bulk_create(edges, ignore_conflicts=True)
+            last_id = batch[-1][0]
+            total += len(batch)
+        # Списки друзей в кэше могли быть загружены из незаполненной таблицы
+        relationship_cache.clear()
+        self.stdout.write(self.style.SUCCESS(f'Processed {total} friendships'))
@@ -0,0 +1,101 @@
+import json
+from pathlib import Path
+
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection
+
+from friendship import bench, sharding
+
+
+class Command(BaseCommand):
+    help = 'Бенчмарк API на синтетическом графе дружбы во временной тестовой базе'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--users', type=int, default=10_000, help='Количество пользователей')
+        parser.add_argument('--average-degree', type=int, default=20, help='Средняя степень вершины графа')
+        parser.add_argument('--request-ratio', type=float, default=0.1, help='Доля связей, ставших запросами')
+        parser.add_argument('--calls', type=int, default=200, help='Количество вызовов каждого эндпоинта')
+        parser.add_argument('--route', action='append', dest='routes', help='Шаблон маршрута (можно несколько раз)')
+        parser.add_argument('--seed', type=int, default=0)
+        parser.add_argument('--serialization-rows', type=int, default=10_000,
+                            help='Количество пользователей в замере сериализации списков (0 — без замера)')
+        parser.add_argument('--output', help='Файл для JSON-результатов')
+        parser.add_argument('--concurrency', type=int, default=0,
+                            help='Сравнить sync и async стек при стольких одновременных медленных клиентах (0 — без замера)')
+        parser.add_argument('--sse-connections', type=int, default=0,
+                            help='Замерить стоимость стольких неактивных SSE-соединений (0 — без замера)')
+        parser.add_argument('--client-delay', type=float, default=20.0, help='Задержка медленного клиента, мс')
+        parser.add_argument('--wsgi-threads', type=int,
+                            help='Потоки sync-воркера в замере --concurrency (по умолчанию GUNICORN_THREADS)')
+        parser.add_argument('--baseline', help='JSON-результаты предыдущего прогона для сравнения')
+        parser.add_argument('--threshold', type=float, default=0.25,
+                            help='Допустимый относительный рост p95 и запросов на вызов')
+
+    def handle(self, *args, **options):
+        if sharding.enabled():
+            raise CommandError('Not supported with sharded relationships (SQLITE_SHARDS)')
+        if options['users'] < 2 or options['calls'] <= 0:
+            raise CommandError('--users must be at least 2 and --calls must be positive')
+        unknown = set(options['routes'] or ()) - bench.SCENARIOS.keys()
+        if unknown:
+            raise CommandError(f'unknown routes: {", ".join(sorted(unknown))}')
+        baseline = None
+        if options['baseline']:
+            baseline = json.loads(Path(options['baseline']).read_text())['endpoints']
+
+        config = {name: options[name] for name in ('users', 'average_degree', 'request_ratio', 'calls', 'seed')}
+        # Рабочая база не затрагивается: граф создаётся в тестовой базе, которая удаляется в конце
+        old_name = connection.creation.create_test_db(verbosity=0, autoclobber=True, serialize=False)
+        try:
+            state = bench.generate(options['users'], options['average_degree'], options['request_ratio'], options['seed'])
+            self.stdout.write(f'Generated {len(state.user_ids)} users, {len(state.friendships)} friendships, '
+                              f'{len(state.requests)} requests')
+            serialization = None
+            if options['serialization_rows']:
+                serialization = bench.measure_serialization(options['serialization_rows'])
+            concurrency = None
+            if options['concurrency']:
+                concurrency = bench.measure_concurrency(state, options['concurrency'],
+                                                        client_delay_ms=options['client_delay'],
+                                                        threads=options['wsgi_threads'])
+            streams = None
+            if options['sse_connections']:
+                streams = bench.measure_notification_streams(state, options['sse_connections'])
+            results = bench.run(state, options['calls'], options['routes'])
+        finally:
+            connection.creation.destroy_test_db(old_name, verbosity=0)
+
+        for route, result in results.items():
+            self.stdout.write(
+                f'{route}: {result["throughput_rps"]:.0f} rps, p50 {result["p50_ms"]:.2f} ms, '
+                f'p95 {result["p95_ms"]:.2f} ms, p99 {result["p99_ms"]:.2f} ms, '
+                f'{result["queries_per_call"]:.2f} queries/call, {result["errors"]} errors'
+            )
+        if serialization is not None:
+            self.stdout.write(
+                f'serialization of {serialization["rows"]} users: '
+                f'ModelSerializer {serialization["model_serializer_ms"]:.1f} ms, '
+                f'values() + FastJSONRenderer {serialization["values_orjson_ms"]:.1f} ms'
+            )
+        if concurrency is not None:
+            for mode, result in concurrency.items():
+                threads = f' ({result["threads"]} threads)' if 'threads' in result else ''
+                self.stdout.write(f'{mode} stack{threads}, {options["concurrency"]} slow clients: '
+                                  f'{result["throughput_rps"]:.0f} rps, {result["errors"]} errors')
+        if streams is not None:
+            self.stdout.write(
+                f'SSE: {streams["connections"]} idle connections, {streams["bytes_per_connection"]:.0f} bytes each, '
+                f'{streams["delivered"]} notified in {streams["delivery_ms"]:.1f} ms'
+            )
+        if options['output']:
+            Path(options['output']).write_text(json.dumps(
+                {'config': config, 'endpoints': results, 'serialization': serialization, 'concurrency': concurrency,
+                 'notification_streams': streams},
+                indent=2,
+            ))
+
+        if baseline is not None:
+            regressions = bench.compare(results, baseline, options['threshold'])
+            if regressions:
+                raise CommandError('Performance regressions:\n' + '\n'.join(regressions))
+            self.stdout.write(self.style.SUCCESS(f'No regressions against {options["baseline"]}'))
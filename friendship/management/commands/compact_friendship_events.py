@@ -0,0 +1,25 @@
+from datetime import timedelta
+
+from django.core.management.base import BaseCommand, CommandError
+from django.utils import timezone
+
+from friendship import events
+
+
+class Command(BaseCommand):
+    help = 'Сжатие журнала изменений связей: у старых событий остаётся только последнее событие каждой пары'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--older-than-days', type=float, default=7,
+                            help='Сжимать только события старше N дней; более новые хранятся полностью')
+        parser.add_argument('--batch-size', type=int, default=events.COMPACT_BATCH_SIZE,
+                            help='Количество событий в одной транзакции')
+
+    def handle(self, *args, **options):
+        if options['older_than_days'] < 0:
+            raise CommandError('--older-than-days must not be negative')
+        if options['batch_size'] <= 0:
+            raise CommandError('--batch-size must be positive')
+        before = timezone.now() - timedelta(days=options['older_than_days'])
+        deleted = events.compact(before, options['batch_size'])
+        self.stdout.write(self.style.SUCCESS(f'Deleted {deleted} superseded events'))
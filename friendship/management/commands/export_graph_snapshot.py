@@ -0,0 +1,28 @@
+import time
+
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+
+from friendship import sharding, snapshot
+
+
+class Command(BaseCommand):
+    help = 'Экспорт графа дружбы в CSR-снимок для чтения через mmap'
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--output', default=None,
+            help='Путь к файлу снимка (по умолчанию settings.FRIENDSHIP_GRAPH_SNAPSHOT_PATH)',
+        )
+
+    def handle(self, *args, **options):
+        if sharding.enabled():
+            raise CommandError('Not supported with sharded relationships (SQLITE_SHARDS)')
+        path = options['output'] or settings.FRIENDSHIP_GRAPH_SNAPSHOT_PATH
+        if path is None:
+            raise CommandError('Specify --output or FRIENDSHIP_GRAPH_SNAPSHOT_PATH')
+        started = time.monotonic()
+        node_count, edge_count = snapshot.export(path)
+        self.stdout.write(self.style.SUCCESS(
+            f'Exported {edge_count} friendships ({node_count} nodes) to {path} in {time.monotonic() - started:.2f}s'
+        ))
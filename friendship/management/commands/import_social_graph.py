@@ -0,0 +1,231 @@
+import csv
+import json
+import time
+from contextlib import contextmanager
+from itertools import islice
+from pathlib import Path
+
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection, transaction
+
+from friendship import cache as relationship_cache, events, sharding
+from friendship.models import Friendship, FriendAdjacency, FriendRequests, FriendshipEvent
+from friendship.services import repair_counters
+from user.models import User
+
+
+# Максимальное количество параметров в одном условии IN
+IN_BATCH_SIZE = 500
+
+
+def _in_batches(values):
+    values = list(values)
+    for start in range(0, len(values), IN_BATCH_SIZE):
+        yield values[start:start + IN_BATCH_SIZE]
+
+
+class Command(BaseCommand):
+    help = 'Потоковый импорт пользователей, дружбы и запросов на дружбу из CSV или NDJSON файлов'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--users', help='Файл пользователей (поля id, username)')
+        parser.add_argument('--friendships', help='Файл пар друзей (поля user1, user2)')
+        parser.add_argument('--requests', help='Файл запросов на дружбу (поля request_from, request_to)')
+        parser.add_argument(
+            '--format', choices=('auto', 'csv', 'ndjson'), default='auto',
+            help='Формат файлов (auto — по расширению: .csv или .ndjson/.jsonl)',
+        )
+        parser.add_argument('--chunk-size', type=int, default=5000, help='Количество строк в одной транзакции')
+        parser.add_argument(
+            '--defer-indexes', action='store_true',
+            help='Удалить индексы из Meta.indexes моделей (friendrequests_incoming_idx) на время импорта и создать '
+                 'их заново в конце; индексы ограничений уникальности и полей с db_index остаются',
+        )
+
+    def handle(self, *args, **options):
+        if sharding.enabled():
+            raise CommandError('Not supported with sharded relationships (SQLITE_SHARDS)')
+        if not any(options[name] for name in ('users', 'friendships', 'requests')):
+            raise CommandError('At least one of --users, --friendships, --requests must be specified')
+        if options['chunk_size'] <= 0:
+            raise CommandError('--chunk-size must be positive')
+        self.chunk_size = options['chunk_size']
+        self.file_format = options['format']
+
+        with self._deferred_indexes(options['defer_indexes']):
+            if options['users']:
+                self._import(options['users'], 'users', self._import_users)
+            if options['friendships']:
+                self._import(options['friendships'], 'friendships', self._import_friendships)
+            if options['requests']:
+                self._import(options['requests'], 'requests', self._import_requests)
+        # Импорт пишет в таблицы связей напрямую, счётчики пересчитываются целиком
+        self.stdout.write(f'Repaired counters of {repair_counters()} users')
+        relationship_cache.clear()
+        self.stdout.write('Run rebuild_recommendations to recompute friend recommendations for imported users')
+
+    def _import(self, path: str, name: str, import_chunk):
+        started = time.monotonic()
+        total = valid = inserted = 0
+        rows = self._read(path)
+        while chunk := list(islice(rows, self.chunk_size)):
+            with transaction.atomic():
+                # bulk_create с ignore_conflicts не сообщает, сколько строк отсечено: import_chunk читает
+                # существующие строки до вставки и возвращает (корректных строк, вставленных строк)
+                chunk_valid, chunk_inserted = import_chunk(chunk)
+            valid += chunk_valid
+            inserted += chunk_inserted
+            total += len(chunk)
+        elapsed = time.monotonic() - started
+        self.stdout.write(self.style.SUCCESS(
+            f'{name}: {total} rows read, {valid} valid, {inserted} inserted, {total - valid} skipped '
+            f'in {elapsed:.2f}s ({total / elapsed if elapsed else total:.0f} rows/s)'
+        ))
+
+    def _read(self, path: str):
+        file_format = self.file_format
+        if file_format == 'auto':
+            suffix = Path(path).suffix.lower()
+            file_format = 'csv' if suffix == '.csv' else 'ndjson' if suffix in ('.ndjson', '.jsonl') else None
+            if file_format is None:
+                raise CommandError(f'Cannot detect format of {path}, use --format')
+        try:
+            with open(path, newline='', encoding='utf-8') as file:
+                if file_format == 'csv':
+                    yield from csv.DictReader(file)
+                else:
+                    for line in file:
+                        if line.strip():
+                            yield json.loads(line)
+        except (OSError, ValueError) as error:
+            raise CommandError(f'Cannot read {path}: {error}')
+
+    @staticmethod
+    def _pairs(chunk, first: str, second: str) -> list[tuple[int, int]]:
+        pairs = []
+        for row in chunk:
+            try:
+                pair = int(row[first]), int(row[second])
+            except (KeyError, TypeError, ValueError):
+                continue
+            if pair[0] != pair[1]:
+                pairs.append(pair)
+        return pairs
+
+    @staticmethod
+    def _existing_users(pairs) -> set[int]:
+        user_ids = {user_id for pair in pairs for user_id in pair}
+        existing = set()
+        for batch in _in_batches(user_ids):
+            existing.update(User.objects.filter(id__in=batch).values_list('id', flat=True))
+        return existing
+
+    @staticmethod
+    def _existing_pairs(model, pairs, first: str, second: str) -> set[tuple[int, int]]:
+        """Пары (first, second) из pairs, которые уже есть в таблице model"""
+        existing = set()
+        for batch in _in_batches(pairs):
+            batch_pairs = set(batch)
+            existing.update(
+                pair for pair in model.objects
+                .filter(**{f'{first}__in': {item[0] for item in batch}, f'{second}__in': {item[1] for item in batch}})
+                .values_list(first, second)
+                if pair in batch_pairs
+            )
+        return existing
+
+    def _import_users(self, chunk) -> tuple[int, int]:
+        users = []
+        for row in chunk:
+            try:
+                user_id, username = int(row['id']), str(row['username']).strip()
+            except (KeyError, TypeError, ValueError):
+                continue
+            if user_id > 0 and 0 < len(username) <= User._meta.get_field('username').max_length:
+                users.append(User(id=user_id, username=username,
+                                  username_normalized=User.normalize_username(username)))
+        new_ids = {user.id for user in users}
+        for batch in _in_batches(new_ids):
+            new_ids.difference_update(User.objects.filter(id__in=batch).values_list('id', flat=True))
+        User.objects.bulk_create(users, ignore_conflicts=True)
+        return len(users), len(new_ids)
+
+    def _import_friendships(self, chunk) -> tuple[int, int]:
+        pairs = self._pairs(chunk, 'user1', 'user2')
+        existing = self._existing_users(pairs)
+        pairs = {Friendship.ordered(*pair) for pair in pairs if pair[0] in existing and pair[1] in existing}
+        inserted = len(pairs - self._existing_pairs(Friendship, pairs, 'user1', 'user2'))
+        Friendship.objects.bulk_create(
+            [Friendship(user1_id=user1, user2_id=user2) for user1, user2 in pairs], ignore_conflicts=True,
+        )
+        FriendAdjacency.objects.bulk_create(
+            [
+                FriendAdjacency(owner_id=owner, friend_id=friend)
+                for user1, user2 in pairs
+                for owner, friend in ((user1, user2), (user2, user1))
+            ],
+            ignore_conflicts=True,
+        )
+        # После вставки все пары существуют, даже отсечённые как повторы
+        events.record(FriendshipEvent.Type.FRIENDSHIP_CREATED, pairs)
+        # Запрос между друзьями не имеет смысла: ожидающие запросы этих пар удаляются
+        stale = {}
+        for batch in _in_batches(pairs):
+            batch_users = {user_id for pair in batch for user_id in pair}
+            batch_pairs = set(batch)
+            requests = FriendRequests.objects.filter(request_from__in=batch_users, request_to__in=batch_users) \
+                .values_list('id', 'request_from', 'request_to')
+            stale.update(
+                (request_id, (request_from, request_to)) for request_id, request_from, request_to in requests
+                if Friendship.ordered(request_from, request_to) in batch_pairs
+            )
+        for batch in _in_batches(stale):
+            FriendRequests.objects.filter(id__in=batch).delete()
+        events.record(FriendshipEvent.Type.REQUEST_DELETED, list(stale.values()))
+        return len(pairs), inserted
+
+    def _import_requests(self, chunk) -> tuple[int, int]:
+        pairs = self._pairs(chunk, 'request_from', 'request_to')
+        existing = self._existing_users(pairs)
+        # Порядок файла сохраняется: из встречных запросов остаётся первый
+        pairs = list(dict.fromkeys(pair for pair in pairs if pair[0] in existing and pair[1] in existing))
+        # Запрос между друзьями не имеет смысла
+        friends = set()
+        for batch in _in_batches({Friendship.ordered(*pair) for pair in pairs}):
+            friends.update(
+                Friendship.objects
+                .filter(user1__in={user1 for user1, _ in batch}, user2__in={user2 for _, user2 in batch})
+                .values_list('user1', 'user2')
+            )
+        requests = [
+            FriendRequests(request_from_id=request_from, request_to_id=request_to)
+            for request_from, request_to in pairs
+            if Friendship.ordered(request_from, request_to) not in friends
+        ]
+        pairs = [(request.request_from_id, request.request_to_id) for request in requests]
+        before = self._existing_pairs(FriendRequests, pairs, 'request_from', 'request_to')
+        # Повторы и встречные запросы отсекаются ограничениями уникальности
+        FriendRequests.objects.bulk_create(requests, ignore_conflicts=True)
+        # События пишутся только для запросов, которые есть в таблице после вставки
+        created = self._existing_pairs(FriendRequests, pairs, 'request_from', 'request_to')
+        events.record(FriendshipEvent.Type.REQUEST_CREATED, [pair for pair in pairs if pair in created])
+        return len(requests), len(created - before)
+
+    @contextmanager
+    def _deferred_indexes(self, enabled: bool):
+        indexes = [(model, index) for model in (User, FriendAdjacency, FriendRequests) for index in model._meta.indexes]
+        if not enabled or not indexes:
+            yield
+            return
+        # Создание и удаление индекса — одиночные CREATE/DROP INDEX без пересборки таблиц, поэтому
+        # редактор схемы используется без контекстного менеджера (в SQLite он требует отключения проверки FK)
+        schema_editor = connection.schema_editor(atomic=False)
+        for model, index in indexes:
+            schema_editor.remove_index(model, index)
+        try:
+            yield
+        finally:
+            started = time.monotonic()
+            for model, index in indexes:
+                schema_editor.add_index(model, index)
+            self.stdout.write(f'Recreated {len(indexes)} indexes in {time.monotonic() - started:.2f}s')
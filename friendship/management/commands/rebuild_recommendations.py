@@ -0,0 +1,39 @@
+from django.core.management.base import BaseCommand
+
+from friendship import recommendations
+from user.models import User
+
+
+class Command(BaseCommand):
+    help = 'Пересчёт top-K рекомендаций друзей для всех, указанных или пользователей с неточной выдачей'
+
+    def add_arguments(self, parser):
+        parser.add_argument('user_ids', nargs='*', type=int, help='ID пользователей (по умолчанию все)')
+        parser.add_argument('--stale', action='store_true',
+                            help='Только структуры, выдача которых стала неточной после изменений дружбы')
+        parser.add_argument('--batch-size', type=int, default=500, help='Количество пользователей в одной пачке')
+
+    def handle(self, *args, **options):
+        batch_size = options['batch_size']
+        user_ids = options['user_ids']
+        if options['stale']:
+            batches = recommendations.stale_user_ids(batch_size)
+        elif user_ids:
+            batches = (user_ids[start:start + batch_size] for start in range(0, len(user_ids), batch_size))
+        else:
+            batches = self._all_user_ids(batch_size)
+
+        total = 0
+        for batch in batches:
+            total += recommendations.rebuild(batch)
+        self.stdout.write(self.style.SUCCESS(f'Rebuilt recommendations for {total} users'))
+
+    @staticmethod
+    def _all_user_ids(batch_size: int):
+        last_id = 0
+        while True:
+            batch = list(User.objects.filter(id__gt=last_id).order_by('id').values_list('id', flat=True)[:batch_size])
+            if not batch:
+                return
+            yield batch
+            last_id = batch[-1]
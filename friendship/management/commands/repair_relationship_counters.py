@@ -0,0 +1,16 @@
+from django.core.management.base import BaseCommand, CommandError
+
+from friendship.services import repair_counters
+
+
+class Command(BaseCommand):
+    help = 'Пересчёт счётчиков друзей и запросов пользователей по таблицам связей'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--batch-size', type=int, default=1000, help='Количество пользователей в одной транзакции')
+
+    def handle(self, *args, **options):
+        if options['batch_size'] <= 0:
+            raise CommandError('--batch-size must be positive')
+        repaired = repair_counters(options['batch_size'])
+        self.stdout.write(self.style.SUCCESS(f'Repaired counters of {repaired} users'))
@@ -0,0 +1,23 @@
+from django.core.management.base import BaseCommand, CommandError
+
+from friendship import cache as relationship_cache, sharding
+from friendship.services import repair_counters
+
+
+class Command(BaseCommand):
+    help = 'Восстановление зеркальных копий пар на шардах и счётчиков пользователей после сбоя между записями'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--batch-size', type=int, default=1000,
+                            help='Количество пользователей в одной транзакции пересчёта счётчиков')
+
+    def handle(self, *args, **options):
+        if not sharding.enabled():
+            raise CommandError('No shards configured, set SQLITE_SHARDS')
+        if options['batch_size'] <= 0:
+            raise CommandError('--batch-size must be positive')
+        pairs = sharding.find_diverged_pairs()
+        sharding.sync_pairs(pairs)
+        relationship_cache.clear()
+        repaired = repair_counters(options['batch_size'])
+        self.stdout.write(self.style.SUCCESS(f'Repaired {len(pairs)} pairs and counters of {repaired} users'))
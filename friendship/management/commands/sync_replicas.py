@@ -0,0 +1,40 @@
+import sqlite3
+import time
+
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+from django.db import DEFAULT_DB_ALIAS, connections
+
+
+def sync_replicas(aliases) -> None:
+    """Копирование основной базы в файлы реплик через SQLite online backup (согласованный снимок)"""
+    source = connections[DEFAULT_DB_ALIAS]
+    source.ensure_connection()
+    for alias in aliases:
+        connections[alias].close()
+        target = sqlite3.connect(connections[alias].settings_dict['NAME'],
+                                 timeout=connections[alias].settings_dict['OPTIONS'].get('timeout', 5))
+        try:
+            source.connection.backup(target)
+        finally:
+            target.close()
+
+
+class Command(BaseCommand):
+    help = 'Копирование основной SQLite-базы в реплики из settings.DATABASE_REPLICAS (локальная имитация репликации)'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--interval', type=float, default=0,
+                            help='Повторять копирование каждые N секунд (отставание реплик до N секунд)')
+
+    def handle(self, *args, **options):
+        if not settings.DATABASE_REPLICAS:
+            raise CommandError('No replicas configured, set SQLITE_REPLICAS')
+        if options['interval'] < 0:
+            raise CommandError('--interval must not be negative')
+        while True:
+            sync_replicas(settings.DATABASE_REPLICAS)
+            self.stdout.write(self.style.SUCCESS(f'Synced {len(settings.DATABASE_REPLICAS)} replicas'))
+            if not options['interval']:
+                return
+            time.sleep(options['interval'])
@@ -0,0 +1,39 @@
+# Generated by Django 4.2.1 on 2026-10-17 10:00
+
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+class Migration(migrations.Migration):
+
+    initial = True
+
+    dependencies = [
+        ('user', '0001_initial'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='Friendship',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('user1', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='user1', to='user.user')),
+                ('user2', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='user2', to='user.user')),
+            ],
+            options={
+                'verbose_name': 'Friends',
+            },
+        ),
+        migrations.CreateModel(
+            name='FriendRequests',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('request_from', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='request_from', to='user.user', verbose_name='Friendship request from')),
+                ('request_to', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='request_to', to='user.user', verbose_name='Friendship request for')),
+            ],
+            options={
+                'verbose_name': 'Friend requests',
+                'unique_together': {('request_from', 'request_to'), ('request_to', 'request_from')},
+            },
+        ),
+    ]
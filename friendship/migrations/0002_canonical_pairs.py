@@ -0,0 +1,102 @@
+# Generated by Django 4.2.1 on 2026-10-17 10:00
+
+from django.db import migrations, models
+import django.db.models.deletion
+import django.db.models.functions.comparison
+
+
+def canonicalize_pairs(apps, schema_editor):
+    """Приведение существующих записей к каноническому виду перед добавлением ограничений.
+
+    Дружба: удаляются петли и дубликаты пары, оставшиеся записи разворачиваются так, чтобы user1 < user2.
+    Запросы: удаляются запросы самому себе, встречные запросы превращаются в дружбу (как в send_request),
+    удаляются запросы между уже дружащими пользователями.
+    """
+    Friendship = apps.get_model('friendship', 'Friendship')
+    FriendRequests = apps.get_model('friendship', 'FriendRequests')
+
+    Friendship.objects.filter(user1=models.F('user2')).delete()
+    FriendRequests.objects.filter(request_from=models.F('request_to')).delete()
+
+    pairs = set()
+    duplicates = []
+    for pk, user1, user2 in Friendship.objects.order_by('id').values_list('id', 'user1_id', 'user2_id').iterator():
+        pair = (min(user1, user2), max(user1, user2))
+        if pair in pairs:
+            duplicates.append(pk)
+        else:
+            pairs.add(pair)
+    for start in range(0, len(duplicates), 500):
+        Friendship.objects.filter(id__in=duplicates[start:start + 500]).delete()
+
+    for friendship in Friendship.objects.filter(user1__gt=models.F('user2')).iterator():
+        friendship.user1_id, friendship.user2_id = friendship.user2_id, friendship.user1_id
+        friendship.save(update_fields=('user1', 'user2'))
+
+    requests = set(FriendRequests.objects.values_list('request_from_id', 'request_to_id').iterator())
+    for request_from, request_to in requests:
+        if request_from < request_to and (request_to, request_from) in requests:
+            if (request_from, request_to) not in pairs:
+                Friendship.objects.create(user1_id=request_from, user2_id=request_to)
+                pairs.add((request_from, request_to))
+            FriendRequests.objects.filter(
+                models.Q(request_from=request_from, request_to=request_to)
+                | models.Q(request_from=request_to, request_to=request_from)
+            ).delete()
+        elif (min(request_from, request_to), max(request_from, request_to)) in pairs:
+            FriendRequests.objects.filter(request_from=request_from, request_to=request_to).delete()
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('user', '0001_initial'),
+        ('friendship', '0001_initial'),
+    ]
+
+    operations = [
+        migrations.AlterUniqueTogether(
+            name='friendrequests',
+            unique_together=set(),
+        ),
+        migrations.AlterField(
+            model_name='friendrequests',
+            name='request_from',
+            field=models.ForeignKey(db_index=False, on_delete=django.db.models.deletion.CASCADE, related_name='request_from', to='user.user', verbose_name='Friendship request from'),
+        ),
+        migrations.AlterField(
+            model_name='friendrequests',
+            name='request_to',
+            field=models.ForeignKey(db_index=False, on_delete=django.db.models.deletion.CASCADE, related_name='request_to', to='user.user', verbose_name='Friendship request for'),
+        ),
+        migrations.AlterField(
+            model_name='friendship',
+            name='user1',
+            field=models.ForeignKey(db_index=False, on_delete=django.db.models.deletion.CASCADE, related_name='user1', to='user.user'),
+        ),
+        migrations.RunPython(canonicalize_pairs, migrations.RunPython.noop),
+        migrations.AddIndex(
+            model_name='friendrequests',
+            index=models.Index(fields=['request_to', 'request_from'], name='friendrequests_incoming_idx'),
+        ),
+        migrations.AddConstraint(
+            model_name='friendrequests',
+            constraint=models.UniqueConstraint(fields=('request_from', 'request_to'), name='friendrequests_unique_direction'),
+        ),
+        migrations.AddConstraint(
+            model_name='friendrequests',
+            constraint=models.UniqueConstraint(django.db.models.functions.comparison.Least('request_from', 'request_to'), django.db.models.functions.comparison.Greatest('request_from', 'request_to'), name='friendrequests_unique_pair'),
+        ),
+        migrations.AddConstraint(
+            model_name='friendrequests',
+            constraint=models.CheckConstraint(check=models.Q(('request_from', models.F('request_to')), _negated=True), name='friendrequests_not_self'),
+        ),
+        migrations.AddConstraint(
+            model_name='friendship',
+            constraint=models.UniqueConstraint(fields=('user1', 'user2'), name='friendship_unique_pair'),
+        ),
+        migrations.AddConstraint(
+            model_name='friendship',
+            constraint=models.CheckConstraint(check=models.Q(('user1__lt', models.F('user2'))), name='friendship_canonical_order'),
+        ),
+    ]
@@ -0,0 +1,30 @@
+# Generated by Django 4.2.1 on 2026-10-17 10:01
+
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('user', '0001_initial'),
+        ('friendship', '0002_canonical_pairs'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='FriendAdjacency',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('friend', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='friend_of', to='user.user')),
+                ('owner', models.ForeignKey(db_index=False, on_delete=django.db.models.deletion.CASCADE, related_name='friend_edges', to='user.user')),
+            ],
+            options={
+                'verbose_name': 'Friend adjacency',
+            },
+        ),
+        migrations.AddConstraint(
+            model_name='friendadjacency',
+            constraint=models.UniqueConstraint(fields=('owner', 'friend'), name='friendadjacency_unique_edge'),
+        ),
+    ]
@@ -0,0 +1,26 @@
+# Generated by Django 4.2.1 on 2026-10-17 10:07
+
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('user', '0001_initial'),
+        ('friendship', '0003_friend_adjacency'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='FriendRecommendations',
+            fields=[
+                ('user', models.OneToOneField(on_delete=django.db.models.deletion.CASCADE, primary_key=True, related_name='recommendations', serialize=False, to='user.user')),
+                ('candidates', models.JSONField(default=list)),
+                ('threshold', models.PositiveIntegerField(default=0)),
+            ],
+            options={
+                'verbose_name': 'Friend recommendations',
+            },
+        ),
+    ]
@@ -0,0 +1,39 @@
+from django.db import migrations
+from django.db.models import Count
+
+
+def fill_counters(apps, schema_editor):
+    """Начальное заполнение счётчиков по существующим связям"""
+    User = apps.get_model('user', 'User')
+    Friendship = apps.get_model('friendship', 'Friendship')
+    FriendRequests = apps.get_model('friendship', 'FriendRequests')
+
+    def counts(model, field):
+        return dict(model.objects.order_by().values_list(field).annotate(count=Count('*')))
+
+    friends = counts(Friendship, 'user1')
+    for user_id, count in counts(Friendship, 'user2').items():
+        friends[user_id] = friends.get(user_id, 0) + count
+    incoming = counts(FriendRequests, 'request_to')
+    outgoing = counts(FriendRequests, 'request_from')
+
+    users = [
+        User(id=user_id, friends_count=friends.get(user_id, 0),
+             incoming_requests_count=incoming.get(user_id, 0), outgoing_requests_count=outgoing.get(user_id, 0))
+        for user_id in friends.keys() | incoming.keys() | outgoing.keys()
+    ]
+    User.objects.bulk_update(
+        users, ['friends_count', 'incoming_requests_count', 'outgoing_requests_count'], batch_size=500,
+    )
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('user', '0002_relationship_counters'),
+        ('friendship', '0004_friend_recommendations'),
+    ]
+
+    operations = [
+        migrations.RunPython(fill_counters, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,28 @@
+# Generated by Django 4.2.1 on 2026-10-17 10:35
+
+from django.db import migrations, models
+import django.utils.timezone
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('friendship', '0005_fill_relationship_counters'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='FriendshipEvent',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('type', models.PositiveSmallIntegerField(choices=[(1, 'Request Created'), (2, 'Request Deleted'), (3, 'Friendship Created'), (4, 'Friendship Deleted')])),
+                ('user_id', models.PositiveBigIntegerField()),
+                ('target_user_id', models.PositiveBigIntegerField()),
+                ('created_at', models.DateTimeField(default=django.utils.timezone.now)),
+            ],
+            options={
+                'verbose_name': 'Friendship event',
+                'indexes': [models.Index(fields=['user_id', 'target_user_id'], name='friendshipevent_pair_idx')],
+            },
+        ),
+    ]
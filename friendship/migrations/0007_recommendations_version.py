@@ -0,0 +1,23 @@
+# Generated by Django 4.2.1 on 2026-10-17 11:06
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('friendship', '0006_friendship_events'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='friendrecommendations',
+            name='exact',
+            field=models.BooleanField(default=False),
+        ),
+        migrations.AddField(
+            model_name='friendrecommendations',
+            name='version',
+            field=models.PositiveIntegerField(default=0),
+        ),
+    ]
@@ -1,21 +1,107 @@
 from enum import Enum
 
 from django.db import models
+from django.db.models import F, Q
+from django.db.models.functions import Greatest, Least
+from django.utils import timezone
 
 from user.models import User
 
 
 class Friendship(models.Model):
-    """Модель для хранения дружеских отношений."""
-    user1 = models.ForeignKey(User, on_delete=models.CASCADE, related_name='user1')
+    """Модель для хранения дружеских отношений.
+
+    Каждая пара хранится один раз в каноническом порядке (user1 < user2),
+    поэтому проверка дружбы — это один поиск по уникальному индексу.
+    """
+    user1 = models.ForeignKey(User, on_delete=models.CASCADE, related_name='user1', db_index=False)
     user2 = models.ForeignKey(User, on_delete=models.CASCADE, related_name='user2')
 
     class Meta:
         verbose_name = 'Friends'
+        constraints = [
+            models.UniqueConstraint(fields=('user1', 'user2'), name='friendship_unique_pair'),
+            models.CheckConstraint(check=Q(user1__lt=F('user2')), name='friendship_canonical_order'),
+        ]
 
     def __str__(self):
         return f'{self.user1} - {self.user2}'
 
+    @staticmethod
+    def ordered(user1: int, user2: int) -> tuple[int, int]:
+        """Приведение пары пользователей к каноническому порядку"""
+        return (user1, user2) if user1 < user2 else (user2, user1)
+
+
+class FriendAdjacency(models.Model):
+    """Денормализованный список друзей: по одной записи на каждое направление дружбы.
+
+    Составной уникальный индекс (owner, friend) покрывает выборку друзей пользователя,
+    поэтому список друзей читается одним диапазонным сканированием индекса.
+    Синхронизируется с Friendship в тех же транзакциях (см. friendship.services).
+    """
+    owner = models.ForeignKey(User, on_delete=models.CASCADE, related_name='friend_edges', db_index=False)
+    friend = models.ForeignKey(User, on_delete=models.CASCADE, related_name='friend_of')
+
+    class Meta:
+        verbose_name = 'Friend adjacency'
+        constraints = [
+            models.UniqueConstraint(fields=('owner', 'friend'), name='friendadjacency_unique_edge'),
+        ]
+
+    def __str__(self):
+        return f'{self.owner} -> {self.friend}'
+
+
+class FriendRecommendations(models.Model):
+    """Top-K кандидатов в друзья пользователя по количеству общих друзей (см. friendship.recommendations)."""
+    user = models.OneToOneField(User, on_delete=models.CASCADE, primary_key=True, related_name='recommendations')
+    # Пары [candidate_id, score], отсортированные по убыванию score
+    candidates = models.JSONField(default=list)
+    # Верхняя граница score для кандидатов, не вошедших в candidates
+    threshold = models.PositiveIntegerField(default=0)
+    # candidates посчитаны целиком и с тех пор не менялись
+    exact = models.BooleanField(default=False)
+    # Увеличивается при каждой записи; обновление начинается с неё, чтобы заблокировать строки до коммита
+    version = models.PositiveIntegerField(default=0)
+
+    class Meta:
+        verbose_name = 'Friend recommendations'
+
+    def __str__(self):
+        return f'{self.user}: {len(self.candidates)} candidates'
+
+
+class FriendshipEvent(models.Model):
+    """Журнал изменений связей, в который только добавляются записи (см. friendship.events).
+
+    id — номер события: SQLite выполняет пишущие транзакции по одной, а AUTOINCREMENT не использует
+    номера повторно, поэтому закоммиченные события видны строго в порядке возрастания id.
+    """
+
+    class Type(models.IntegerChoices):
+        REQUEST_CREATED = 1
+        REQUEST_DELETED = 2
+        FRIENDSHIP_CREATED = 3
+        FRIENDSHIP_DELETED = 4
+
+    type = models.PositiveSmallIntegerField(choices=Type.choices)
+    # Запрос: отправитель и получатель; дружба: пара в каноническом порядке.
+    # Без внешних ключей: журнал не зависит от удаления пользователей
+    user_id = models.PositiveBigIntegerField()
+    target_user_id = models.PositiveBigIntegerField()
+    created_at = models.DateTimeField(default=timezone.now)
+
+    class Meta:
+        verbose_name = 'Friendship event'
+        indexes = [
+            # Поиск более поздних событий той же пары при сжатии журнала
+            models.Index(fields=('user_id', 'target_user_id'), name='friendshipevent_pair_idx'),
+        ]
+
+    def __str__(self):
+        return f'#{self.id} {self.Type(self.type).name} {self.user_id} {self.target_user_id}'
+
 
 class FriendRequests(models.Model):
     """Модель для хранения запросов на дружбу между пользователями."""
@@ -28,12 +114,27 @@ class FriendRequests(models.Model):
         ALREADY_FRIENDS = "Already friends"
 
     request_from = models.ForeignKey(
-        User, on_delete=models.CASCADE, related_name='request_from', verbose_name='Friendship request from'
+        User, on_delete=models.CASCADE, related_name='request_from', verbose_name='Friendship request from',
+        db_index=False,
     )
     request_to = models.ForeignKey(
-        User, on_delete=models.CASCADE, related_name='request_to', verbose_name='Friendship request for'
+        User, on_delete=models.CASCADE, related_name='request_to', verbose_name='Friendship request for',
+        db_index=False,
     )
 
     class Meta:
         verbose_name = 'Friend requests'
-        unique_together = (('request_from', 'request_to'), ('request_to', 'request_from'))
+        constraints = [
+            # Покрывает выборку исходящих запросов (request_from = ?)
+            models.UniqueConstraint(fields=('request_from', 'request_to'), name='friendrequests_unique_direction'),
+            # Между двумя пользователями может быть только один запрос, в какую бы сторону он ни был
+            models.UniqueConstraint(
+                Least('request_from', 'request_to'), Greatest('request_from', 'request_to'),
+                name='friendrequests_unique_pair',
+            ),
+            models.CheckConstraint(check=~Q(request_from=F('request_to')), name='friendrequests_not_self'),
+        ]
+        indexes = [
+            # Покрывает выборку входящих запросов (request_to = ?)
+            models.Index(fields=('request_to', 'request_from'), name='friendrequests_incoming_idx'),
+        ]
@@ -0,0 +1,254 @@
+"""Живые уведомления о входящих запросах и новых друзьях через server-sent events (SSE).
+
+Поток GET /api/async/friendships/<user_id>/notifications/ обслуживается отдельным ASGI-приложением
+перед Django (см. mount): Django держал бы на каждое соединение поток исполнителя sync_to_async,
+а здесь неактивное соединение — это приостановленная корутина, ожидание отключения и таймер heartbeat.
+
+Поток работает только под ASGI (vk_internship.asgi:application); под WSGI маршрут доходит до Django
+и получает 404. Middleware Django к потоку не применяются, поэтому mount сам проверяет заголовок Host
+по ALLOWED_HOSTS. Чтения потока идут в основную базу (реплики включает только ReplicaRoutingMiddleware),
+в метрики MetricsMiddleware поток не попадает: длительность бесконечного ответа не имеет смысла.
+
+Сообщения рассылает брокер из settings.FRIENDSHIP_NOTIFICATIONS['BACKEND']:
+
+* InProcessBroker — публикация из friendship.services после коммита, только подписчикам этого процесса;
+* EventLogBroker — один опрос журнала FriendshipEvent на процесс, подходит для нескольких воркеров.
+"""
+import asyncio
+import json
+import re
+from collections import deque
+from functools import cache
+
+from django.conf import settings
+from django.http.request import split_domain_port, validate_host
+from django.utils.module_loading import import_string
+
+from friendship.models import FriendshipEvent
+from user.models import User
+
+STREAM_PATH = re.compile(r'^/api/async/friendships/(?P<user_id>\d+)/notifications/$')
+
+REQUEST_CREATED = 'request_created'
+FRIENDSHIP_CREATED = 'friendship_created'
+
+
+class Subscription:
+    """Сообщения одного соединения.
+
+    Вместо asyncio.Queue — deque и одна Future ожидания: неактивное соединение держит только
+    приостановленную корутину, эту Future и таймер heartbeat. Методы вызываются из цикла событий соединения.
+    """
+    __slots__ = ('user_id', 'loop', 'max_queue', 'messages', 'closed', '_waiter')
+
+    def __init__(self, user_id: int, max_queue: int):
+        self.user_id = user_id
+        self.loop = asyncio.get_running_loop()
+        self.max_queue = max_queue
+        self.messages = deque()
+        self.closed = False
+        self._waiter = None
+
+    def deliver(self, message: tuple[str, dict]):
+        if len(self.messages) >= self.max_queue:
+            # Клиент не успевает читать: соединение закрывается, после переподключения он перечитает список
+            self.close()
+            return
+        self.messages.append(message)
+        self._wake()
+
+    def close(self):
+        self.closed = True
+        self._wake()
+
+    def _wake(self):
+        if self._waiter is not None and not self._waiter.done():
+            self._waiter.set_result(None)
+
+    async def wait(self, timeout: float):
+        """Ожидание сообщения, закрытия или истечения timeout"""
+        if self.messages or self.closed:
+            return
+        self._waiter = self.loop.create_future()
+        timer = self.loop.call_later(timeout, self._wake)
+        try:
+            await self._waiter
+        finally:
+            timer.cancel()
+            self._waiter = None
+
+
+class InProcessBroker:
+    """Подписчики по id пользователя в памяти процесса.
+
+    Наборы подписчиков заменяются целиком (копирование при записи), поэтому publish из любого
+    потока читает их без блокировок.
+    """
+
+    def __init__(self, max_queue: int = 100):
+        self.max_queue = max_queue
+        self._subscribers: dict[int, tuple[Subscription, ...]] = {}
+
+    @property
+    def subscriber_count(self) -> int:
+        return sum(len(subscriptions) for subscriptions in list(self._subscribers.values()))
+
+    def subscribe(self, user_id: int) -> Subscription:
+        subscription = Subscription(user_id, self.max_queue)
+        self._subscribers[user_id] = (*self._subscribers.get(user_id, ()), subscription)
+        return subscription
+
+    def unsubscribe(self, subscription: Subscription):
+        remaining = tuple(item for item in self._subscribers.get(subscription.user_id, ()) if item is not subscription)
+        if remaining:
+            self._subscribers[subscription.user_id] = remaining
+        else:
+            self._subscribers.pop(subscription.user_id, None)
+
+    def dispatch(self, user_id: int, event: str, data: dict):
+        """Доставка сообщения подписчикам пользователя; потокобезопасно"""
+        for subscription in self._subscribers.get(user_id, ()):
+            try:
+                subscription.loop.call_soon_threadsafe(subscription.deliver, (event, data))
+            except RuntimeError:
+                # Цикл событий соединения уже закрыт
+                pass
+
+    def publish(self, user_id: int, event: str, data: dict):
+        """Публикация изменения из friendship.services"""
+        self.dispatch(user_id, event, data)
+
+
+class EventLogBroker(InProcessBroker):
+    """Рассылка по журналу FriendshipEvent: изменения из любого процесса доходят до подписчиков этого.
+
+    Журнал опрашивается одной задачей на процесс раз в poll_interval секунд, пока есть подписчики.
+    """
+
+    def __init__(self, max_queue: int = 100, poll_interval: float = 1.0):
+        super().__init__(max_queue)
+        self.poll_interval = poll_interval
+        self._poller = None
+
+    def subscribe(self, user_id: int) -> Subscription:
+        subscription = super().subscribe(user_id)
+        if self._poller is None or self._poller.done():
+            self._poller = asyncio.get_running_loop().create_task(self._poll())
+        return subscription
+
+    def publish(self, user_id: int, event: str, data: dict):
+        # Изменение уже записано в журнал и будет разослано опросом
+        pass
+
+    async def _poll(self):
+        cursor = await FriendshipEvent.objects.order_by('-id').values_list('id', flat=True).afirst() or 0
+        while self._subscribers:
+            await asyncio.sleep(self.poll_interval)
+            async for sequence, event_type, user_id, target_user_id in FriendshipEvent.objects \
+                    .filter(id__gt=cursor, type__in=(FriendshipEvent.Type.REQUEST_CREATED,
+                                                     FriendshipEvent.Type.FRIENDSHIP_CREATED)) \
+                    .order_by('id').values_list('id', 'type', 'user_id', 'target_user_id'):
+                cursor = sequence
+                data = {'user_id': user_id, 'target_user_id': target_user_id}
+                if event_type == FriendshipEvent.Type.REQUEST_CREATED:
+                    self.dispatch(target_user_id, REQUEST_CREATED, data)
+                else:
+                    self.dispatch(user_id, FRIENDSHIP_CREATED, data)
+                    self.dispatch(target_user_id, FRIENDSHIP_CREATED, data)
+
+
+@cache
+def get_broker() -> InProcessBroker:
+    config = settings.FRIENDSHIP_NOTIFICATIONS
+    return import_string(config['BACKEND'])(**config.get('OPTIONS', {}))
+
+
+def publish_changes(created_requests=(), created_friendships=()):
+    """Уведомление получателей новых запросов и обоих участников новой дружбы"""
+    broker = get_broker()
+    for request_from, request_to in created_requests:
+        broker.publish(request_to, REQUEST_CREATED, {'user_id': request_from, 'target_user_id': request_to})
+    for user1, user2 in created_friendships:
+        data = {'user_id': user1, 'target_user_id': user2}
+        broker.publish(user1, FRIENDSHIP_CREATED, data)
+        broker.publish(user2, FRIENDSHIP_CREATED, data)
+
+
+def _format(event: str, data: dict) -> bytes:
+    return f'event: {event}\ndata: {json.dumps(data)}\n\n'.encode()
+
+
+async def _respond(send, status: int, body: dict):
+    await send({'type': 'http.response.start', 'status': status,
+                'headers': [(b'content-type', b'application/json')]})
+    await send({'type': 'http.response.body', 'body': json.dumps(body).encode()})
+
+
+async def stream(scope, receive, send, user_id: int):
+    """SSE-поток уведомлений пользователя; завершается при отключении клиента"""
+    if scope['method'] != 'GET':
+        await _respond(send, 405, {'detail': f'Method "{scope["method"]}" not allowed.'})
+        return
+    if not await User.objects.filter(id=user_id).aexists():
+        await _respond(send, 404, {'detail': 'User does not exist'})
+        return
+
+    broker = get_broker()
+    subscription = broker.subscribe(user_id)
+    disconnected = asyncio.ensure_future(_wait_disconnect(receive))
+    disconnected.add_done_callback(lambda _: subscription.close())
+    try:
+        await send({'type': 'http.response.start', 'status': 200, 'headers': [
+            (b'content-type', b'text/event-stream'),
+            (b'cache-control', b'no-cache'),
+            # Буферизующий прокси (nginx) иначе задерживает события
+            (b'x-accel-buffering', b'no'),
+        ]})
+        await send({'type': 'http.response.body', 'body': b'retry: 3000\n\n', 'more_body': True})
+        heartbeat = settings.FRIENDSHIP_NOTIFICATIONS.get('HEARTBEAT', 15)
+        while True:
+            await subscription.wait(heartbeat)
+            if subscription.closed:
+                break
+            if subscription.messages:
+                messages, subscription.messages = subscription.messages, deque()
+                body = b''.join(_format(*message) for message in messages)
+            else:
+                # Комментарий SSE не даёт прокси закрыть неактивное соединение
+                body = b': ping\n\n'
+            await send({'type': 'http.response.body', 'body': body, 'more_body': True})
+        if not disconnected.done():
+            await send({'type': 'http.response.body', 'body': b''})
+    finally:
+        broker.unsubscribe(subscription)
+        disconnected.cancel()
+
+
+async def _wait_disconnect(receive):
+    while (await receive())['type'] != 'http.disconnect':
+        pass
+
+
+def _allowed_host(scope) -> bool:
+    """Проверка заголовка Host по ALLOWED_HOSTS, как в HttpRequest.get_host"""
+    host = next((value.decode('latin-1') for name, value in scope.get('headers', ()) if name == b'host'), '')
+    allowed_hosts = settings.ALLOWED_HOSTS
+    if settings.DEBUG and not allowed_hosts:
+        allowed_hosts = ['.localhost', '127.0.0.1', '[::1]']
+    domain, _ = split_domain_port(host)
+    return bool(domain) and validate_host(domain, allowed_hosts)
+
+
+def mount(django_application):
+    """ASGI-приложение: поток уведомлений обслуживается напрямую, остальные запросы — Django"""
+    async def application(scope, receive, send):
+        if scope['type'] == 'http':
+            match = STREAM_PATH.match(scope['path'])
+            if match is not None:
+                if not _allowed_host(scope):
+                    await _respond(send, 400, {'detail': 'Invalid HTTP_HOST header'})
+                    return
+                await stream(scope, receive, send, int(match['user_id']))
+                return
+        await django_application(scope, receive, send)
+    return application
@@ -0,0 +1,96 @@
+from bisect import bisect_left, bisect_right
+
+from django.conf import settings
+from rest_framework.exceptions import NotFound
+from rest_framework.pagination import CursorPagination, Cursor
+from rest_framework.request import Request
+
+
+class KeysetPagination(CursorPagination):
+    """Курсорная пагинация списков связей: размер страницы из ?limit=, курсоры в формате CursorPagination"""
+    page_size = settings.FRIENDSHIP_PAGE_SIZE
+    page_size_query_param = 'limit'
+    max_page_size = settings.FRIENDSHIP_MAX_PAGE_SIZE
+    count_query_param = 'count'
+
+    def include_count(self, request, default: bool = False) -> bool:
+        """Нужно ли считать общее количество записей (?count=true/false)"""
+        value = request.GET.get(self.count_query_param)
+        if value is None:
+            return default
+        return value.lower() in ('1', 'true', 'yes')
+
+    def get_links(self) -> dict:
+        return {
+            'next': self.get_next_link(),
+            'previous': self.get_previous_link(),
+        }
+
+
+class SortedIdsPagination(KeysetPagination):
+    """Курсорная пагинация отсортированного массива id, уже загруженного в память (например, из кэша связей).
+
+    Позиция курсора — id на границе страницы, как у CursorPagination по столбцу id связи,
+    поэтому курсоры остаются верными после изменения списка. request может быть обычным HttpRequest.
+    """
+
+    def paginate_ids(self, ids, request) -> list[int]:
+        if not isinstance(request, Request):
+            request = Request(request)
+        self.request = request
+        self.base_url = request.build_absolute_uri()
+        self.page_size = self.get_page_size(request)
+        cursor = self.decode_cursor(request)
+        reverse = bool(cursor and cursor.reverse)
+        try:
+            position = int(cursor.position) if cursor and cursor.position is not None else None
+        except (TypeError, ValueError):
+            raise NotFound(self.invalid_cursor_message)
+        if reverse:
+            end = bisect_left(ids, position) if position is not None else len(ids)
+            start = max(end - self.page_size, 0)
+        else:
+            start = bisect_right(ids, position) if position is not None else 0
+            end = min(start + self.page_size, len(ids))
+        page = list(ids[start:end])
+        self.next_position = page[-1] if page and end < len(ids) else None
+        self.previous_position = page[0] if page and start > 0 else None
+        return page
+
+    def get_next_link(self):
+        if self.next_position is None:
+            return None
+        return self.encode_cursor(Cursor(offset=0, reverse=False, position=self.next_position))
+
+    def get_previous_link(self):
+        if self.previous_position is None:
+            return None
+        return self.encode_cursor(Cursor(offset=0, reverse=True, position=self.previous_position))
+
+
+class RankedIdsPagination(KeysetPagination):
+    """Курсорная пагинация ранжированного списка id: курсор хранит смещение, поддерживается только переход вперёд.
+
+    Порядок задаёт не столбец, а ранжирование, поэтому список загружается до конца запрошенной страницы
+    вызовом load(limit); смещение не больше offset_cutoff.
+    """
+
+    def paginate_ranked(self, load, request) -> list[int]:
+        self.request = request
+        self.base_url = request.build_absolute_uri()
+        self.page_size = self.get_page_size(request)
+        cursor = self.decode_cursor(request)
+        offset = cursor.offset if cursor else 0
+        ids = load(offset + self.page_size + 1)
+        page = ids[offset:offset + self.page_size]
+        next_offset = offset + self.page_size
+        self.next_offset = next_offset if len(ids) > next_offset and next_offset <= self.offset_cutoff else None
+        return page
+
+    def get_next_link(self):
+        if self.next_offset is None:
+            return None
+        return self.encode_cursor(Cursor(offset=self.next_offset, reverse=False, position=None))
+
+    def get_previous_link(self):
+        return None
@@ -0,0 +1,272 @@
+"""Рекомендации друзей («возможно, вы знакомы») по количеству общих друзей.
+
+Для каждого пользователя хранится ограниченный top-K кандидатов (FriendRecommendations).
+Структура поддерживается инкрементально при добавлении и удалении дружбы; для
+кандидатов, не попавших в top-K, хранится только верхняя граница их счёта (threshold).
+Пока все отдаваемые кандидаты имеют счёт не меньше этой границы, выдача точная.
+
+Структуры обновляются после коммита изменения дружбы (friendship.services, transaction.on_commit), вне
+пишущей транзакции, и записываются одним upsert на пачку пользователей. Полного пересчёта при изменении нет:
+структура, выдача которой стала неточной, остаётся такой до rebuild_recommendations --stale. Чтение ничего
+не записывает: без сохранённой структуры или при неточной выдаче top-K считается в памяти.
+Параллельные изменения одной структуры (потоки, процессы) выполняются по очереди: транзакция обновления
+начинается с записи версии строк, которая блокирует их до коммита.
+"""
+from collections import Counter
+
+from django.conf import settings
+from django.db import transaction
+from django.db.models import Count, F, Subquery
+
+from friendship import sharding
+from friendship.graph import intersect_sorted
+from friendship.models import FriendAdjacency, FriendRecommendations
+
+# Максимальное количество пользователей в одном запросе при загрузке и обновлении top-K
+UPDATE_BATCH_SIZE = 500
+
+
+class TopK:
+    """Ограниченный набор кандидатов с наибольшим количеством общих друзей"""
+    __slots__ = ('capacity', 'scores', 'threshold', 'exact')
+
+    def __init__(self, capacity: int, scores: dict[int, int] | None = None, threshold: int = 0,
+                 exact: bool = False):
+        self.capacity = capacity
+        self.scores = scores or {}
+        # Верхняя граница счёта любого кандидата, которого нет в scores
+        self.threshold = threshold
+        # Структура посчитана целиком и с тех пор не менялась: её порядок точен при любой границе
+        self.exact = exact
+
+    @classmethod
+    def from_row(cls, row: FriendRecommendations) -> 'TopK':
+        return cls(settings.FRIENDSHIP_RECOMMENDATIONS_CAPACITY, dict(row.candidates), row.threshold, row.exact)
+
+    def row_fields(self) -> dict:
+        return {
+            'candidates': [[candidate, score] for candidate, score in self.ranked()],
+            'threshold': self.threshold,
+            'exact': self.exact,
+        }
+
+    def ranked(self) -> list[tuple[int, int]]:
+        return sorted(self.scores.items(), key=lambda item: (-item[1], item[0]))
+
+    def increment(self, candidate: int):
+        self.exact = False
+        if candidate in self.scores:
+            self.scores[candidate] += 1
+        elif self.threshold:
+            # Точный счёт неизвестен, но граница для неотслеживаемых кандидатов выросла не больше чем на 1
+            self.threshold += 1
+        else:
+            self.put(candidate, 1)
+
+    def decrement(self, candidate: int):
+        if candidate not in self.scores:
+            return
+        self.exact = False
+        self.scores[candidate] -= 1
+        if self.scores[candidate] <= 0:
+            del self.scores[candidate]
+
+    def put(self, candidate: int, score: int):
+        self.exact = False
+        if score <= 0:
+            self.scores.pop(candidate, None)
+            return
+        self.scores[candidate] = score
+        while len(self.scores) > self.capacity:
+            lowest, lowest_score = self.ranked()[-1]
+            del self.scores[lowest]
+            self.threshold = max(self.threshold, lowest_score)
+
+    def discard(self, candidate: int):
+        if self.scores.pop(candidate, None) is not None:
+            self.exact = False
+
+    def top(self, limit: int, exclude) -> list[tuple[int, int]] | None:
+        """Лучшие кандидаты без exclude или None, если выдача может быть неточной"""
+        result = []
+        for candidate, score in self.ranked():
+            if candidate in exclude:
+                continue
+            # Неотслеживаемый кандидат может иметь такой же или больший счёт
+            if score <= self.threshold and not self.exact:
+                return None
+            result.append((candidate, score))
+            if len(result) == limit:
+                return result
+        if self.threshold and not self.exact:
+            return None
+        return result
+
+
+def compute(user_id: int) -> TopK:
+    """Полный пересчёт top-K пользователя одним запросом по FriendAdjacency"""
+    capacity = settings.FRIENDSHIP_RECOMMENDATIONS_CAPACITY
+    if sharding.enabled():
+        return _compute_on_shards(user_id, capacity)
+    friends = Subquery(FriendAdjacency.objects.filter(owner=user_id).values('friend_id'))
+    rows = list(
+        FriendAdjacency.objects
+        .filter(owner__in=friends)
+        .exclude(friend=user_id)
+        .exclude(friend__in=friends)
+        .values('friend_id')
+        .annotate(score=Count('id'))
+        .order_by('-score', 'friend_id')
+        .values_list('friend_id', 'score')[:capacity + 1]
+    )
+    threshold = rows.pop()[1] if len(rows) > capacity else 0
+    return TopK(capacity, dict(rows), threshold, exact=True)
+
+
+def _compute_on_shards(user_id: int, capacity: int) -> TopK:
+    """compute для связей на шардах: друзья друзей читаются параллельно со всех шардов и считаются в памяти"""
+    friends = list(FriendAdjacency.objects.using(sharding.shard_for(user_id)).filter(owner=user_id)
+                   .values_list('friend_id', flat=True))
+    scores = Counter(sharding.fan_out(
+        lambda shard, owners: FriendAdjacency.objects.using(shard).filter(owner__in=owners)
+        .values_list('friend_id', flat=True),
+        friends,
+    ))
+    for excluded in (user_id, *friends):
+        scores.pop(excluded, None)
+    rows = sorted(scores.items(), key=lambda row: (-row[1], row[0]))[:capacity + 1]
+    threshold = rows.pop()[1] if len(rows) > capacity else 0
+    return TopK(capacity, dict(rows), threshold, exact=True)
+
+
+def rebuild(user_ids) -> int:
+    """Пересчёт и сохранение top-K для пользователей; возвращает количество пользователей"""
+    user_ids = list(user_ids)
+    rows = [FriendRecommendations(user_id=user_id, **compute(user_id).row_fields()) for user_id in user_ids]
+    with transaction.atomic():
+        FriendRecommendations.objects.bulk_create(
+            rows, update_conflicts=True, unique_fields=['user'], update_fields=['candidates', 'threshold', 'exact'],
+        )
+        # Изменения, прочитавшие строку до пересчёта, не должны записать её поверх
+        FriendRecommendations.objects.filter(user_id__in=user_ids).update(version=F('version') + 1)
+    return len(rows)
+
+
+def get_recommendations(user_id: int, limit: int, exclude) -> list[tuple[int, int]]:
+    """Кандидаты в друзья с количеством общих друзей, лучшие первыми"""
+    row = FriendRecommendations.objects.filter(user_id=user_id).first()
+    if row is not None:
+        result = TopK.from_row(row).top(limit, exclude)
+        if result is not None:
+            return result
+    return compute(user_id).top(limit, exclude)
+
+
+def apply_changes(changes: dict):
+    """Применение изменений {user_id: [(метод TopK, *аргументы), ...]} к сохранённым структурам.
+
+    Пользователи без сохранённой структуры пропускаются. На пачку — три выражения: блокирующее обновление
+    версии, чтение строк и upsert изменённых структур.
+    """
+    user_ids = sorted(changes)
+    for start in range(0, len(user_ids), UPDATE_BATCH_SIZE):
+        batch = user_ids[start:start + UPDATE_BATCH_SIZE]
+        with transaction.atomic():
+            # Сначала запись: в SQLite чтение с последующим повышением блокировки приводит к "database is locked"
+            if not FriendRecommendations.objects.filter(user_id__in=batch).update(version=F('version') + 1):
+                continue
+            rows = []
+            for row in FriendRecommendations.objects.filter(user_id__in=batch):
+                top_k = TopK.from_row(row)
+                for method, *args in changes[row.user_id]:
+                    getattr(top_k, method)(*args)
+                rows.append(FriendRecommendations(user_id=row.user_id, **top_k.row_fields()))
+            FriendRecommendations.objects.bulk_create(
+                rows, update_conflicts=True, unique_fields=['user'], update_fields=['candidates', 'threshold', 'exact'],
+            )
+
+
+def stale_user_ids(batch_size: int = UPDATE_BATCH_SIZE):
+    """Пачки пользователей, выдача сохранённых структур которых стала неточной, в порядке id"""
+    last_id = 0
+    while batch := list(FriendRecommendations.objects.filter(user_id__gt=last_id, exact=False)
+                        .order_by('user_id')[:batch_size]):
+        stale = [
+            row.user_id for row in batch
+            if TopK.from_row(row).top(settings.FRIENDSHIP_RECOMMENDATIONS_SIZE, ()) is None
+        ]
+        if stale:
+            yield stale
+        last_id = batch[-1].user_id
+
+
+def _create_missing(user_ids):
+    """Сохранение посчитанных структур пользователей, у которых их ещё нет"""
+    existing = set(FriendRecommendations.objects.filter(user_id__in=user_ids).values_list('user_id', flat=True))
+    FriendRecommendations.objects.bulk_create(
+        [
+            FriendRecommendations(user_id=user_id, **compute(user_id).row_fields())
+            for user_id in sorted(set(user_ids) - existing)
+        ],
+        ignore_conflicts=True,
+    )
+
+
+def record_created(changes: dict, user_id: int, target_user_id: int, friend_ids: dict):
+    """Изменения top-K после появления дружбы; friend_ids — списки друзей обоих сразу после изменения"""
+    changes.setdefault(user_id, []).append(('discard', target_user_id))
+    changes.setdefault(target_user_id, []).append(('discard', user_id))
+    for owner, other in ((user_id, target_user_id), (target_user_id, user_id)):
+        owner_friends = set(friend_ids[owner])
+        for candidate in friend_ids[other]:
+            if candidate == owner or candidate in owner_friends:
+                continue
+            # candidate стал кандидатом для owner через other, а owner — для candidate
+            changes[owner].append(('increment', candidate))
+            changes.setdefault(candidate, []).append(('increment', owner))
+
+
+def record_deleted(changes: dict, user_id: int, target_user_id: int, friend_ids: dict):
+    """Изменения top-K после удаления дружбы; friend_ids — списки друзей обоих сразу после изменения"""
+    mutual = len(intersect_sorted(friend_ids[user_id], friend_ids[target_user_id]))
+    changes.setdefault(user_id, []).append(('put', target_user_id, mutual))
+    changes.setdefault(target_user_id, []).append(('put', user_id, mutual))
+    for owner, other in ((user_id, target_user_id), (target_user_id, user_id)):
+        owner_friends = set(friend_ids[owner])
+        for candidate in friend_ids[other]:
+            if candidate == owner or candidate in owner_friends:
+                continue
+            changes[owner].append(('decrement', candidate))
+            changes.setdefault(candidate, []).append(('decrement', owner))
+
+
+def on_friendships_changed(created, deleted, friend_ids: dict):
+    """Обновление top-K после создания пар created и удаления пар deleted.
+
+    friend_ids — списки друзей всех участников пар после всех изменений (пара входит не более
+    чем в один из списков). Промежуточные состояния восстанавливаются последовательно:
+    сначала применяются удаления, затем создания.
+    """
+    state = {user_id: set(ids) for user_id, ids in friend_ids.items()}
+    for user_id, target_user_id in created:
+        state[user_id].discard(target_user_id)
+        state[target_user_id].discard(user_id)
+    for user_id, target_user_id in deleted:
+        state[user_id].add(target_user_id)
+        state[target_user_id].add(user_id)
+
+    changes = {}
+    for pairs, record, linked in ((deleted, record_deleted, False), (created, record_created, True)):
+        for user_id, target_user_id in pairs:
+            for owner, other in ((user_id, target_user_id), (target_user_id, user_id)):
+                if linked:
+                    state[owner].add(other)
+                else:
+                    state[owner].discard(other)
+            record(changes, user_id, target_user_id, {
+                user_id: sorted(state[user_id]),
+                target_user_id: sorted(state[target_user_id]),
+            })
+    apply_changes(changes)
+    # Структуры участников пар создаются после изменения: они уже его учитывают
+    _create_missing({user_id for pair in (*created, *deleted) for user_id in pair})
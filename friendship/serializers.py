@@ -0,0 +1,47 @@
+from django.conf import settings
+from rest_framework import serializers
+
+from friendship.services import REQUEST_ACTIONS
+
+
+class UserTargetsSerializer(serializers.Serializer):
+    """Пакетный запрос для одного пользователя относительно списка пользователей"""
+    user_id = serializers.IntegerField(min_value=1)
+    target_ids = serializers.ListField(
+        child=serializers.IntegerField(min_value=1),
+        allow_empty=False,
+        max_length=settings.FRIENDSHIP_BATCH_MAX_SIZE,
+    )
+
+    def validate(self, attrs):
+        if attrs['user_id'] in attrs['target_ids']:
+            raise serializers.ValidationError('target_ids must not contain user_id')
+        # Убираем повторы, сохраняя порядок
+        attrs['target_ids'] = list(dict.fromkeys(attrs['target_ids']))
+        return attrs
+
+
+class RequestActionSerializer(serializers.Serializer):
+    """Одно действие с запросом на дружбу"""
+    user_id = serializers.IntegerField(min_value=1)
+    target_user_id = serializers.IntegerField(min_value=1)
+    action = serializers.ChoiceField(choices=REQUEST_ACTIONS)
+
+    def to_internal_value(self, data):
+        if isinstance(data, dict) and isinstance(data.get('action'), str):
+            data = {**data, 'action': data['action'].lower()}
+        return super().to_internal_value(data)
+
+    def validate(self, attrs):
+        if attrs['user_id'] == attrs['target_user_id']:
+            raise serializers.ValidationError('user_id must not be equal to target_user_id')
+        return attrs
+
+
+class RequestActionsBatchSerializer(serializers.Serializer):
+    """Пакет действий с запросами на дружбу"""
+    operations = serializers.ListField(
+        child=RequestActionSerializer(),
+        allow_empty=False,
+        max_length=settings.FRIENDSHIP_BATCH_MAX_SIZE,
+    )
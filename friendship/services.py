@@ -1,150 +1,828 @@
-from django.db.models import Q, When, Case, F, IntegerField
+import time
+from collections import Counter
+from dataclasses import dataclass, field
+from functools import cache
+from typing import NamedTuple
+
+from django.conf import settings
+from django.db import DEFAULT_DB_ALIAS, IntegrityError, connections, transaction
+from django.db.models import Q, F, Value, IntegerField, Case, When, Count, OuterRef, Subquery
+from django.db.models.functions import Coalesce
 from rest_framework import status
 from rest_framework.response import Response
 
-from friendship.models import FriendRequests, Friendship
+from friendship import cache as relationship_cache, events, notifications, recommendations, sharding, snapshot
+from friendship.graph import PathSearch, intersect_sorted, shortest_path
+from friendship.models import FriendRequests, Friendship, FriendAdjacency, FriendshipEvent
 from user.models import User
+from vk_internship.db import replicas
+
+
+class Outcome(NamedTuple):
+    """Результат действия с запросом на дружбу"""
+    status: int
+    success: bool
+    message: str
+
+    def as_response(self) -> Response:
+        return Response({"success": self.success, "message": self.message}, status=self.status)
+
+
+USER_NOT_FOUND = Outcome(status.HTTP_404_NOT_FOUND, False, "User does not exist")
+SELF_REQUEST = Outcome(status.HTTP_400_BAD_REQUEST, False, "user_id must not be equal to target_user_id")
+ALREADY_FRIENDS = Outcome(status.HTTP_409_CONFLICT, False, "This user is already your friend")
+REQUEST_ALREADY_EXISTS = Outcome(status.HTTP_409_CONFLICT, False, "You already have such a request")
+REQUEST_NOT_FOUND = Outcome(status.HTTP_404_NOT_FOUND, False, "You don't have such a request.")
+REQUEST_SENT = Outcome(status.HTTP_201_CREATED, True, "You have successfully sent the request.")
+REQUEST_SENT_BECAME_FRIENDS = Outcome(
+    status.HTTP_201_CREATED, True,
+    "You have successfully sent the request. "
+    "Since you already have a request from this user, you automatically become friends.",
+)
+REQUEST_ACCEPTED = Outcome(status.HTTP_200_OK, True, "You have successfully accepted the request.")
+REQUEST_DECLINED = Outcome(status.HTTP_200_OK, True, "You have successfully declined the request.")
+REQUEST_CANCELED = Outcome(status.HTTP_200_OK, True, "You have successfully canceled the request.")
+CONCURRENT_CHANGE = Outcome(
+    status.HTTP_409_CONFLICT, False, "Relationships were changed concurrently, please repeat the request.",
+)
+
+REQUEST_ACTIONS = ('send_request', 'accept_request', 'decline_request', 'cancel_request')
 
 
 def send_request(user_id: int, target_user_id: int) -> Response:
-    """Создание запроса на дружбу"""
-    try:
-        user = User.objects.get(id=user_id)
-        target_user = User.objects.get(id=target_user_id)
-    except User.DoesNotExist:
-        return Response(status=status.HTTP_404_NOT_FOUND)
-
-    # Если уже являются друзьями
-    if is_friends(user1=user_id, user2=target_user_id):
-        return Response(
-            {
-                "success": False,
-                "message": "This user is already your friend",
-            },
-            status=status.HTTP_409_CONFLICT,
-        )
+    """Создание запроса на дружбу.
 
-    # Такой запрос уже существует
-    if request_exists(user_id, target_user_id):
-        return Response(
-            {
-                "success": False,
-                "message": "You already have such a request",
-            },
-            status=status.HTTP_409_CONFLICT,
-        )
+    Без предварительных проверок: встречный запрос удаляется первым выражением, новый запрос вставляется
+    условным INSERT. Гонки разрешают ограничения уникальности: при конфликте операция повторяется один раз.
+    """
+    # Запрос самому себе нарушил бы CHECK-ограничение, и IntegrityError был бы принят за гонку
+    if user_id == target_user_id:
+        return SELF_REQUEST.as_response()
+    if sharding.enabled():
+        if User.objects.filter(id__in=(user_id, target_user_id)).count() != 2:
+            return USER_NOT_FOUND.as_response()
+        return _apply_on_shards(user_id, target_user_id, 'send_request').as_response()
+    for attempt in range(2):
+        try:
+            with transaction.atomic(), _Changes() as changes:
+                return _send_request(user_id, target_user_id, changes).as_response()
+        except IntegrityError:
+            # Параллельно создан такой же или встречный запрос; на повторе встречный будет принят
+            if attempt:
+                return REQUEST_ALREADY_EXISTS.as_response()
+
+
+def _send_request(user_id: int, target_user_id: int, changes: '_Changes') -> Outcome:
+    # Перекрёстные запросы: удаление встречного запроса сразу захватывает блокировку на запись
+    if _delete_requests([(target_user_id, user_id)], changes):
+        _create_friendships([(user_id, target_user_id)], changes)
+        return REQUEST_SENT_BECAME_FRIENDS
+
+    if _insert_request(user_id, target_user_id):
+        changes.created_requests.append((user_id, target_user_id))
+        return REQUEST_SENT
+
+    # Запрос не вставлен: причина нужна только для ответа
+    match get_relationship_status(user_id, target_user_id):
+        case FriendRequests.RequestStatus.ALREADY_FRIENDS:
+            return ALREADY_FRIENDS
+        case FriendRequests.RequestStatus.OUTGOING_REQUEST:
+            return REQUEST_ALREADY_EXISTS
+    return USER_NOT_FOUND
+
+
+def _insert_request(request_from: int, request_to: int, shard: str | None = None) -> bool:
+    """Создание запроса одним выражением, если оба пользователя существуют, не друзья и запроса ещё нет.
+
+    В шарде shard пользователей нет: их существование проверяет вызывающий код.
+    """
+    user1, user2 = Friendship.ordered(request_from, request_to)
+    connection = connections[shard or DEFAULT_DB_ALIAS]
+    check_users = shard is None
+    with connection.cursor() as cursor:
+        cursor.execute(_insert_request_sql(connection.vendor, check_users), [
+            request_from, request_to,
+            *((request_from, request_to) if check_users else ()),
+            user1, user2,
+            request_from, request_to,
+        ])
+        return cursor.rowcount == 1
 
-    # Перекрёстные запросы
-    if request_exists(target_user_id, user_id):
-        Friendship.objects.create(user1=user, user2=target_user)
-        return Response(
-            {
-                "success": True,
-                "message": "You have successfully sent the request. "
-                           "Since you already have a request from this user, you automatically become friends.",
-            },
-            status=status.HTTP_201_CREATED,
-        )
 
-    # Все условия проверены, создаём новый запрос
-    FriendRequests.objects.create(request_from=user, request_to=target_user)
-    return Response(
-        {
-            "success": True,
-            "message": "You have successfully sent the request."
-        },
-        status=status.HTTP_201_CREATED,
+@cache
+def _insert_request_sql(vendor: str, check_users: bool = True) -> str:
+    """SQL условной вставки запроса; кэшируется по СУБД, так как от неё зависит экранирование имён"""
+    qn = connections[DEFAULT_DB_ALIAS].ops.quote_name
+
+    def column(model, field: str) -> str:
+        return qn(model._meta.get_field(field).column)
+
+    requests, friendships, users = (qn(model._meta.db_table) for model in (FriendRequests, Friendship, User))
+    request_from, request_to = column(FriendRequests, 'request_from'), column(FriendRequests, 'request_to')
+    users_exist = f'(SELECT COUNT(*) FROM {users} WHERE {qn(User._meta.pk.column)} IN (%s, %s)) = 2 AND ' \
+        if check_users else ''
+    return (
+        f'INSERT INTO {requests} ({request_from}, {request_to}) '
+        f'SELECT %s, %s WHERE {users_exist}'
+        f'NOT EXISTS (SELECT 1 FROM {friendships} '
+        f'WHERE {column(Friendship, "user1")} = %s AND {column(Friendship, "user2")} = %s) '
+        f'AND NOT EXISTS (SELECT 1 FROM {requests} WHERE {request_from} = %s AND {request_to} = %s)'
     )
 
 
 def cancel_request(user_id: int, target_user_id: int) -> Response:
     """Пользователь передумал и решил отменить свою заявку в друзья"""
-    if FriendRequests.objects.filter(request_from=user_id, request_to=target_user_id).delete()[0]:
-        return Response(
-            {
-                "success": True,
-                "message": "You have successfully canceled the request."
-            },
-            status=status.HTTP_200_OK,
-        )
-    return Response(
-        {
-            "success": False,
-            "message": "You don't have such a request."
-        },
-        status=status.HTTP_404_NOT_FOUND,
-    )
+    if sharding.enabled():
+        return _apply_on_shards(user_id, target_user_id, 'cancel_request').as_response()
+    with transaction.atomic(), _Changes() as changes:
+        if _delete_requests([(user_id, target_user_id)], changes):
+            return REQUEST_CANCELED.as_response()
+    return REQUEST_NOT_FOUND.as_response()
 
 
 def accept_request(user_id: int, target_user_id: int) -> Response:
-    """user_id принимает запрос дружбы от target_user_id"""
-    user1 = User.objects.get(id=user_id)
-    user2 = User.objects.get(id=target_user_id)
-    if request_exists(target_user_id, user_id):
-        Friendship.objects.create(user1=user1, user2=user2)
-        FriendRequests.objects.filter(request_from=target_user_id, request_to=user_id).delete()
-        return Response(
-            {
-                "success": True,
-                "message": "You have successfully accepted the request."
-            },
-            status=status.HTTP_200_OK,
-        )
-    return Response(
-        {
-            "success": False,
-            "message": "You don't have such a request."
-        },
-        status=status.HTTP_404_NOT_FOUND,
-    )
+    """user_id принимает запрос дружбы от target_user_id: DELETE запроса и INSERT дружбы в одной транзакции.
+
+    Принимает запрос только та транзакция, которая его удалила, поэтому дружба не создаётся дважды.
+    """
+    if sharding.enabled():
+        return _apply_on_shards(user_id, target_user_id, 'accept_request').as_response()
+    with transaction.atomic(), _Changes() as changes:
+        if _delete_requests([(target_user_id, user_id)], changes):
+            _create_friendships([(user_id, target_user_id)], changes)
+            return REQUEST_ACCEPTED.as_response()
+    return REQUEST_NOT_FOUND.as_response()
 
 
 def decline_request(user_id: int, target_user_id: int) -> Response:
     """user_id отклоняет запрос дружбы от target_user_id"""
-    if FriendRequests.objects.filter(request_from=target_user_id, request_to=user_id).delete()[0]:
-        return Response(
-            {
-                "success": True,
-                "message": "You have successfully declined the request."
-            },
-            status=status.HTTP_200_OK,
+    if sharding.enabled():
+        return _apply_on_shards(user_id, target_user_id, 'decline_request').as_response()
+    with transaction.atomic(), _Changes() as changes:
+        if _delete_requests([(target_user_id, user_id)], changes):
+            return REQUEST_DECLINED.as_response()
+    return REQUEST_NOT_FOUND.as_response()
+
+
+def apply_request_actions(operations) -> list[Outcome]:
+    """Пакетное выполнение действий (user_id, target_user_id, action) с запросами на дружбу.
+
+    Все действия выполняются в одной транзакции по порядку, как если бы они были отправлены
+    по одному. Предусловия проверяются по состоянию, загруженному тремя запросами на весь пакет,
+    изменения записываются пачками. Гонки с параллельными изменениями тех же пар разрешают
+    ограничения уникальности: при конфликте пакет повторяется один раз, затем у всех действий
+    результат CONCURRENT_CHANGE.
+
+    На шардах общей транзакции нет: действия выполняются по одному, каждое в транзакции своей пары.
+    """
+    operations = list(operations)
+    if sharding.enabled():
+        existing_users = set()
+        for batch in _batches(sorted({user_id for operation in operations for user_id in operation[:2]})):
+            existing_users.update(User.objects.filter(id__in=batch).values_list('id', flat=True))
+        return [
+            _apply_on_shards(user_id, target_user_id, action)
+            if user_id in existing_users and target_user_id in existing_users else USER_NOT_FOUND
+            for user_id, target_user_id, action in operations
+        ]
+    for attempt in range(2):
+        try:
+            return _apply_request_actions(operations)
+        except IntegrityError:
+            if attempt:
+                return [CONCURRENT_CHANGE] * len(operations)
+
+
+@transaction.atomic
+def _apply_request_actions(operations: list) -> list[Outcome]:
+    user_ids = {user_id for operation in operations for user_id in operation[:2]}
+    pairs = {Friendship.ordered(user_id, target_user_id) for user_id, target_user_id, _ in operations}
+    # Сначала запись: в SQLite чтение с последующим повышением блокировки приводит к "database is locked".
+    # Увеличение версий участников блокирует запись до коммита, поэтому загруженное ниже состояние не устареет
+    for batch in _batches(sorted(user_ids)):
+        User.objects.filter(id__in=batch).update(relationship_version=F('relationship_version') + 1)
+
+    existing_users = set()
+    friends = set()
+    requests = set()
+    for batch in _batches(sorted(pairs)):
+        batch_users = {user_id for pair in batch for user_id in pair}
+        existing_users.update(User.objects.filter(id__in=batch_users).values_list('id', flat=True))
+        batch_pairs = set(batch)
+        friends.update(
+            pair for pair in Friendship.objects
+            .filter(user1__in={user1 for user1, _ in batch}, user2__in={user2 for _, user2 in batch})
+            .values_list('user1', 'user2')
+            if pair in batch_pairs
         )
-    return Response(
-        {
-            "success": False,
-            "message": "You don't have such a request."
-        },
-        status=status.HTTP_404_NOT_FOUND,
-    )
+        requests.update(
+            pair for pair in FriendRequests.objects
+            .filter(request_from__in=batch_users, request_to__in=batch_users)
+            .values_list('request_from', 'request_to')
+            if Friendship.ordered(*pair) in batch_pairs
+        )
+    initial_requests = set(requests)
+    created_friends = []
+
+    outcomes = []
+    for user_id, target_user_id, action in operations:
+        if user_id not in existing_users or target_user_id not in existing_users:
+            outcomes.append(USER_NOT_FOUND)
+            continue
+        pair = Friendship.ordered(user_id, target_user_id)
+        match action:
+            case 'send_request':
+                if pair in friends:
+                    outcome = ALREADY_FRIENDS
+                elif (user_id, target_user_id) in requests:
+                    outcome = REQUEST_ALREADY_EXISTS
+                elif (target_user_id, user_id) in requests:
+                    requests.remove((target_user_id, user_id))
+                    friends.add(pair)
+                    created_friends.append((user_id, target_user_id))
+                    outcome = REQUEST_SENT_BECAME_FRIENDS
+                else:
+                    requests.add((user_id, target_user_id))
+                    outcome = REQUEST_SENT
+            case 'accept_request':
+                if (target_user_id, user_id) in requests:
+                    requests.remove((target_user_id, user_id))
+                    friends.add(pair)
+                    created_friends.append((user_id, target_user_id))
+                    outcome = REQUEST_ACCEPTED
+                else:
+                    outcome = REQUEST_NOT_FOUND
+            case 'decline_request' | 'cancel_request':
+                request = (target_user_id, user_id) if action == 'decline_request' else (user_id, target_user_id)
+                if request in requests:
+                    requests.remove(request)
+                    outcome = REQUEST_DECLINED if action == 'decline_request' else REQUEST_CANCELED
+                else:
+                    outcome = REQUEST_NOT_FOUND
+            case _:
+                raise ValueError(f'unknown action "{action}"')
+        outcomes.append(outcome)
+
+    with _Changes() as changes:
+        _delete_requests(initial_requests - requests, changes)
+        _create_requests(requests - initial_requests, changes)
+        _create_friendships(created_friends, changes)
+    return outcomes
 
 
 def request_exists(request_from: int, request_to: int) -> bool:
-    return FriendRequests.objects.filter(request_from=request_from, request_to=request_to).exists()
+    return relationship_cache.contains(get_outgoing_request_ids(request_from), request_to)
 
 
 def is_friends(user1: int, user2: int) -> bool:
-    return Friendship.objects.filter(Q(user1=user1, user2=user2) | Q(user1=user2, user2=user1)).exists()
+    return relationship_cache.contains(get_user_friend_ids(user1), user2)
+
+
+def delete_friendship(user_id: int, target_user_id: int) -> bool:
+    """Удаление пары из друзей. Возвращает False, если пользователи не были друзьями"""
+    if sharding.enabled():
+        return _delete_friendship_on_shards(user_id, target_user_id)
+    with transaction.atomic(), _Changes() as changes:
+        return bool(_delete_friendships([(user_id, target_user_id)], changes))
+
+
+# Максимальное количество пар в одном запросе при пакетных изменениях
+_BATCH_SIZE = 250
+
+
+def _batches(items: list):
+    for start in range(0, len(items), _BATCH_SIZE):
+        yield items[start:start + _BATCH_SIZE]
+
+
+def _pairs_filter(pairs, first: str, second: str) -> Q:
+    condition = Q()
+    for value1, value2 in pairs:
+        condition |= Q(**{first: value1, second: value2})
+    return condition
+
+
+def _create_requests(pairs, changes: '_Changes'):
+    """Создание запросов (request_from, request_to)"""
+    pairs = list(pairs)
+    if not pairs:
+        return
+    FriendRequests.objects.bulk_create(
+        [FriendRequests(request_from_id=request_from, request_to_id=request_to) for request_from, request_to in pairs],
+    )
+    changes.created_requests.extend(pairs)
+
+
+@transaction.atomic
+def _delete_requests(pairs, changes: '_Changes') -> int:
+    """Удаление запросов (request_from, request_to); возвращает количество удалённых"""
+    pairs = list(dict.fromkeys(pairs))
+    deleted = 0
+    for batch in _batches(pairs):
+        batch_deleted = FriendRequests.objects.filter(_pairs_filter(batch, 'request_from', 'request_to')).delete()[0]
+        if batch_deleted == len(batch):
+            changes.deleted_requests.extend(batch)
+        elif batch_deleted:
+            changes.unknown_requests.extend(batch)
+        deleted += batch_deleted
+    return deleted
+
+
+@transaction.atomic
+def _create_friendships(pairs, changes: '_Changes'):
+    """Создание дружбы для пар пользователей вместе с записями FriendAdjacency"""
+    pairs = list(pairs)
+    if not pairs:
+        return
+    Friendship.objects.bulk_create([Friendship(user1_id=user1, user2_id=user2)
+                                    for user1, user2 in (Friendship.ordered(*pair) for pair in pairs)])
+    FriendAdjacency.objects.bulk_create([
+        FriendAdjacency(owner_id=owner, friend_id=friend)
+        for user_id, target_user_id in pairs
+        for owner, friend in ((user_id, target_user_id), (target_user_id, user_id))
+    ])
+    changes.created_friendships.extend(pairs)
+
+
+@transaction.atomic
+def _delete_friendships(pairs, changes: '_Changes') -> int:
+    """Удаление дружбы для пар пользователей; возвращает количество удалённых пар"""
+    pairs = [Friendship.ordered(*pair) for pair in pairs]
+    deleted = []
+    for batch in _batches(pairs):
+        # Сначала запись: в SQLite чтение с последующим повышением блокировки приводит к "database is locked"
+        FriendAdjacency.objects.filter(
+            _pairs_filter(batch, 'owner', 'friend') | _pairs_filter(batch, 'friend', 'owner')
+        ).delete()
+        existing = list(Friendship.objects.filter(_pairs_filter(batch, 'user1', 'user2')).values_list('id', 'user1', 'user2'))
+        if not existing:
+            continue
+        Friendship.objects.filter(id__in=[friendship_id for friendship_id, _, _ in existing]).delete()
+        deleted += [(user1, user2) for _, user1, user2 in existing]
+    changes.deleted_friendships.extend(deleted)
+    return len(deleted)
+
+
+def _apply_on_shards(user_id: int, target_user_id: int, action: str) -> Outcome:
+    """Действие с запросом на шардах: транзакция в основной копии пары, затем синхронизация
+    зеркальной копии и побочные эффекты в основной базе (см. friendship.sharding).
+
+    Гонки разрешают ограничения уникальности, как и без шардов: при конфликте действие повторяется
+    один раз, затем send_request отвечает REQUEST_ALREADY_EXISTS, остальные действия — CONCURRENT_CHANGE.
+    Существование пользователей проверяет вызывающий код.
+    """
+    for attempt in range(2):
+        try:
+            return _apply_on_shard(user_id, target_user_id, action)
+        except IntegrityError:
+            if attempt:
+                return REQUEST_ALREADY_EXISTS if action == 'send_request' else CONCURRENT_CHANGE
+
+
+def _apply_on_shard(user_id: int, target_user_id: int, action: str) -> Outcome:
+    user1, user2 = Friendship.ordered(user_id, target_user_id)
+    shard, _ = sharding.pair_shards(user1, user2)
+    created, deleted, friendships = [], [], []
+    with transaction.atomic(using=shard):
+        match action:
+            case 'send_request':
+                if _delete_shard_request(shard, target_user_id, user_id):
+                    deleted.append((target_user_id, user_id))
+                    friendships.append((user_id, target_user_id))
+                    outcome = REQUEST_SENT_BECAME_FRIENDS
+                elif _insert_request(user_id, target_user_id, shard):
+                    created.append((user_id, target_user_id))
+                    outcome = REQUEST_SENT
+                elif Friendship.objects.using(shard).filter(user1=user1, user2=user2).exists():
+                    outcome = ALREADY_FRIENDS
+                else:
+                    outcome = REQUEST_ALREADY_EXISTS
+            case 'accept_request':
+                if _delete_shard_request(shard, target_user_id, user_id):
+                    deleted.append((target_user_id, user_id))
+                    friendships.append((user_id, target_user_id))
+                    outcome = REQUEST_ACCEPTED
+                else:
+                    outcome = REQUEST_NOT_FOUND
+            case 'decline_request' | 'cancel_request':
+                request = (target_user_id, user_id) if action == 'decline_request' else (user_id, target_user_id)
+                if _delete_shard_request(shard, *request):
+                    deleted.append(request)
+                    outcome = REQUEST_DECLINED if action == 'decline_request' else REQUEST_CANCELED
+                else:
+                    outcome = REQUEST_NOT_FOUND
+            case _:
+                raise ValueError(f'unknown action "{action}"')
+        if friendships:
+            _create_shard_friendships(shard, friendships)
+    if created or deleted:
+        _after_shard_changes([(user_id, target_user_id)], created, deleted, friendships, [])
+    return outcome
+
+
+def _delete_friendship_on_shards(user_id: int, target_user_id: int) -> bool:
+    user1, user2 = Friendship.ordered(user_id, target_user_id)
+    shard, _ = sharding.pair_shards(user1, user2)
+    with transaction.atomic(using=shard):
+        # Сначала запись, как и в _delete_friendships
+        FriendAdjacency.objects.using(shard).filter(Q(owner=user1, friend=user2) | Q(owner=user2, friend=user1)).delete()
+        deleted = Friendship.objects.using(shard).filter(user1=user1, user2=user2).delete()[0]
+    if deleted:
+        _after_shard_changes([(user1, user2)], [], [], [], [(user1, user2)])
+    return bool(deleted)
+
+
+def _delete_shard_request(shard: str, request_from: int, request_to: int) -> bool:
+    return bool(FriendRequests.objects.using(shard).filter(request_from=request_from, request_to=request_to).delete()[0])
+
+
+def _create_shard_friendships(shard: str, pairs):
+    """Дружба в основной копии пар; записи FriendAdjacency — только владельцев с этого шарда"""
+    Friendship.objects.using(shard).bulk_create([Friendship(user1_id=user1, user2_id=user2)
+                                                 for user1, user2 in (Friendship.ordered(*pair) for pair in pairs)])
+    FriendAdjacency.objects.using(shard).bulk_create([
+        FriendAdjacency(owner_id=owner, friend_id=friend)
+        for user_id, target_user_id in pairs
+        for owner, friend in ((user_id, target_user_id), (target_user_id, user_id))
+        if sharding.shard_for(owner) == shard
+    ])
+
+
+def _after_shard_changes(pairs, created_requests, deleted_requests, created_friendships, deleted_friendships):
+    """Синхронизация зеркальных копий пар и побочные эффекты изменений одной транзакцией в основной базе"""
+    sharding.sync_pairs(pairs)
+    changes = _Changes(created_requests=created_requests, deleted_requests=deleted_requests,
+                       created_friendships=created_friendships, deleted_friendships=deleted_friendships)
+    with transaction.atomic():
+        changes.apply()
+
+
+@dataclass
+class _Changes:
+    """Изменения связей одной операции; побочные эффекты применяются при выходе из блока with в её транзакции.
+
+    В транзакции — только то, что должно быть видно вместе с изменением: счётчики и версии связей одним UPDATE
+    на пачку пользователей. Журнал изменений, уведомления и рекомендации записываются после коммита.
+    """
+    created_requests: list = field(default_factory=list)
+    deleted_requests: list = field(default_factory=list)
+    # Запросы, из которых удалена только часть, неизвестно какая: счётчики участников пересчитываются
+    unknown_requests: list = field(default_factory=list)
+    created_friendships: list = field(default_factory=list)
+    deleted_friendships: list = field(default_factory=list)
+
+    def __enter__(self) -> '_Changes':
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        if exc_type is None:
+            self.apply()
+
+    def apply(self):
+        requests = [*self.created_requests, *self.deleted_requests, *self.unknown_requests]
+        created = [Friendship.ordered(*pair) for pair in self.created_friendships]
+        deleted = [Friendship.ordered(*pair) for pair in self.deleted_friendships]
+        friendships = [*created, *deleted]
+        if not requests and not friendships:
+            return
+
+        incoming = Counter(request_to for _, request_to in self.created_requests)
+        incoming.subtract(request_to for _, request_to in self.deleted_requests)
+        outgoing = Counter(request_from for request_from, _ in self.created_requests)
+        outgoing.subtract(request_from for request_from, _ in self.deleted_requests)
+        friends = Counter(user_id for pair in created for user_id in pair)
+        friends.subtract(user_id for pair in deleted for user_id in pair)
+        _update_counters(incoming_requests_count=incoming, outgoing_requests_count=outgoing, friends_count=friends)
+        if self.unknown_requests:
+            recount_counters({user_id for pair in self.unknown_requests for user_id in pair})
+
+        friend_user_ids = {user_id for pair in friendships for user_id in pair}
+        # До коммита: к моменту, когда изменение видно, чтения этих пользователей уже идут в основную базу
+        replicas.pin_users({user_id for pair in requests for user_id in pair} | friend_user_ids)
+
+        if sharding.enabled():
+            # Состояние пар на шардах, а журнал — в основной базе: события пишутся с известным типом
+            events.record(FriendshipEvent.Type.REQUEST_CREATED, self.created_requests)
+            events.record(FriendshipEvent.Type.REQUEST_DELETED, self.deleted_requests)
+            events.record(FriendshipEvent.Type.FRIENDSHIP_CREATED, created)
+            events.record(FriendshipEvent.Type.FRIENDSHIP_DELETED, deleted)
+        else:
+            # После коммита изменение уже видно, поэтому ошибки записи журнала и рекомендаций только логируются
+            transaction.on_commit(lambda: events.record_states(requests, friendships), robust=True)
+        if self.created_requests or created:
+            created_requests = list(self.created_requests)
+            transaction.on_commit(lambda: notifications.publish_changes(created_requests, created))
+        if friendships:
+            transaction.on_commit(lambda: _update_recommendations(created, deleted, friend_user_ids), robust=True)
+
+
+def _update_recommendations(created, deleted, user_ids):
+    """Обновление top-K рекомендаций после коммита по закоммиченным спискам друзей из основной базы"""
+    with replicas.primary():
+        friend_ids = _load_friend_ids(user_ids)
+    recommendations.on_friendships_changed(created, deleted, friend_ids)
+
+
+def _update_counters(**deltas: Counter):
+    """Изменение счётчиков пользователей: {поле: Counter(user_id -> приращение)}, один UPDATE на пачку.
+
+    Тем же UPDATE увеличивается relationship_version всех затронутых пользователей, в том числе с нулевым
+    приращением: множества их связей изменились, и по версии строятся ключи кэша связей и ETag.
+    """
+    user_ids = sorted({user_id for counter in deltas.values() for user_id in counter})
+    deltas = {field: {user_id: delta for user_id, delta in counter.items() if delta} for field, counter in deltas.items()}
+    for batch in _batches(user_ids):
+        User.objects.filter(id__in=batch).update(
+            relationship_version=F('relationship_version') + 1,
+            **{
+                field: F(field) + Case(
+                    *(When(id=user_id, then=Value(counter[user_id])) for user_id in batch if user_id in counter),
+                    default=Value(0),
+                )
+                for field, counter in deltas.items()
+                if counter.keys() & set(batch)
+            },
+        )
+
+
+def _count_subquery(model, field: str):
+    return Coalesce(Subquery(
+        model.objects.filter(**{field: OuterRef('pk')}).order_by().values(field).annotate(count=Count('*')).values('count')
+    ), 0)
+
+
+def recount_counters(user_ids) -> int:
+    """Пересчёт счётчиков пользователей по таблицам связей; возвращает количество исправленных пользователей"""
+    if sharding.enabled():
+        return _recount_counters_on_shards(user_ids)
+    actual = {
+        'friends_count': _count_subquery(Friendship, 'user1') + _count_subquery(Friendship, 'user2'),
+        'incoming_requests_count': _count_subquery(FriendRequests, 'request_to'),
+        'outgoing_requests_count': _count_subquery(FriendRequests, 'request_from'),
+    }
+    drifted = Q()
+    for field in actual:
+        drifted |= ~Q(**{field: F(f'actual_{field}')})
+    drifted_ids = list(
+        User.objects.filter(id__in=list(user_ids))
+        .alias(**{f'actual_{field}': expression for field, expression in actual.items()})
+        .filter(drifted).values_list('id', flat=True)
+    )
+    if drifted_ids:
+        User.objects.filter(id__in=drifted_ids).update(relationship_version=F('relationship_version') + 1, **actual)
+    return len(drifted_ids)
+
+
+_COUNTED_RELATIONS = (
+    ('friends_count', FriendAdjacency, 'owner'),
+    ('incoming_requests_count', FriendRequests, 'request_to'),
+    ('outgoing_requests_count', FriendRequests, 'request_from'),
+)
+
+
+def _count_on_shard(shard: str, user_ids: list):
+    """Строки (поле счётчика, user_id, значение) по связям пользователей из их шарда"""
+    for field, model, column in _COUNTED_RELATIONS:
+        for user_id, count in model.objects.using(shard).filter(**{f'{column}__in': user_ids}).order_by() \
+                .values(column).annotate(count=Count('*')).values_list(column, 'count'):
+            yield field, user_id, count
+
+
+def _recount_counters_on_shards(user_ids) -> int:
+    user_ids = list(user_ids)
+    actual = {field: Counter() for field, _, _ in _COUNTED_RELATIONS}
+    for field, user_id, count in sharding.fan_out(_count_on_shard, user_ids):
+        actual[field][user_id] = count
+    drifted = [
+        user_id
+        for user_id, *counts in User.objects.filter(id__in=user_ids).values_list('id', *actual)
+        if counts != [actual[field][user_id] for field in actual]
+    ]
+    if drifted:
+        User.objects.filter(id__in=drifted).update(relationship_version=F('relationship_version') + 1, **{
+            field: Case(*(When(id=user_id, then=Value(counter[user_id])) for user_id in drifted))
+            for field, counter in actual.items()
+        })
+    return len(drifted)
+
+
+def repair_counters(batch_size: int = 1000) -> int:
+    """Пересчёт счётчиков всех пользователей пачками по id; возвращает количество исправленных пользователей"""
+    last_id = 0
+    repaired = 0
+    while batch := list(User.objects.filter(id__gt=last_id).order_by('id').values_list('id', flat=True)[:batch_size]):
+        with transaction.atomic():
+            repaired += recount_counters(batch)
+        last_id = batch[-1]
+    return repaired
+
+
+# Порядок важен: при наличии нескольких записей выбирается статус с наименьшим индексом
+_STATUS_PRIORITY = (
+    FriendRequests.RequestStatus.ALREADY_FRIENDS,
+    FriendRequests.RequestStatus.OUTGOING_REQUEST,
+    FriendRequests.RequestStatus.INCOMING_REQUEST,
+)
+
+
+def get_relationship_status(user_id: int, target_user_id: int) -> FriendRequests.RequestStatus:
+    """Статус отношения user_id к target_user_id за один запрос к базе"""
+    return get_relationship_statuses(user_id, [target_user_id])[target_user_id]
+
+
+def get_relationship_statuses(user_id: int, target_user_ids) -> dict[int, FriendRequests.RequestStatus]:
+    """Статусы отношения user_id к каждому из target_user_ids.
+
+    Один запрос (UNION ALL по трём индексам) независимо от количества целевых пользователей.
+    """
+    target_user_ids = list(target_user_ids)
+    return _statuses_from_rows(_statuses_query(user_id, target_user_ids), target_user_ids)
+
+
+async def aget_relationship_status(user_id: int, target_user_id: int) -> FriendRequests.RequestStatus:
+    """Асинхронный get_relationship_status"""
+    rows = [row async for row in _statuses_query(user_id, [target_user_id])]
+    return _statuses_from_rows(rows, [target_user_id])[target_user_id]
+
+
+def _statuses_query(user_id: int, target_user_ids: list):
+    def kind(status_: FriendRequests.RequestStatus):
+        return Value(_STATUS_PRIORITY.index(status_), output_field=IntegerField())
+
+    # Все связи пользователя хранятся в его шарде
+    shard = sharding.db_for_user(user_id)
+    friends = FriendAdjacency.objects.using(shard).filter(owner=user_id, friend__in=target_user_ids) \
+        .annotate(kind=kind(FriendRequests.RequestStatus.ALREADY_FRIENDS)).values_list('friend', 'kind')
+    outgoing = FriendRequests.objects.using(shard).filter(request_from=user_id, request_to__in=target_user_ids) \
+        .annotate(kind=kind(FriendRequests.RequestStatus.OUTGOING_REQUEST)).values_list('request_to', 'kind')
+    incoming = FriendRequests.objects.using(shard).filter(request_to=user_id, request_from__in=target_user_ids) \
+        .annotate(kind=kind(FriendRequests.RequestStatus.INCOMING_REQUEST)).values_list('request_from', 'kind')
+    return friends.union(outgoing, incoming, all=True)
+
+
+def _statuses_from_rows(rows, target_user_ids: list) -> dict[int, FriendRequests.RequestStatus]:
+    kinds = {}
+    for target_user_id, kind_ in rows:
+        kinds[target_user_id] = min(kind_, kinds.get(target_user_id, kind_))
+    return {
+        target_user_id: _STATUS_PRIORITY[kinds[target_user_id]] if target_user_id in kinds
+        else FriendRequests.RequestStatus.EMPTY
+        for target_user_id in target_user_ids
+    }
+
+
+def get_user_friend_ids(user_id: int, version: int | None = None):
+    """Отсортированные id друзей пользователя через кэш связей.
+
+    version — relationship_version пользователя, если вызывающий код её уже прочитал, иначе она читается здесь.
+    """
+    return relationship_cache.get_ids(
+        relationship_cache.FRIENDS, user_id, _version(user_id, version),
+        lambda: FriendAdjacency.objects.using(sharding.db_for_user(user_id)).filter(owner=user_id)
+        .values_list('friend_id', flat=True),
+    )
+
+
+def get_users_friend_ids(user_ids) -> dict:
+    """Отсортированные id друзей для нескольких пользователей.
+
+    Промахи кэша загружаются одним запросом, на шардах — параллельно по запросу на шард.
+    """
+    user_ids = list(user_ids)
+    versions = get_relationship_versions(user_ids)
+    return relationship_cache.get_many_ids(
+        relationship_cache.FRIENDS, {user_id: versions.get(user_id) for user_id in user_ids},
+        lambda batch: sharding.fan_out(
+            lambda shard, ids: FriendAdjacency.objects.using(shard).filter(owner__in=ids).values_list('owner_id', 'friend_id'),
+            batch,
+        ),
+    )
+
+
+def get_mutual_friend_ids(user_id: int, target_user_id: int):
+    """Отсортированные id общих друзей двух пользователей"""
+    friend_ids = get_users_friend_ids([user_id, target_user_id])
+    return intersect_sorted(friend_ids[user_id], friend_ids[target_user_id])
+
+
+def count_mutual_friends(user_id: int, target_user_ids) -> dict[int, int]:
+    """Количество общих друзей user_id с каждым из target_user_ids"""
+    target_user_ids = list(target_user_ids)
+    friend_ids = get_users_friend_ids([user_id, *target_user_ids])
+    return {
+        target_user_id: len(intersect_sorted(friend_ids[user_id], friend_ids[target_user_id]))
+        for target_user_id in target_user_ids
+    }
+
+
+def find_friendship_path(user_id: int, target_user_id: int, max_depth: int) -> PathSearch:
+    """Кратчайшая цепочка друзей между пользователями длиной не больше max_depth.
+
+    Бюджеты FRIENDSHIP_PATH_MAX_VISITED и FRIENDSHIP_PATH_TIMEOUT ограничивают поиск через
+    пользователей с огромным количеством друзей. Друзья фронтов читаются из CSR-снимка графа,
+    если он есть, иначе из базы.
+    """
+    graph = snapshot.get_snapshot()
+    load_neighbors = _load_friend_ids if graph is None else \
+        (lambda user_ids: {frontier_id: graph.neighbors(frontier_id) for frontier_id in user_ids})
+    return shortest_path(
+        user_id, target_user_id, load_neighbors, max_depth,
+        settings.FRIENDSHIP_PATH_MAX_VISITED, time.monotonic() + settings.FRIENDSHIP_PATH_TIMEOUT,
+    )
+
+
+def _load_friend_ids(user_ids) -> dict[int, list]:
+    """Друзья пользователей одним запросом (на шардах — параллельно по запросу на шард) мимо кэша связей.
+
+    Для фронтов поиска цепочки (они вытеснили бы из кэша списки активных пользователей) и для
+    обновления рекомендаций, которому нужны списки сразу после коммита, а не из кэша.
+    """
+    friend_ids = {user_id: [] for user_id in user_ids}
+    for owner_id, friend_id in sharding.fan_out(
+        lambda shard, ids: FriendAdjacency.objects.using(shard).filter(owner__in=ids).values_list('owner_id', 'friend_id'),
+        user_ids,
+    ):
+        friend_ids[owner_id].append(friend_id)
+    return friend_ids
+
+
+def get_friend_recommendations(user_id: int, limit: int) -> list[tuple[int, int]]:
+    """Рекомендуемые друзья (user_id, количество общих друзей) без друзей и пользователей с запросами"""
+    version = _version(user_id)
+    exclude = {user_id}
+    exclude.update(get_user_friend_ids(user_id, version))
+    exclude.update(get_incoming_request_ids(user_id, version))
+    exclude.update(get_outgoing_request_ids(user_id, version))
+    return recommendations.get_recommendations(user_id, limit, exclude)
+
+
+def get_incoming_request_ids(user_id: int, version: int | None = None):
+    """Отсортированные id отправителей входящих запросов (через кэш связей, см. get_user_friend_ids)"""
+    return relationship_cache.get_ids(
+        relationship_cache.INCOMING, user_id, _version(user_id, version),
+        lambda: FriendRequests.objects.using(sharding.db_for_user(user_id)).filter(request_to=user_id)
+        .values_list('request_from_id', flat=True),
+    )
+
+
+def get_outgoing_request_ids(user_id: int, version: int | None = None):
+    """Отсортированные id получателей исходящих запросов (через кэш связей, см. get_user_friend_ids)"""
+    return relationship_cache.get_ids(
+        relationship_cache.OUTGOING, user_id, _version(user_id, version),
+        lambda: FriendRequests.objects.using(sharding.db_for_user(user_id)).filter(request_from=user_id)
+        .values_list('request_to_id', flat=True),
+    )
+
+
+def _version(user_id: int, version: int | None = None) -> int | None:
+    """Версия связей пользователя для ключа кэша: переданная или прочитанная одним запросом; None, если его нет"""
+    if version is None:
+        version = get_relationship_versions([user_id]).get(user_id)
+    return version
+
+
+def get_relationship_counts(user_id: int) -> dict[str, int] | None:
+    """Счётчики друзей и запросов пользователя и версия его связей одним чтением строки User.
+
+    None, если пользователя нет.
+    """
+    return User.objects.filter(id=user_id).values(
+        'friends_count', 'incoming_requests_count', 'outgoing_requests_count', 'relationship_version',
+    ).first()
+
+
+async def aget_relationship_counts(user_id: int) -> dict[str, int] | None:
+    """Асинхронный get_relationship_counts"""
+    return await User.objects.filter(id=user_id).values(
+        'friends_count', 'incoming_requests_count', 'outgoing_requests_count', 'relationship_version',
+    ).afirst()
+
+
+def get_relationship_versions(user_ids) -> dict[int, int]:
+    """Версии связей пользователей; отсутствующих пользователей в результате нет"""
+    return dict(User.objects.filter(id__in=list(user_ids)).values_list('id', 'relationship_version'))
+
+
+async def aget_relationship_versions(user_ids) -> dict[int, int]:
+    """Асинхронный get_relationship_versions"""
+    return {
+        user_id: version
+        async for user_id, version in User.objects.filter(id__in=list(user_ids)).values_list('id', 'relationship_version')
+    }
+
+
+def _count(user_id: int, field: str) -> int:
+    counts = get_relationship_counts(user_id)
+    return counts[field] if counts else 0
 
 
-def get_incoming_requests(user_id: int):
-    """Получение входящих запросов в друзья"""
-    return FriendRequests.objects.filter(request_to=user_id).values_list("request_from", flat=True)
+def count_user_friends(user_id: int) -> int:
+    return _count(user_id, 'friends_count')
 
 
-def get_outgoing_requests(user_id: int):
-    """Получение исходящих запросов в друзья"""
-    return FriendRequests.objects.filter(request_from=user_id).values_list("request_to", flat=True)
+def count_incoming_requests(user_id: int) -> int:
+    return _count(user_id, 'incoming_requests_count')
 
 
-def get_user_friends(user_id: int):
-    friends = Friendship.objects \
-        .filter(Q(user1__id=user_id) | Q(user2__id=user_id)) \
-        .annotate(
-            friend_id=Case(
-                When(user1=user_id, then=F('user2')),
-                When(user2=user_id, then=F('user1')),
-                output_field=IntegerField(),
-          )
-        ) \
-        .values_list('friend_id', flat=True)
-    return User.objects.filter(id__in=friends)
+def count_outgoing_requests(user_id: int) -> int:
+    return _count(user_id, 'outgoing_requests_count')
@@ -0,0 +1,208 @@
+"""Хранение связей на шардах: Friendship, FriendRequests и FriendAdjacency распределены по хэшу id пользователя.
+
+Шарды — псевдонимы баз из settings.FRIENDSHIP_SHARDS (пустой список — всё в основной базе). Пользователи,
+счётчики, журнал событий и рекомендации остаются в основной базе.
+
+Шард пользователя (shard_for) хранит всё, что читается по этому пользователю: его записи FriendAdjacency,
+входящие и исходящие запросы и его пары Friendship. Поэтому статусы, списки и счётчики одного пользователя
+читаются из одного шарда, а данные нескольких пользователей — параллельно (fan_out).
+
+Пара пользователей с разных шардов хранится дважды. Основная копия — на шарде меньшего id: изменения пары
+выполняются транзакцией в ней, и её ограничения уникальности разрешают гонки. Затем sync_pairs переписывает
+зеркальную копию на шарде второго пользователя по основной. Между двумя коммитами процесс может упасть:
+зеркало останется устаревшим, а счётчики и журнал событий в основной базе — без изменения. Восстановление —
+python manage.py repair_shards: сравнение копий всех пар, синхронизация расходящихся и пересчёт счётчиков.
+События, потерянные при сбое, не восстанавливаются: потребителям журнала нужна полная пересинхронизация.
+
+Количество шардов менять нельзя: перераспределения записей между шардами нет.
+"""
+from collections import defaultdict
+from concurrent.futures import ThreadPoolExecutor
+
+from django.conf import settings
+from django.db import transaction
+from django.db.models import Q
+
+from friendship.models import FriendAdjacency, FriendRequests, Friendship
+from vk_internship import metrics
+
+SHARDED_MODELS = (Friendship, FriendRequests, FriendAdjacency)
+
+# Максимальное количество пользователей в одном запросе к шарду при fan_out
+FAN_OUT_BATCH_SIZE = 500
+# Максимальное количество пар в одной транзакции синхронизации
+SYNC_BATCH_SIZE = 250
+
+_executor: ThreadPoolExecutor | None = None
+
+
+def enabled() -> bool:
+    return bool(settings.FRIENDSHIP_SHARDS)
+
+
+def shard_for(user_id: int) -> str:
+    """Шард пользователя; мультипликативный хэш разводит последовательные id по разным шардам"""
+    shards = settings.FRIENDSHIP_SHARDS
+    return shards[(((user_id * 0x9E3779B97F4A7C15) & 0xFFFFFFFFFFFFFFFF) >> 32) % len(shards)]
+
+
+def db_for_user(user_id: int) -> str | None:
+    """База связей пользователя для QuerySet.using(): шард или None (маршрутизация по умолчанию)"""
+    return shard_for(user_id) if enabled() else None
+
+
+def pair_shards(user_id: int, target_user_id: int) -> tuple[str, str]:
+    """Шарды основной и зеркальной копии пары (совпадают, если оба пользователя на одном шарде)"""
+    user1, user2 = Friendship.ordered(user_id, target_user_id)
+    return shard_for(user1), shard_for(user2)
+
+
+def fan_out(load, user_ids) -> list:
+    """Объединённый результат load(using, user_ids) по шардам пользователей, пачками по FAN_OUT_BATCH_SIZE.
+
+    Шарды опрашиваются параллельно; без шардов пачки загружаются по очереди вызовами load(None, ...).
+    Запросы потоков пула учитываются в метриках HTTP-запроса, из которого вызван fan_out.
+    """
+    user_ids = list(user_ids)
+    groups = defaultdict(list)
+    if enabled():
+        for user_id in user_ids:
+            groups[shard_for(user_id)].append(user_id)
+    else:
+        groups[None] = user_ids
+    tasks = [
+        (using, ids[start:start + FAN_OUT_BATCH_SIZE])
+        for using, ids in groups.items()
+        for start in range(0, len(ids), FAN_OUT_BATCH_SIZE)
+    ]
+    if len(tasks) == 1 or not enabled():
+        return [row for task in tasks for row in load(*task)]
+    load_task = metrics.propagate(lambda task: list(load(*task)))
+    return [row for rows in _get_executor().map(load_task, tasks) for row in rows]
+
+
+def _get_executor() -> ThreadPoolExecutor:
+    # Потоки пула держат свои соединения с шардами между вызовами
+    global _executor
+    if _executor is None:
+        _executor = ThreadPoolExecutor(max_workers=settings.FRIENDSHIP_SHARD_WORKERS, thread_name_prefix='shard')
+    return _executor
+
+
+def shutdown():
+    """Остановка пула fan_out (при смене настроек шардов, в тестах): соединения закрываются вместе с потоками"""
+    global _executor
+    if _executor is not None:
+        _executor.shutdown()
+        _executor = None
+
+
+class ShardRouter:
+    """Связи — на шарды, остальные модели — мимо шардов; без шардов решение остаётся следующему маршрутизатору.
+
+    Запросы к связям указывают шард явно (QuerySet.using(db_for_user(...))). Без него маршрутизатор
+    знает шард только для сохранения и удаления загруженной модели, иначе запрос был бы молча выполнен
+    в основной базе, где связей нет.
+    """
+
+    def db_for_read(self, model, **hints):
+        return self._db_for(model, hints)
+
+    def db_for_write(self, model, **hints):
+        return self._db_for(model, hints)
+
+    @staticmethod
+    def _db_for(model, hints):
+        if not enabled() or model not in SHARDED_MODELS:
+            return None
+        instance = hints.get('instance')
+        if instance is None:
+            raise RuntimeError(f'{model.__name__} is sharded: query it with .using(sharding.db_for_user(...))')
+        if instance._state.db is not None:
+            return instance._state.db
+        owner = {Friendship: 'user1_id', FriendRequests: 'request_from_id', FriendAdjacency: 'owner_id'}[model]
+        return shard_for(getattr(instance, owner))
+
+    def allow_relation(self, obj1, obj2, **hints):
+        return None
+
+    def allow_migrate(self, db, app_label, model_name=None, **hints):
+        if db not in settings.FRIENDSHIP_SHARDS:
+            return None
+        # На шардах только таблицы связей; миграции данных (RunPython) относятся к основной базе
+        return app_label == 'friendship' and model_name in {model._meta.model_name for model in SHARDED_MODELS}
+
+
+def _pairs_q(pairs) -> tuple[Q, Q, Q]:
+    """Условия на запросы (в обе стороны), дружбу и запись FriendAdjacency зеркала для пар user1 < user2"""
+    requests, friendships, edges = Q(), Q(), Q()
+    for user1, user2 in pairs:
+        requests |= Q(request_from=user1, request_to=user2) | Q(request_from=user2, request_to=user1)
+        friendships |= Q(user1=user1, user2=user2)
+        edges |= Q(owner=user2, friend=user1)
+    return requests, friendships, edges
+
+
+def sync_pairs(pairs) -> int:
+    """Перезапись зеркальных копий пар по основным; возвращает количество пар с разными шардами.
+
+    Идемпотентна: повтор после сбоя или параллельный вызов для той же пары приводят зеркало к основной копии.
+    """
+    groups = defaultdict(list)
+    for pair in {Friendship.ordered(*pair) for pair in pairs}:
+        source, target = pair_shards(*pair)
+        if source != target:
+            groups[source, target].append(pair)
+    for (source, target), group in groups.items():
+        group.sort()
+        for start in range(0, len(group), SYNC_BATCH_SIZE):
+            _sync_batch(source, target, group[start:start + SYNC_BATCH_SIZE])
+    return sum(len(group) for group in groups.values())
+
+
+def _sync_batch(source: str, target: str, pairs: list):
+    requests, friendships, edges = _pairs_q(pairs)
+    with transaction.atomic(using=target):
+        # Сначала запись: блокировка зеркала держится до конца копирования, поэтому параллельные
+        # синхронизации пары выполняются по очереди и последняя копирует самое новое состояние
+        FriendRequests.objects.using(target).filter(requests).delete()
+        Friendship.objects.using(target).filter(friendships).delete()
+        FriendAdjacency.objects.using(target).filter(edges).delete()
+        request_rows = list(FriendRequests.objects.using(source).filter(requests)
+                            .values_list('request_from_id', 'request_to_id'))
+        friend_rows = list(Friendship.objects.using(source).filter(friendships).values_list('user1_id', 'user2_id'))
+        FriendRequests.objects.using(target).bulk_create(
+            [FriendRequests(request_from_id=request_from, request_to_id=request_to)
+             for request_from, request_to in request_rows],
+        )
+        Friendship.objects.using(target).bulk_create(
+            [Friendship(user1_id=user1, user2_id=user2) for user1, user2 in friend_rows],
+        )
+        FriendAdjacency.objects.using(target).bulk_create(
+            [FriendAdjacency(owner_id=user2, friend_id=user1) for user1, user2 in friend_rows],
+        )
+
+
+def find_diverged_pairs() -> set[tuple[int, int]]:
+    """Пары, основная и зеркальная копии которых различаются (полный просмотр связей всех шардов)"""
+    copies = {}
+    for using in settings.FRIENDSHIP_SHARDS:
+        facts = set()
+        for request_from, request_to in FriendRequests.objects.using(using) \
+                .values_list('request_from_id', 'request_to_id').iterator(chunk_size=10_000):
+            if shard_for(request_from) != shard_for(request_to):
+                facts.add(('request', request_from, request_to))
+        for user1, user2 in Friendship.objects.using(using).values_list('user1_id', 'user2_id') \
+                .iterator(chunk_size=10_000):
+            if shard_for(user1) != shard_for(user2):
+                facts.add(('friendship', user1, user2))
+        copies[using] = facts
+
+    diverged = set()
+    for using, facts in copies.items():
+        for fact in facts:
+            pair = Friendship.ordered(*fact[1:])
+            source, target = pair_shards(*pair)
+            if fact not in copies[target if using == source else source]:
+                diverged.add(pair)
+    return diverged
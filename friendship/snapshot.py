@@ -0,0 +1,210 @@
+"""Снимок графа дружбы в формате CSR (compressed sparse row) для read-only запросов.
+
+Файл снимка состоит из заголовка и трёх массивов int64 в порядке байтов машины:
+
+* offsets — node_count + 1 смещений, соседи пользователя u лежат в neighbors[offsets[u]:offsets[u + 1]];
+* neighbors — отсортированные id друзей, подряд для каждого пользователя.
+
+Файл открывается через mmap, поэтому все процессы читают одну копию из page cache.
+В заголовке хранится номер последнего события журнала (friendship.events) на момент экспорта;
+более поздние события накладываются на снимок дельтой (см. GraphSnapshot.refresh). Если после экспорта
+накопилось больше FRIENDSHIP_GRAPH_SNAPSHOT_MAX_DELTA событий, get_snapshot возвращает None и чтения идут
+в базу до следующего экспорта. Экспортирует снимок команда export_graph_snapshot по расписанию (например, cron),
+а не потоки обработки запросов; без FRIENDSHIP_GRAPH_SNAPSHOT_PATH снимок не используется.
+
+Снимок читает поиск цепочки друзей (friendship.services.find_friendship_path): он отстаёт от базы
+не больше чем на FRIENDSHIP_GRAPH_SNAPSHOT_DELTA_TTL секунд.
+"""
+import logging
+import mmap
+import os
+import struct
+import sys
+import threading
+import time
+from array import array
+
+from django.conf import settings
+from django.db import transaction
+from django.db.models import Count
+
+from friendship import events, sharding
+from friendship.graph import intersect_sorted
+from friendship.models import FriendAdjacency, FriendshipEvent
+
+MAGIC = b'FRNDCSR2'
+# magic, порядок байтов (1 — little endian), node_count, neighbor_count, номер последнего события журнала
+HEADER = struct.Struct('<8sqqqq')
+ITEM_SIZE = array('q').itemsize
+EXPORT_BATCH_SIZE = 10_000
+
+logger = logging.getLogger(__name__)
+
+
+def export(path) -> tuple[int, int]:
+    """Экспорт текущего графа в файл path; возвращает (количество пользователей, количество пар дружбы)"""
+    # Временный файл свой у каждого процесса: параллельные запуски экспорта не пишут в один файл
+    tmp_path = f'{path}.{os.getpid()}.tmp'
+    with transaction.atomic(), open(tmp_path, 'wb') as file:
+        # Чтения в транзакции SQLite видят один снимок базы, поэтому курсор согласован с содержимым
+        event_cursor = events.last_sequence()
+        degrees = dict(FriendAdjacency.objects.values('owner_id').annotate(degree=Count('id')).values_list('owner_id', 'degree'))
+        node_count = max(degrees, default=0) + 1
+        offsets = array('q', [0]) * (node_count + 1)
+        for user_id in range(node_count):
+            offsets[user_id + 1] = offsets[user_id] + degrees.get(user_id, 0)
+
+        file.write(HEADER.pack(MAGIC, sys.byteorder == 'little', node_count, offsets[-1], event_cursor))
+        offsets.tofile(file)
+        _write_in_batches(
+            file, FriendAdjacency.objects.order_by('owner_id', 'friend_id').values_list('friend_id', flat=True),
+        )
+    os.replace(tmp_path, path)
+    return node_count, offsets[-1] // 2
+
+
+def _write_in_batches(file, queryset):
+    batch = array('q')
+    for row in queryset.iterator(chunk_size=EXPORT_BATCH_SIZE):
+        batch.append(row)
+        if len(batch) >= EXPORT_BATCH_SIZE:
+            batch.tofile(file)
+            batch = array('q')
+    batch.tofile(file)
+
+
+class GraphSnapshot:
+    """Граф дружбы из файла снимка с наложенной дельтой изменений из базы"""
+
+    def __init__(self, path):
+        self.path = path
+        self._file = open(path, 'rb')
+        self._mmap = mmap.mmap(self._file.fileno(), 0, access=mmap.ACCESS_READ)
+        self.mtime = os.fstat(self._file.fileno()).st_mtime
+        magic, little_endian, self.node_count, neighbor_count, self.event_cursor = HEADER.unpack_from(self._mmap)
+        if magic != MAGIC:
+            raise ValueError(f'{path} is not a friendship graph snapshot')
+        if bool(little_endian) != (sys.byteorder == 'little'):
+            raise ValueError(f'{path} was exported on a machine with a different byte order')
+
+        view = memoryview(self._mmap)
+        start = HEADER.size
+        self.offsets = view[start:start + (self.node_count + 1) * ITEM_SIZE].cast('q')
+        start += (self.node_count + 1) * ITEM_SIZE
+        self._neighbors = view[start:start + neighbor_count * ITEM_SIZE].cast('q')
+
+        # Последнее известное состояние пар, изменённых после экспорта: (user1, user2) -> дружат ли
+        self._changed_pairs = {}
+        self._delta = {}
+        # Количество событий журнала, прочитанных после экспорта
+        self.delta_events = 0
+        self.refreshed_at = None
+        # Дельта превысила FRIENDSHIP_GRAPH_SNAPSHOT_MAX_DELTA: снимок больше не используется
+        self.stale = False
+
+    def close(self):
+        try:
+            for view in (self.offsets, self._neighbors):
+                view.release()
+            self._mmap.close()
+        except BufferError:
+            # Кто-то ещё держит срезы снимка: отображение освободится вместе с ними
+            pass
+        self._file.close()
+
+    def _base_neighbors(self, user_id: int):
+        if not 0 <= user_id < self.node_count:
+            return self._neighbors[0:0]
+        return self._neighbors[self.offsets[user_id]:self.offsets[user_id + 1]]
+
+    def neighbors(self, user_id: int):
+        """Отсортированные id друзей пользователя (срез mmap без копирования, если дельты нет)"""
+        delta = self._delta.get(user_id)
+        if delta is None:
+            return self._base_neighbors(user_id)
+        added, removed = delta
+        return array('q', sorted(set(self._base_neighbors(user_id)).difference(removed).union(added)))
+
+    def degree(self, user_id: int) -> int:
+        if user_id in self._delta:
+            return len(self.neighbors(user_id))
+        if not 0 <= user_id < self.node_count:
+            return 0
+        return self.offsets[user_id + 1] - self.offsets[user_id]
+
+    def intersection(self, user_id: int, target_user_id: int):
+        return intersect_sorted(self.neighbors(user_id), self.neighbors(target_user_id))
+
+    def refresh(self) -> bool:
+        """Применение событий журнала, появившихся после предыдущего обновления.
+
+        Читаются только новые события, поэтому стоимость обновления пропорциональна количеству изменений,
+        а не размеру графа. Если всего после экспорта событий больше FRIENDSHIP_GRAPH_SNAPSHOT_MAX_DELTA,
+        дельта не применяется, снимок помечается устаревшим и возвращается False.
+        """
+        max_delta = settings.FRIENDSHIP_GRAPH_SNAPSHOT_MAX_DELTA
+        rows = list(
+            FriendshipEvent.objects.filter(id__gt=self.event_cursor).order_by('id')
+            .values_list('id', 'type', 'user_id', 'target_user_id')[:max(max_delta - self.delta_events, 0) + 1]
+        )
+        if self.delta_events + len(rows) > max_delta:
+            self.stale = True
+            return False
+        self.delta_events += len(rows)
+        for sequence, event_type, user1, user2 in rows:
+            if event_type in (FriendshipEvent.Type.FRIENDSHIP_CREATED, FriendshipEvent.Type.FRIENDSHIP_DELETED):
+                self._changed_pairs[user1, user2] = event_type == FriendshipEvent.Type.FRIENDSHIP_CREATED
+            self.event_cursor = sequence
+        self._delta = self._build_delta(
+            [pair for pair, friends in self._changed_pairs.items() if friends],
+            [pair for pair, friends in self._changed_pairs.items() if not friends],
+        )
+        self.refreshed_at = time.monotonic()
+        return True
+
+    @staticmethod
+    def _build_delta(added_pairs, removed_pairs) -> dict:
+        delta = {}
+        for pairs, position in ((removed_pairs, 1), (added_pairs, 0)):
+            for user1, user2 in pairs:
+                for owner, friend in ((user1, user2), (user2, user1)):
+                    added, removed = delta.setdefault(owner, (set(), set()))
+                    if position:
+                        removed.add(friend)
+                    else:
+                        added.add(friend)
+        return delta
+
+
+_snapshot = None
+_lock = threading.Lock()
+
+
+def get_snapshot() -> GraphSnapshot | None:
+    """Снимок графа процесса: переоткрывается после нового экспорта, дельта обновляется
+    не чаще раза в FRIENDSHIP_GRAPH_SNAPSHOT_DELTA_TTL секунд.
+
+    None, если снимок не настроен или не экспортирован, связи на шардах или дельта снимка слишком велика.
+    """
+    global _snapshot
+    path = settings.FRIENDSHIP_GRAPH_SNAPSHOT_PATH
+    if path is None or sharding.enabled():
+        return None
+    with _lock:
+        try:
+            mtime = os.stat(path).st_mtime
+        except FileNotFoundError:
+            return None
+        if _snapshot is None or _snapshot.path != path or _snapshot.mtime != mtime:
+            if _snapshot is not None:
+                _snapshot.close()
+            _snapshot = GraphSnapshot(path)
+        if _snapshot.stale:
+            return None
+        if _snapshot.refreshed_at is None \
+                or time.monotonic() - _snapshot.refreshed_at >= settings.FRIENDSHIP_GRAPH_SNAPSHOT_DELTA_TTL:
+            if not _snapshot.refresh():
+                logger.warning('Graph snapshot %s is stale, run export_graph_snapshot', path)
+                return None
+        return _snapshot
+
@@ -1,15 +1,58 @@
-from rest_framework.test import APITestCase
+import asyncio
+import json
+import random
+import re
+import tempfile
+import threading
+from datetime import timedelta
+from decimal import Decimal
+from io import StringIO
+from pathlib import Path
+from unittest import mock
 
-from friendship.services import is_friends, request_exists
+from asgiref.sync import sync_to_async
+from django.conf import settings
+from django.core.management import CommandError, call_command
+from django.db import IntegrityError, connection, connections, transaction
+from django.test import TransactionTestCase, override_settings
+from django.test.utils import CaptureQueriesContext
+from django.utils import timezone
+from rest_framework.renderers import JSONRenderer
+from rest_framework.test import APIClient, APITestCase
+
+from friendship import bench, cache as relationship_cache, events, notifications, recommendations, services, \
+    sharding, snapshot, urls as friendship_urls
+from friendship.graph import intersect_sorted, shortest_path
+from friendship.models import FriendAdjacency, FriendRequests, Friendship, FriendshipEvent
+from friendship.services import get_friend_recommendations, is_friends, request_exists
+from user import urls as user_urls
+from user.models import User
+from vk_internship import metrics
+from vk_internship.renderers import FastJSONRenderer
+
+
+class CommitAPIClient(APIClient):
+    """Клиент, выполняющий колбэки transaction.on_commit после каждого запроса, как коммит запроса вне тестов"""
+
+    def request(self, **kwargs):
+        with APITestCase.captureOnCommitCallbacks(execute=True):
+            return super().request(**kwargs)
 
 
 class FriendshipTestCase(APITestCase):
+    client_class = CommitAPIClient
+
     def setUp(self):
         super().setUp()
+        relationship_cache.clear()
         usernames = ['Вася', 'Петя', 'Коля', 'Саша', 'Маша', 'Даша', 'Глаша', 'Паша', 'Миша', 'Гоша', 'Катя', 'Лена']
         for username in usernames:
             self.client.post('/api/users/', data={'username': username})
 
+    def make_friends(self, user_id, target_user_id):
+        self.client.post(f'/api/friendships/requests/{user_id}-{target_user_id}/send_request/')
+        self.client.post(f'/api/friendships/requests/{target_user_id}-{user_id}/accept_request/')
+
     def test_friendship_create(self):
         data = {
             'from_user': 1,
@@ -45,6 +88,9 @@ class FriendshipTestCase(APITestCase):
         self.assertEqual(response.status_code, 404)
         self.assertEqual(request_exists(data['from_user'], data['to_user']), False)
         self.assertEqual(is_friends(data['from_user'], data['to_user']), False)
+        response = services.send_request(1, 1)
+        self.assertEqual(response.status_code, 400)
+        self.assertFalse(FriendRequests.objects.exists())
 
     def test_friendship_accept_request(self):
         data = {
@@ -91,3 +137,1185 @@ class FriendshipTestCase(APITestCase):
         self.assertEqual(response.status_code, 200)
         self.assertEqual(is_friends(data['from_user'], data['to_user']), False)
         self.assertEqual(request_exists(data['from_user'], data['to_user']), False)
+
+    def test_friendship_stored_in_canonical_order(self):
+        response = self.client.post('/api/friendships/requests/6-2/send_request/')
+        self.assertEqual(response.status_code, 201)
+        response = self.client.post('/api/friendships/requests/2-6/accept_request/')
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(list(Friendship.objects.values_list('user1', 'user2')), [(2, 6)])
+        self.assertEqual(is_friends(6, 2), True)
+
+    def test_friendship_pair_constraints(self):
+        Friendship.objects.create(user1_id=1, user2_id=2)
+        with self.assertRaises(IntegrityError), transaction.atomic():
+            Friendship.objects.create(user1_id=1, user2_id=2)
+        with self.assertRaises(IntegrityError), transaction.atomic():
+            Friendship.objects.create(user1_id=3, user2_id=1)
+        FriendRequests.objects.create(request_from_id=3, request_to_id=4)
+        with self.assertRaises(IntegrityError), transaction.atomic():
+            FriendRequests.objects.create(request_from_id=4, request_to_id=3)
+
+    def test_friendship_delete(self):
+        self.client.post('/api/friendships/requests/3-1/send_request/')
+        self.client.post('/api/friendships/requests/1-3/accept_request/')
+        response = self.client.post('/api/friendships/delete/3-1/')
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(is_friends(1, 3), False)
+        response = self.client.post('/api/friendships/delete/1-3/')
+        self.assertEqual(response.status_code, 400)
+
+    def test_friends_list(self):
+        self.client.post('/api/friendships/requests/1-2/send_request/')
+        self.client.post('/api/friendships/requests/2-1/accept_request/')
+        self.client.post('/api/friendships/requests/3-1/send_request/')
+        self.client.post('/api/friendships/requests/1-3/send_request/')
+        response = self.client.get('/api/friendships/1/')
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(sorted(user['id'] for user in response.data['friends']), [2, 3])
+        response = self.client.get('/api/friendships/3/')
+        self.assertEqual([user['id'] for user in response.data['friends']], [1])
+        self.client.post('/api/friendships/delete/1-3/')
+        self.assertEqual(FriendAdjacency.objects.filter(owner=3).count(), 0)
+        response = self.client.get('/api/friendships/1/')
+        self.assertEqual([user['id'] for user in response.data['friends']], [2])
+
+    def test_backfill_friend_adjacency(self):
+        Friendship.objects.create(user1_id=1, user2_id=2)
+        Friendship.objects.create(user1_id=2, user2_id=5)
+        call_command('backfill_friend_adjacency', batch_size=1, stdout=StringIO())
+        self.assertEqual(
+            sorted(FriendAdjacency.objects.values_list('owner', 'friend')),
+            [(1, 2), (2, 1), (2, 5), (5, 2)],
+        )
+
+    def test_friendship_status(self):
+        def status_of(user_id, target_user_id):
+            # Версии связей для ETag и сам статус
+            with self.assertNumQueries(2):
+                response = self.client.get(f'/api/friendships/status/{user_id}-{target_user_id}/')
+            self.assertEqual(response.status_code, 200)
+            return response.data['status']
+
+        self.assertEqual(status_of(1, 2), FriendRequests.RequestStatus.EMPTY.name)
+        self.client.post('/api/friendships/requests/1-2/send_request/')
+        self.assertEqual(status_of(1, 2), FriendRequests.RequestStatus.OUTGOING_REQUEST.name)
+        self.assertEqual(status_of(2, 1), FriendRequests.RequestStatus.INCOMING_REQUEST.name)
+        self.client.post('/api/friendships/requests/2-1/accept_request/')
+        self.assertEqual(status_of(1, 2), FriendRequests.RequestStatus.ALREADY_FRIENDS.name)
+        self.assertEqual(status_of(2, 1), FriendRequests.RequestStatus.ALREADY_FRIENDS.name)
+        response = self.client.get('/api/friendships/status/1-1/')
+        self.assertEqual(response.status_code, 400)
+
+    def test_friendship_batch_status(self):
+        self.client.post('/api/friendships/requests/1-2/send_request/')
+        self.client.post('/api/friendships/requests/2-1/accept_request/')
+        self.client.post('/api/friendships/requests/1-3/send_request/')
+        self.client.post('/api/friendships/requests/4-1/send_request/')
+        with self.assertNumQueries(1):
+            response = self.client.post(
+                '/api/friendships/status/batch/', data={'user_id': 1, 'target_ids': [2, 3, 4, 5, 3]}, format='json'
+            )
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(
+            [(item['target_user_id'], item['status']) for item in response.data['statuses']],
+            [
+                (2, FriendRequests.RequestStatus.ALREADY_FRIENDS.name),
+                (3, FriendRequests.RequestStatus.OUTGOING_REQUEST.name),
+                (4, FriendRequests.RequestStatus.INCOMING_REQUEST.name),
+                (5, FriendRequests.RequestStatus.EMPTY.name),
+            ],
+        )
+        response = self.client.post(
+            '/api/friendships/status/batch/', data={'user_id': 1, 'target_ids': [1, 2]}, format='json'
+        )
+        self.assertEqual(response.status_code, 400)
+
+    def test_friends_list_pagination(self):
+        for target_user_id in range(2, 13):
+            Friendship.objects.create(user1_id=1, user2_id=target_user_id)
+        call_command('backfill_friend_adjacency', stdout=StringIO())
+        call_command('repair_relationship_counters', stdout=StringIO())
+        friend_ids = []
+        url = '/api/friendships/1/?limit=4&count=true'
+        while url:
+            # Количество друзей читается из счётчика в строке пользователя, список друзей загружается
+            # в кэш связей при первом запросе
+            with self.assertNumQueries(2 if friend_ids else 3):
+                response = self.client.get(url)
+            self.assertEqual(response.status_code, 200)
+            self.assertEqual(response.data['count'], 11)
+            self.assertLessEqual(len(response.data['friends']), 4)
+            friend_ids += [user['id'] for user in response.data['friends']]
+            url = response.data['next']
+        self.assertEqual(friend_ids, list(range(2, 13)))
+        response = self.client.get('/api/friendships/1/?limit=4')
+        self.assertIsNone(response.data['previous'])
+        response = self.client.get(self.client.get(response.data['next']).data['previous'])
+        self.assertEqual([user['id'] for user in response.data['friends']], [2, 3, 4, 5])
+        self.assertIsNone(response.data['previous'])
+        self.assertNotIn('count', response.data)
+
+    def test_requests_list(self):
+        for user_id in (5, 3, 9):
+            self.client.post(f'/api/friendships/requests/{user_id}-1/send_request/')
+        response = self.client.get('/api/friendships/requests/1/incoming/?limit=2')
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual([user['id'] for user in response.data['requests_users']], [3, 5])
+        self.assertEqual(response.data['count'], 3)
+        response = self.client.get(response.data['next'])
+        self.assertEqual([user['id'] for user in response.data['requests_users']], [9])
+        self.assertIsNone(response.data['next'])
+        response = self.client.get('/api/friendships/requests/5/OUTGOING/?count=false')
+        self.assertEqual(response.data['requests_type'], 'outgoing')
+        self.assertEqual([user['id'] for user in response.data['requests_users']], [1])
+        self.assertNotIn('count', response.data)
+        response = self.client.get('/api/friendships/requests/1/unknown/')
+        self.assertEqual(response.status_code, 400)
+
+    def test_relationship_cache_versions(self):
+        self.assertEqual(is_friends(1, 2), False)
+        self.assertEqual(request_exists(1, 2), False)
+        # При попадании читается только версия связей
+        with self.assertNumQueries(1):
+            self.assertEqual(is_friends(1, 2), False)
+        self.client.post('/api/friendships/requests/1-2/send_request/')
+        self.assertEqual(request_exists(1, 2), True)
+        self.client.post('/api/friendships/requests/2-1/accept_request/')
+        self.assertEqual(is_friends(1, 2), True)
+        self.assertEqual(is_friends(2, 1), True)
+        self.assertEqual(request_exists(1, 2), False)
+        self.client.post('/api/friendships/delete/2-1/')
+        self.assertEqual(is_friends(1, 2), False)
+        self.client.post('/api/friendships/requests/3-1/send_request/')
+        self.client.post('/api/friendships/requests/1-3/decline_request/')
+        self.assertEqual(request_exists(3, 1), False)
+        self.client.post('/api/friendships/requests/3-1/send_request/')
+        self.client.post('/api/friendships/requests/3-1/cancel_request/')
+        self.assertEqual(request_exists(3, 1), False)
+
+        response = self.client.get('/api/friendships/cache/stats/')
+        self.assertEqual(response.status_code, 200)
+        self.assertGreater(response.data['hits'], 0)
+        self.assertGreater(response.data['misses'], 0)
+
+        # Читатель загрузил список до коммита и записал его в кэш после: запись под старой версией не видна
+        version = services.get_relationship_counts(1)['relationship_version']
+        stale_ids = services.get_user_friend_ids(1)
+        self.make_friends(1, 2)
+        relationship_cache._cache().set(relationship_cache._key(relationship_cache.FRIENDS, 1, version), stale_ids)
+        self.assertEqual(is_friends(1, 2), True)
+        self.assertEqual(self.client.get('/api/friendships/1/?fields=id').data['friends'], [{'id': 2}])
+
+    def test_relationship_cache_rollback(self):
+        services.send_request(1, 2)
+        with self.assertRaises(RuntimeError), transaction.atomic():
+            services.accept_request(2, 1)
+            raise RuntimeError
+        self.assertFalse(FriendAdjacency.objects.exists())
+        self.assertEqual(list(services.get_user_friend_ids(1)), [])
+        self.assertEqual(is_friends(2, 1), False)
+
+    def test_intersect_sorted(self):
+        self.assertEqual(list(intersect_sorted([1, 3, 5, 7], [2, 3, 4, 7, 9])), [3, 7])
+        self.assertEqual(list(intersect_sorted([5], list(range(0, 1000, 5)))), [5])
+        self.assertEqual(list(intersect_sorted(list(range(1000)), [999, 1000])), [999])
+        self.assertEqual(list(intersect_sorted([], [1, 2])), [])
+
+    def test_shortest_path(self):
+        # Пользователь 0 — хаб с десятью друзьями, до 20 ведёт цепочка 20-21-22-10
+        graph = {0: list(range(1, 11)), 20: [21], 21: [20, 22], 22: [21, 10]}
+        for friend_id in range(1, 11):
+            graph[friend_id] = [0]
+        graph[10].append(22)
+        loads = []
+
+        def load(frontier):
+            loads.append(list(frontier))
+            return {user_id: graph.get(user_id, []) for user_id in frontier}
+
+        search = shortest_path(0, 20, load, max_depth=6, max_visited=100, deadline=float('inf'))
+        self.assertEqual(search.path, [0, 10, 22, 21, 20])
+        self.assertFalse(search.exhausted)
+        # После первого шага расширяется меньший фронт — со стороны цели
+        self.assertEqual(loads, [[0], [20], [21], [22]])
+        self.assertEqual(shortest_path(0, 20, load, 3, 100, float('inf')), (None, False, 14))
+        self.assertEqual(shortest_path(0, 30, load, 6, 100, float('inf')), (None, False, 12))
+        self.assertTrue(shortest_path(0, 20, load, 6, 5, float('inf')).exhausted)
+        self.assertTrue(shortest_path(0, 20, load, 6, 100, 0).exhausted)
+
+    def test_friendship_path(self):
+        for user_id, target_user_id in ((1, 2), (2, 3), (3, 4), (4, 5), (1, 6), (6, 7), (7, 5)):
+            self.make_friends(user_id, target_user_id)
+        # Проверка пользователей, по запросу на каждый из трёх шагов поиска, имена цепочки
+        with self.assertNumQueries(5):
+            response = self.client.get('/api/friendships/path/1-5/')
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.data['distance'], 3)
+        self.assertEqual(response.data['path'], [
+            {'id': 1, 'username': 'Вася'}, {'id': 6, 'username': 'Даша'},
+            {'id': 7, 'username': 'Глаша'}, {'id': 5, 'username': 'Маша'},
+        ])
+        self.assertFalse(response.data['exhausted'])
+        response = self.client.get('/api/friendships/path/5-3/?fields=id')
+        self.assertEqual(response.data['path'], [{'id': 5}, {'id': 4}, {'id': 3}])
+
+        response = self.client.get('/api/friendships/path/1-5/?max_depth=2')
+        self.assertEqual((response.data['distance'], response.data['path'], response.data['exhausted']), (None, [], False))
+        response = self.client.get('/api/friendships/path/1-8/')
+        self.assertEqual((response.data['distance'], response.data['exhausted']), (None, False))
+        with override_settings(FRIENDSHIP_PATH_MAX_VISITED=3):
+            response = self.client.get('/api/friendships/path/1-5/')
+        self.assertEqual((response.data['distance'], response.data['exhausted']), (None, True))
+
+        for path in ('1-1/', '1-5/?max_depth=0', '1-5/?max_depth=7', '1-5/?max_depth=abc', '1-5/?fields=email'):
+            self.assertEqual(self.client.get(f'/api/friendships/path/{path}').status_code, 400)
+        response = self.client.get('/api/friendships/path/1-999/')
+        self.assertEqual((response.status_code, response.json()), (404, {'detail': 'User does not exist'}))
+
+    def test_mutual_friends(self):
+        for friend_id in (3, 4, 5, 6):
+            self.make_friends(1, friend_id)
+        for friend_id in (4, 5, 6, 7):
+            self.make_friends(2, friend_id)
+        response = self.client.get('/api/friendships/1-2/mutual/?limit=2')
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.data['count'], 3)
+        self.assertEqual([user['id'] for user in response.data['users']], [4, 5])
+        response = self.client.get(response.data['next'])
+        self.assertEqual([user['id'] for user in response.data['users']], [6])
+        self.assertIsNone(response.data['next'])
+        response = self.client.get('/api/friendships/1-2/mutual/?cursor=cD1hYmM=')
+        self.assertEqual(response.status_code, 404)
+
+        # Версии связей и списки друзей всех пользователей загружаются двумя запросами
+        relationship_cache.clear()
+        with self.assertNumQueries(2):
+            response = self.client.post(
+                '/api/friendships/mutual/batch/', data={'user_id': 1, 'target_ids': [2, 7]}, format='json'
+            )
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(
+            [(item['target_user_id'], item['count']) for item in response.data['mutual']], [(2, 3), (7, 0)]
+        )
+        response = self.client.get('/api/friendships/1-1/mutual/')
+        self.assertEqual(response.status_code, 400)
+
+    def test_friend_recommendations(self):
+        for user_id, target_user_id in ((1, 2), (2, 3), (2, 4), (5, 3), (1, 5), (6, 4)):
+            self.make_friends(user_id, target_user_id)
+        self.client.post('/api/friendships/requests/1-6/send_request/')
+        response = self.client.get('/api/friendships/1/recommendations/')
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(
+            [(user['id'], user['mutual_friends']) for user in response.data['recommendations']], [(3, 2), (4, 1)]
+        )
+        self.make_friends(1, 3)
+        response = self.client.get('/api/friendships/1/recommendations/?limit=1')
+        self.assertEqual([user['id'] for user in response.data['recommendations']], [4])
+        response = self.client.get('/api/friendships/1/recommendations/?limit=0')
+        self.assertEqual(response.status_code, 400)
+
+    @override_settings(FRIENDSHIP_RECOMMENDATIONS_CAPACITY=3)
+    def test_friend_recommendations_incremental(self):
+        def expected(user_id):
+            friends = {}
+            for user1, user2 in edges:
+                friends.setdefault(user1, set()).add(user2)
+                friends.setdefault(user2, set()).add(user1)
+            scores = {}
+            for friend in friends.get(user_id, ()):
+                for candidate in friends[friend]:
+                    if candidate != user_id and candidate not in friends[user_id]:
+                        scores[candidate] = scores.get(candidate, 0) + 1
+            return sorted(scores.items(), key=lambda item: (-item[1], item[0]))[:2]
+
+        call_command('rebuild_recommendations', stdout=StringIO())
+        rng = random.Random(7)
+        edges = set()
+        for _ in range(60):
+            pair = tuple(sorted(rng.sample(range(1, 13), 2)))
+            if pair in edges:
+                self.client.post(f'/api/friendships/delete/{pair[0]}-{pair[1]}/')
+                edges.remove(pair)
+            else:
+                self.make_friends(*pair)
+                edges.add(pair)
+            for user_id in range(1, 13):
+                self.assertEqual(get_friend_recommendations(user_id, 2), expected(user_id))
+        # Неточные структуры пересчитывает rebuild_recommendations --stale, после него чтение — один запрос
+        stale = [user_id for batch in recommendations.stale_user_ids() for user_id in batch]
+        self.assertTrue(stale)
+        output = StringIO()
+        call_command('rebuild_recommendations', stale=True, stdout=output)
+        self.assertIn(f'Rebuilt recommendations for {len(stale)} users', output.getvalue())
+        self.assertEqual(list(recommendations.stale_user_ids()), [])
+        for user_id in range(1, 13):
+            with self.assertNumQueries(1):
+                self.assertEqual(recommendations.get_recommendations(user_id, 2, set()), expected(user_id))
+
+    def test_friend_recommendations_storage(self):
+        for user_id, target_user_id in ((1, 2), (2, 3)):
+            self.make_friends(user_id, target_user_id)
+        recommendations.FriendRecommendations.objects.all().delete()
+        # Чтение без сохранённой структуры считает её в памяти и ничего не записывает
+        with CaptureQueriesContext(connection) as queries:
+            self.assertEqual(recommendations.get_recommendations(1, 5, set()), [(3, 1)])
+        self.assertTrue(all(query['sql'].startswith('SELECT') for query in queries.captured_queries))
+        self.assertFalse(recommendations.FriendRecommendations.objects.exists())
+
+        self.make_friends(3, 4)
+        self.assertEqual(
+            set(recommendations.FriendRecommendations.objects.values_list('user_id', flat=True)), {3, 4},
+        )
+        # Обновление вне пишущей транзакции: accept_request только регистрирует его на коммит
+        self.client.post('/api/friendships/requests/5-4/send_request/')
+        with self.captureOnCommitCallbacks() as callbacks:
+            services.accept_request(4, 5)
+        self.assertEqual(recommendations.FriendRecommendations.objects.get(user_id=3).candidates, [[1, 1]])
+        # Рекомендации регистрируются последними: события и уведомления выполняются отдельно
+        for callback in callbacks[:-1]:
+            callback()
+        with CaptureQueriesContext(connection) as queries:
+            callbacks[-1]()
+        self.assertEqual(recommendations.FriendRecommendations.objects.get(user_id=3).candidates, [[1, 1], [5, 1]])
+        # Изменения существующих структур — одним upsert, без пересчёта: друзья 4, строки 3 и 4, upsert,
+        # затем создание структуры 5
+        writes = [query['sql'].split()[0] for query in queries.captured_queries
+                  if not query['sql'].startswith(('SAVEPOINT', 'RELEASE SAVEPOINT'))]
+        self.assertEqual(writes[:4], ['SELECT', 'UPDATE', 'SELECT', 'INSERT'])
+        self.assertEqual(writes.count('INSERT'), 2)
+
+    def test_graph_snapshot(self):
+        for user_id, target_user_id in ((1, 2), (1, 3), (2, 3), (3, 4), (5, 6)):
+            self.make_friends(user_id, target_user_id)
+        with tempfile.TemporaryDirectory() as directory:
+            path = Path(directory) / 'graph.csr'
+            call_command('export_graph_snapshot', output=str(path), stdout=StringIO())
+            graph = snapshot.GraphSnapshot(path)
+            graph.refresh()
+            self.assertEqual(list(graph.neighbors(3)), [1, 2, 4])
+            self.assertEqual(graph.degree(1), 2)
+            self.assertEqual(graph.degree(12), 0)
+            self.assertEqual(graph.degree(999), 0)
+            self.assertEqual(list(graph.intersection(1, 2)), [3])
+
+            self.client.post('/api/friendships/delete/1-3/')
+            self.make_friends(1, 4)
+            self.make_friends(3, 1)
+            self.make_friends(12, 5)
+            graph.refresh()
+            self.assertEqual(list(graph.neighbors(1)), [2, 3, 4])
+            self.assertEqual(list(graph.neighbors(4)), [1, 3])
+            self.assertEqual(graph.degree(12), 1)
+            self.assertEqual(list(graph.intersection(5, 6)), [])
+            self.assertEqual(list(graph.intersection(4, 2)), [1, 3])
+            graph.close()
+
+            with override_settings(FRIENDSHIP_GRAPH_SNAPSHOT_PATH=path):
+                self.assertEqual(list(snapshot.get_snapshot().neighbors(5)), [6, 12])
+                # Поиск цепочки читает друзей фронтов из снимка с дельтой
+                with self.assertNumQueries(0):
+                    self.assertEqual(services.find_friendship_path(6, 12, 4).path, [6, 5, 12])
+            # Слишком большая дельта: до следующего экспорта чтения идут в базу, запросы снимок не экспортируют
+            with override_settings(FRIENDSHIP_GRAPH_SNAPSHOT_PATH=path, FRIENDSHIP_GRAPH_SNAPSHOT_MAX_DELTA=1,
+                                   FRIENDSHIP_GRAPH_SNAPSHOT_DELTA_TTL=0), \
+                    mock.patch.object(snapshot, 'export') as export:
+                self.assertIsNone(snapshot.get_snapshot())
+                self.assertEqual(services.find_friendship_path(6, 12, 4).path, [6, 5, 12])
+                export.assert_not_called()
+            with override_settings(FRIENDSHIP_GRAPH_SNAPSHOT_PATH=Path(directory) / 'missing.csr'):
+                self.assertIsNone(snapshot.get_snapshot())
+        # По умолчанию снимок выключен
+        self.assertIsNone(settings.FRIENDSHIP_GRAPH_SNAPSHOT_PATH)
+        self.assertIsNone(snapshot.get_snapshot())
+        with self.assertRaises(CommandError):
+            call_command('export_graph_snapshot', stdout=StringIO())
+
+    def test_import_social_graph(self):
+        with tempfile.TemporaryDirectory() as directory:
+            directory = Path(directory)
+            (directory / 'users.csv').write_text('id,username\n100,Рома\n101,Оля\n102,\nbad,Ира\n', encoding='utf-8')
+            (directory / 'friendships.ndjson').write_text(
+                '{"user1": 101, "user2": 100}\n{"user1": 100, "user2": 101}\n{"user1": 1, "user2": 1}\n'
+                '{"user1": 1, "user2": 999}\n{"user1": 2, "user2": 100}\n'
+            )
+            (directory / 'requests.csv').write_text(
+                'request_from,request_to\n3,100\n100,3\n100,101\n4,101\n'
+            )
+            output = StringIO()
+            call_command(
+                'import_social_graph',
+                users=str(directory / 'users.csv'),
+                friendships=str(directory / 'friendships.ndjson'),
+                requests=str(directory / 'requests.csv'),
+                chunk_size=2,
+                defer_indexes=True,
+                stdout=output,
+            )
+        self.assertIn('rows/s', output.getvalue())
+        # Считаются вставленные строки: повтор пары дружбы и встречный запрос 100 -> 3 не вставлены
+        for line in ('users: 4 rows read, 2 valid, 2 inserted, 2 skipped',
+                     'friendships: 5 rows read, 2 valid, 2 inserted, 3 skipped',
+                     'requests: 4 rows read, 3 valid, 2 inserted, 1 skipped'):
+            self.assertIn(line, output.getvalue())
+        self.assertEqual(
+            sorted(Friendship.objects.values_list('user1', 'user2')), [(2, 100), (100, 101)]
+        )
+        self.assertEqual(FriendAdjacency.objects.filter(owner=100).count(), 2)
+        # Встречный запрос 100 -> 3 отсекается ограничением на пару, запрос между друзьями 100 и 101 пропускается
+        self.assertEqual(
+            sorted(FriendRequests.objects.values_list('request_from', 'request_to')), [(3, 100), (4, 101)]
+        )
+        response = self.client.get('/api/friendships/100/')
+        self.assertEqual([user['username'] for user in response.data['friends']], ['Петя', 'Оля'])
+        # Импорт пишет события только о существующих после вставки связях
+        self.assertEqual(
+            sorted(FriendshipEvent.objects.values_list('type', 'user_id', 'target_user_id')),
+            [(FriendshipEvent.Type.REQUEST_CREATED, 3, 100), (FriendshipEvent.Type.REQUEST_CREATED, 4, 101),
+             (FriendshipEvent.Type.FRIENDSHIP_CREATED, 2, 100), (FriendshipEvent.Type.FRIENDSHIP_CREATED, 100, 101)],
+        )
+
+        # Ожидающий запрос пары, импортированной как дружба, удаляется
+        self.client.post('/api/friendships/requests/1-2/send_request/')
+        with tempfile.NamedTemporaryFile('w', suffix='.csv') as file:
+            file.write('user1,user2\n2,1\n')
+            file.flush()
+            call_command('import_social_graph', friendships=file.name, stdout=StringIO())
+            # Повторный импорт тех же пар ничего не вставляет
+            output = StringIO()
+            call_command('import_social_graph', friendships=file.name, stdout=output)
+            self.assertIn('friendships: 1 rows read, 1 valid, 0 inserted, 0 skipped', output.getvalue())
+        self.assertFalse(FriendRequests.objects.filter(request_from=1, request_to=2).exists())
+        self.assertTrue(FriendshipEvent.objects.filter(
+            type=FriendshipEvent.Type.REQUEST_DELETED, user_id=1, target_user_id=2,
+        ).exists())
+        self.assertEqual(services.get_relationship_counts(1)['outgoing_requests_count'], 0)
+
+    def test_friendship_events(self):
+        def replay(cursor=0, state=None, limit=2):
+            """Потребитель журнала: множества дружб и запросов, восстановленные из событий после cursor"""
+            state = state or {'friendship': set(), 'request': set()}
+            while True:
+                response = self.client.get(f'/api/friendships/events/?since={cursor}&limit={limit}')
+                self.assertEqual(response.status_code, 200)
+                for event in response.data['events']:
+                    self.assertGreater(event['sequence'], cursor)
+                    cursor = event['sequence']
+                    kind, action = event['type'].split('_')
+                    pair = (event['user_id'], event['target_user_id'])
+                    state[kind].add(pair) if action == 'created' else state[kind].discard(pair)
+                self.assertEqual(response.data['cursor'], cursor)
+                if not response.data['has_more']:
+                    return cursor, state
+
+        def current_state():
+            return {
+                'friendship': set(Friendship.objects.values_list('user1', 'user2')),
+                'request': set(FriendRequests.objects.values_list('request_from', 'request_to')),
+            }
+
+        self.make_friends(1, 2)
+        self.make_friends(3, 1)
+        self.client.post('/api/friendships/requests/4-1/send_request/')
+        self.client.post('/api/friendships/requests/1-5/send_request/')
+        cursor, state = replay()
+        self.assertEqual(state, current_state())
+        self.assertEqual(
+            [event['type'] for event in self.client.get('/api/friendships/events/?limit=3').data['events']],
+            ['request_created', 'request_deleted', 'friendship_created'],
+        )
+
+        # Потребитель продолжает с сохранённого курсора; удаление друга и пакетные действия тоже попадают в журнал
+        self.client.post('/api/friendships/delete/2-1/')
+        self.client.post('/api/friendships/requests/5-1/decline_request/')
+        with self.captureOnCommitCallbacks(execute=True):
+            services.apply_request_actions([(6, 7, 'send_request'), (7, 6, 'accept_request'), (8, 1, 'send_request')])
+        cursor, state = replay(cursor, state)
+        self.assertEqual(state, current_state())
+        self.assertEqual(replay(cursor, state)[0], cursor)
+
+        # После сжатия остаётся последнее событие каждой пары, воспроизведение с начала даёт то же состояние
+        total = FriendshipEvent.objects.count()
+        self.assertEqual(events.compact(timezone.now() - timedelta(days=1)), 0)
+        deleted = events.compact(timezone.now() + timedelta(seconds=1), batch_size=3)
+        self.assertEqual(FriendshipEvent.objects.count(), total - deleted)
+        # Запросы 1-2, 3-1, 1-5 и дружба 1-2 (встречные действия 6-7 в одном пакете запрос не создают)
+        self.assertEqual(deleted, 4)
+        self.assertEqual(replay()[1], current_state())
+        call_command('compact_friendship_events', older_than_days=0, stdout=StringIO())
+        self.assertEqual(FriendshipEvent.objects.count(), total - deleted)
+
+        for query in ('since=-1', 'since=abc', 'limit=0', f'limit={events.MAX_BATCH_SIZE + 1}'):
+            self.assertEqual(self.client.get(f'/api/friendships/events/?{query}').status_code, 400)
+
+    def test_friendship_requests_batch(self):
+        self.client.post('/api/friendships/requests/2-1/send_request/')
+        self.client.post('/api/friendships/requests/3-1/send_request/')
+        self.make_friends(1, 4)
+        operations = [
+            (1, 2, 'accept_request'),
+            (1, 3, 'DECLINE_REQUEST'),
+            (1, 4, 'send_request'),
+            (1, 5, 'send_request'),
+            (1, 5, 'send_request'),
+            (5, 1, 'accept_request'),
+            (1, 6, 'send_request'),
+            (1, 6, 'cancel_request'),
+            (7, 1, 'send_request'),
+            (1, 7, 'send_request'),
+            (1, 999, 'send_request'),
+        ]
+        response = self.client.post('/api/friendships/requests/batch/', data={
+            'operations': [
+                {'user_id': user_id, 'target_user_id': target_user_id, 'action': action}
+                for user_id, target_user_id, action in operations
+            ],
+        }, format='json')
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual([item['status'] for item in response.data['results']],
+                         [200, 200, 409, 201, 409, 200, 201, 200, 201, 201, 404])
+        self.assertEqual(response.data['results'][1]['action'], 'decline_request')
+        self.assertEqual(sorted(Friendship.objects.values_list('user1', 'user2')), [(1, 2), (1, 4), (1, 5), (1, 7)])
+        self.assertEqual(FriendRequests.objects.count(), 0)
+        for friend_id in (2, 4, 5, 7):
+            self.assertEqual(is_friends(friend_id, 1), True)
+        self.assertEqual(request_exists(3, 1), False)
+
+        # Конфликт с параллельной вставкой: пакет повторяется по новому состоянию, второй конфликт — 409
+        with mock.patch.object(services, '_create_requests', wraps=services._create_requests,
+                               side_effect=[IntegrityError, mock.DEFAULT]):
+            outcomes = services.apply_request_actions([(8, 9, 'send_request')])
+        self.assertEqual(outcomes, [services.REQUEST_SENT])
+        with mock.patch.object(services, '_create_requests', side_effect=IntegrityError):
+            outcomes = services.apply_request_actions([(8, 10, 'send_request'), (9, 8, 'accept_request')])
+        self.assertEqual(outcomes, [services.CONCURRENT_CHANGE] * 2)
+        self.assertEqual(request_exists(8, 9), True)
+        self.assertEqual(is_friends(8, 9), False)
+
+        response = self.client.post('/api/friendships/requests/batch/', data={
+            'operations': [{'user_id': 1, 'target_user_id': 1, 'action': 'send_request'}],
+        }, format='json')
+        self.assertEqual(response.status_code, 400)
+        response = self.client.post('/api/friendships/requests/batch/', data={
+            'operations': [{'user_id': 1, 'target_user_id': 2, 'action': 'unknown'}],
+        }, format='json')
+        self.assertEqual(response.status_code, 400)
+
+    def test_request_actions_statements(self):
+        def statements(action, user_id, target_user_id):
+            with CaptureQueriesContext(connection) as queries:
+                response = action(user_id, target_user_id)
+            return response.status_code, [
+                (query['sql'].split()[0], re.search(r'(?:FROM|INTO|UPDATE) "(\w+)"', query['sql'])[1])
+                for query in queries.captured_queries
+                if not query['sql'].startswith(('SAVEPOINT', 'RELEASE SAVEPOINT'))
+            ]
+
+        requests, users = 'friendship_friendrequests', 'user_user'
+        # Встречный запрос, условная вставка и один UPDATE счётчиков и версий связей обоих пользователей
+        self.assertEqual(statements(services.send_request, 1, 2),
+                         (201, [('DELETE', requests), ('INSERT', requests), ('UPDATE', users)]))
+        self.assertEqual(request_exists(1, 2), True)
+        # Отказ: вставка не выполнена, статус пары нужен только для ответа
+        self.assertEqual(statements(services.send_request, 1, 2),
+                         (409, [('DELETE', requests), ('INSERT', requests), ('SELECT', 'friendship_friendadjacency')]))
+        self.assertEqual(statements(services.send_request, 1, 999)[0], 404)
+        self.assertEqual(FriendRequests.objects.count(), 1)
+
+        self.assertEqual(statements(services.accept_request, 2, 1), (200, [
+            ('DELETE', requests), ('INSERT', 'friendship_friendship'), ('INSERT', 'friendship_friendadjacency'),
+            ('UPDATE', users),
+        ]))
+        self.assertEqual(Friendship.objects.count(), 1)
+        self.assertEqual(statements(services.accept_request, 2, 1), (404, [('DELETE', requests)]))
+        self.assertEqual(statements(services.send_request, 2, 1)[0], 409)
+        self.assertEqual(services.send_request(2, 1).data['message'], services.ALREADY_FRIENDS.message)
+
+    def test_relationship_counters(self):
+        def counts(user_id):
+            response = self.client.get(f'/api/friendships/{user_id}/counts/')
+            self.assertEqual(response.status_code, 200)
+            return response.data['friends'], response.data['incoming_requests'], response.data['outgoing_requests']
+
+        self.make_friends(1, 2)
+        self.client.post('/api/friendships/requests/1-3/send_request/')
+        self.client.post('/api/friendships/requests/4-1/send_request/')
+        self.client.post('/api/friendships/requests/1-5/send_request/')
+        self.client.post('/api/friendships/requests/5-1/send_request/')
+        self.client.post('/api/friendships/requests/1-3/send_request/')
+        self.client.post('/api/friendships/requests/1-4/decline_request/')
+        self.client.post('/api/friendships/requests/batch/', data={
+            'operations': [
+                {'user_id': 6, 'target_user_id': 1, 'action': 'send_request'},
+                {'user_id': 7, 'target_user_id': 1, 'action': 'send_request'},
+                {'user_id': 1, 'target_user_id': 7, 'action': 'accept_request'},
+            ],
+        }, format='json')
+        self.client.post('/api/friendships/delete/2-1/')
+        self.assertEqual(counts(1), (2, 1, 1))
+        self.assertEqual(counts(3), (0, 1, 0))
+        self.assertEqual(counts(2), (0, 0, 0))
+        with self.assertNumQueries(1):
+            self.client.get('/api/friendships/1/counts/')
+        response = self.client.get('/api/friendships/999/counts/')
+        self.assertEqual((response.status_code, response.json()), (404, {'detail': 'User does not exist'}))
+        self.assertEqual(services.recount_counters(range(1, 13)), 0)
+
+        # Прямые записи в таблицы связей исправляются командой пересчёта
+        Friendship.objects.create(user1_id=8, user2_id=9)
+        User.objects.filter(id=3).update(incoming_requests_count=5)
+        out = StringIO()
+        call_command('repair_relationship_counters', '--batch-size', '5', stdout=out)
+        self.assertIn('Repaired counters of 3 users', out.getvalue())
+        self.assertEqual(counts(8), (1, 0, 0))
+        self.assertEqual(counts(3), (0, 1, 0))
+
+    def test_benchmark(self):
+        routes = {f'api/{pattern.pattern}' for module in (user_urls, friendship_urls) for pattern in module.urlpatterns}
+        self.assertEqual(set(bench.SCENARIOS), routes)
+
+        Friendship.objects.all().delete()
+        User.objects.all().delete()
+        state = bench.generate(users=60, average_degree=6, request_ratio=0.2, seed=1)
+        self.assertEqual(len(state.user_ids), 60)
+        self.assertEqual(len(state.friendships) + len(state.requests), 3 + 3 * 57)
+        self.assertEqual(FriendAdjacency.objects.count(), 2 * len(state.friendships))
+        self.assertEqual(services.recount_counters(state.user_ids), 0)
+
+        results = bench.run(state, calls=3)
+        self.assertEqual(set(results), routes)
+        for result in results.values():
+            self.assertEqual(result['errors'], 0)
+            self.assertLessEqual(result['p50_ms'], result['p99_ms'])
+        self.assertEqual(results['api/friendships/<int:user_id>/counts/']['queries_per_call'], 1)
+
+        baseline = {route: dict(result) for route, result in results.items()}
+        self.assertEqual(bench.compare(results, baseline, threshold=0.2), [])
+        baseline['api/friendships/status/batch/']['queries_per_call'] = 0.5
+        self.assertEqual(bench.compare(results, baseline, threshold=0.2),
+                         ['api/friendships/status/batch/: queries_per_call 0.50 -> 1.00'])
+
+    def test_conditional_get(self):
+        def conditional_get(url, etag, expected_status):
+            response = self.client.get(url, HTTP_IF_NONE_MATCH=etag)
+            self.assertEqual(response.status_code, expected_status)
+            return response
+
+        self.make_friends(1, 2)
+        self.client.post('/api/friendships/requests/3-1/send_request/')
+        for url in ('/api/friendships/1/', '/api/friendships/1/?limit=1', '/api/friendships/requests/1/incoming/',
+                    '/api/friendships/status/1-2/'):
+            response = self.client.get(url)
+            etag = response['ETag']
+            # 304 отдаётся после одного запроса версии, без запросов списка и сериализации
+            with self.assertNumQueries(1):
+                response = conditional_get(url, etag, 304)
+            self.assertEqual(response.content, b'')
+            self.assertEqual(response['ETag'], etag)
+
+        etags = {url: self.client.get(url)['ETag'] for url in ('/api/friendships/1/', '/api/friendships/1/?limit=1')}
+        self.assertNotEqual(*etags.values())
+
+        # Изменение связей пользователя меняет версию
+        self.client.post('/api/friendships/requests/1-3/accept_request/')
+        response = conditional_get('/api/friendships/1/', etags['/api/friendships/1/'], 200)
+        self.assertEqual([user['id'] for user in response.data['friends']], [2, 3])
+        self.assertNotEqual(response['ETag'], etags['/api/friendships/1/'])
+
+        # Действия других пользователей версию не меняют
+        etag = self.client.get('/api/friendships/1/')['ETag']
+        self.make_friends(4, 5)
+        self.client.post('/api/friendships/delete/2-1/')
+        conditional_get('/api/friendships/1/', etag, 200)
+        etag = self.client.get('/api/friendships/1/')['ETag']
+        self.make_friends(4, 6)
+        conditional_get('/api/friendships/1/', etag, 304)
+
+        self.assertNotIn('ETag', self.client.get('/api/friendships/999/'))
+
+    def test_list_fields(self):
+        for target_user_id in (2, 3, 4):
+            self.make_friends(1, target_user_id)
+        self.make_friends(2, 3)
+        self.client.post('/api/friendships/requests/5-1/send_request/')
+
+        response = self.client.get('/api/friendships/1/')
+        self.assertEqual(response.data['friends'], [{'id': 2, 'username': 'Петя'}, {'id': 3, 'username': 'Коля'},
+                                                    {'id': 4, 'username': 'Саша'}])
+        # Без username страница строится из списка id в кэше связей без запроса пользователей
+        with CaptureQueriesContext(connection) as queries:
+            response = self.client.get('/api/friendships/1/?fields=id')
+        self.assertEqual(response.data['friends'], [{'id': 2}, {'id': 3}, {'id': 4}])
+        self.assertEqual(len(queries.captured_queries), 1)
+
+        response = self.client.get('/api/friendships/requests/1/incoming/?fields=username,id')
+        self.assertEqual(response.data['requests_users'], [{'username': 'Маша', 'id': 5}])
+        # Списки друзей загружаются в кэш при первом запросе, без username повторный читает только версии связей
+        self.client.get('/api/friendships/2-3/mutual/?fields=id')
+        with self.assertNumQueries(1):
+            response = self.client.get('/api/friendships/2-3/mutual/?fields=id')
+        self.assertEqual(response.data['users'], [{'id': 1}])
+        response = self.client.get('/api/friendships/2-3/mutual/')
+        self.assertEqual(response.data['users'], [{'id': 1, 'username': 'Вася'}])
+
+        for fields in ('', 'id,password', 'name'):
+            response = self.client.get(f'/api/friendships/1/?fields={fields}')
+            self.assertEqual(response.status_code, 400)
+
+    def test_fast_json_renderer(self):
+        data = {'friends': [{'id': 1, 'username': 'Вася "В"'}], 'next': None, 'count': 1, 'ratio': 0.5}
+        self.assertEqual(FastJSONRenderer().render(data), JSONRenderer().render(data))
+        self.assertEqual(FastJSONRenderer().render(data, 'application/json; indent=2'),
+                         JSONRenderer().render(data, 'application/json; indent=2'))
+        self.assertEqual(FastJSONRenderer().render({1: Decimal('1.5')}), JSONRenderer().render({1: Decimal('1.5')}))
+        # Разделители строк экранируются, даты выводятся encoder DRF, как у JSONRenderer
+        data = {'username': 'Вася\u2028\u2029–', 'created_at': timezone.now(), 'date': timezone.now().date()}
+        self.assertEqual(FastJSONRenderer().render(data), JSONRenderer().render(data))
+        self.assertIn(b'\\u2028\\u2029', FastJSONRenderer().render(data))
+        # NaN — задокументированное отличие: orjson выводит null, JSONRenderer отклоняет
+        self.assertEqual(FastJSONRenderer().render({'ratio': float('nan')}), b'{"ratio":null}')
+        with self.assertRaises(ValueError):
+            JSONRenderer().render({'ratio': float('nan')})
+
+        result = bench.measure_serialization(rows=10, repeat=1)
+        self.assertEqual(result['rows'], 10)
+        self.assertGreater(result['model_serializer_ms'], 0)
+
+
+    def test_async_views(self):
+        def assert_same(url):
+            response = self.client.get(url)
+            async_url = url.replace('/api/', '/api/async/', 1)
+            async_response = self.client.get(async_url)
+            self.assertEqual(async_response.status_code, response.status_code, url)
+            # ETag зависит от пути запроса, поэтому у async-маршрута он свой
+            self.assertEqual('ETag' in async_response, 'ETag' in response, url)
+            if 'ETag' in async_response:
+                conditional = self.client.get(async_url, HTTP_IF_NONE_MATCH=async_response['ETag'])
+                self.assertEqual(conditional.status_code, 304, url)
+                self.assertEqual(conditional['ETag'], async_response['ETag'])
+            if response.status_code != 304:
+                self.assertEqual(async_response.content.decode().replace('/api/async/', '/api/'),
+                                 response.content.decode(), url)
+            return response
+
+        for target_user_id in (2, 3, 4):
+            self.make_friends(1, target_user_id)
+        self.client.post('/api/friendships/requests/5-1/send_request/')
+        self.client.post('/api/friendships/requests/1-6/send_request/')
+
+        response = assert_same('/api/friendships/1/?limit=2&count=true')
+        assert_same(response.data['next'].split('testserver')[1])
+        for url in ('/api/friendships/1/?fields=id', '/api/friendships/requests/1/incoming/',
+                    '/api/friendships/requests/1/OUTGOING/', '/api/friendships/status/1-2/',
+                    '/api/friendships/status/1-5/', '/api/friendships/status/1-999/', '/api/friendships/999/'):
+            assert_same(url)
+        for url in ('/api/friendships/status/1-1/', '/api/friendships/requests/1/all/',
+                    '/api/friendships/1/?fields=name'):
+            self.assertEqual(assert_same(url).status_code, 400)
+        self.assertEqual(assert_same('/api/friendships/1/?cursor=invalid').status_code, 404)
+
+        # Сравнение ведётся по шаблону маршрута; у async-маршрутов свои метрики
+        self.client.get('/api/async/friendships/1/')
+        self.assertIn('route="api/async/friendships/<int:user_id>/"', self.client.get('/metrics').content.decode())
+
+
+class StreamConnection:
+    """Клиент ASGI-приложения friendship.notifications.mount в тесте"""
+
+    def __init__(self, path: str, method: str = 'GET', host: str = 'testserver'):
+        self.sent = asyncio.Queue()
+        self.disconnected = asyncio.Event()
+        self.django_requests = []
+        application = notifications.mount(self._django_application)
+        scope = {'type': 'http', 'method': method, 'path': path, 'headers': [(b'host', host.encode())]}
+        self.task = asyncio.ensure_future(application(scope, self._receive, self.sent.put))
+
+    async def _django_application(self, scope, receive, send):
+        self.django_requests.append(scope['path'])
+
+    async def _receive(self):
+        await self.disconnected.wait()
+        return {'type': 'http.disconnect'}
+
+    async def next(self) -> dict:
+        return await asyncio.wait_for(self.sent.get(), 5)
+
+    async def next_event(self) -> tuple[str, dict]:
+        lines = (await self.next())['body'].decode().splitlines()
+        return lines[0].removeprefix('event: '), json.loads(lines[1].removeprefix('data: '))
+
+    async def close(self):
+        self.disconnected.set()
+        await asyncio.wait_for(self.task, 5)
+
+
+class FriendshipNotificationsTestCase(APITestCase):
+    def setUp(self):
+        super().setUp()
+        relationship_cache.clear()
+        for username in ('Вася', 'Петя', 'Коля'):
+            self.client.post('/api/users/', data={'username': username})
+
+    def action(self, action, user_id, target_user_id):
+        def run():
+            with self.captureOnCommitCallbacks(execute=True):
+                action(user_id, target_user_id)
+        return sync_to_async(run)()
+
+    async def test_notification_stream(self):
+        connection_ = StreamConnection('/api/async/friendships/2/notifications/')
+        start = await connection_.next()
+        self.assertEqual(start['status'], 200)
+        self.assertIn((b'content-type', b'text/event-stream'), start['headers'])
+        self.assertEqual((await connection_.next())['body'], b'retry: 3000\n\n')
+        self.assertEqual(notifications.get_broker().subscriber_count, 1)
+
+        await self.action(services.send_request, 1, 2)
+        self.assertEqual(await connection_.next_event(), ('request_created', {'user_id': 1, 'target_user_id': 2}))
+        # Изменения, не касающиеся пользователя, и отклонения не отправляются
+        await self.action(services.send_request, 3, 1)
+        await self.action(services.send_request, 2, 3)
+        await self.action(services.decline_request, 3, 2)
+        await self.action(services.accept_request, 2, 1)
+        self.assertEqual(await connection_.next_event(), ('friendship_created', {'user_id': 1, 'target_user_id': 2}))
+
+        await connection_.close()
+        self.assertEqual(notifications.get_broker().subscriber_count, 0)
+        self.assertTrue(connection_.sent.empty())
+
+    async def test_notification_stream_heartbeat(self):
+        with override_settings(FRIENDSHIP_NOTIFICATIONS={**settings.FRIENDSHIP_NOTIFICATIONS,
+                                                         'HEARTBEAT': 0.01}):
+            connection_ = StreamConnection('/api/async/friendships/1/notifications/')
+            for _ in range(2):
+                await connection_.next()
+            self.assertEqual((await connection_.next())['body'], b': ping\n\n')
+            await connection_.close()
+
+    async def test_notification_stream_errors(self):
+        for path, method, status_code in (('/api/async/friendships/999/notifications/', 'GET', 404),
+                                          ('/api/async/friendships/1/notifications/', 'POST', 405)):
+            connection_ = StreamConnection(path, method)
+            self.assertEqual((await connection_.next())['status'], status_code)
+            await connection_.close()
+        # Middleware Django к потоку не применяются, Host проверяет сам mount
+        with override_settings(ALLOWED_HOSTS=['testserver']):
+            connection_ = StreamConnection('/api/async/friendships/1/notifications/', host='evil.example')
+            self.assertEqual((await connection_.next())['status'], 400)
+            await connection_.close()
+
+        connection_ = StreamConnection('/api/async/friendships/1/')
+        await connection_.close()
+        self.assertEqual(connection_.django_requests, ['/api/async/friendships/1/'])
+
+    async def test_event_log_broker(self):
+        broker = notifications.EventLogBroker(poll_interval=0.01)
+        subscription = broker.subscribe(2)
+        # Опрос начинает с последнего события на момент подписки
+        await asyncio.sleep(0.05)
+        # События журнала записываются после коммита
+        await self.action(services.send_request, 1, 2)
+        await self.action(services.send_request, 3, 1)
+        await asyncio.wait_for(subscription.wait(5), 5)
+        self.assertEqual(list(subscription.messages), [('request_created', {'user_id': 1, 'target_user_id': 2})])
+        broker.unsubscribe(subscription)
+
+
+class FriendshipConcurrencyTestCase(TransactionTestCase):
+    threads = 8
+    rounds = 30
+
+    def setUp(self):
+        relationship_cache.clear()
+        self.user_ids = [User.objects.create(username=f'user{index}').id for index in range(4)]
+
+    def test_measure_concurrency(self):
+        # Настоящие WSGI/ASGI-обработчики закрывают соединения после запроса, поэтому нужен TransactionTestCase
+        state = bench.generate(users=30, average_degree=4, request_ratio=0.2, seed=1)
+        results = bench.measure_concurrency(state, connections=4, requests_per_connection=2, client_delay_ms=1,
+                                            threads=2)
+        self.assertEqual(set(results), {'sync', 'async'})
+        self.assertEqual(results['sync']['threads'], 2)
+        for result in results.values():
+            self.assertEqual(result['requests'], 8)
+            self.assertEqual(result['errors'], 0)
+
+    def test_measure_notification_streams(self):
+        # Потоки проверяют пользователя из другого потока, поэтому данные должны быть закоммичены
+        state = bench.generate(users=30, average_degree=4, request_ratio=0.2, seed=1)
+        result = bench.measure_notification_streams(state, connections=20)
+        self.assertEqual(result['delivered'], 20)
+        self.assertLess(result['bytes_per_connection'], 32 * 1024)
+        self.assertEqual(notifications.get_broker().subscriber_count, 0)
+
+    def test_concurrent_requests_same_pair(self):
+        first, second = self.user_ids[:2]
+        actions = (services.send_request, services.accept_request, services.decline_request, services.cancel_request)
+        barrier = threading.Barrier(self.threads)
+        status_codes = []
+        errors = []
+
+        def worker(seed):
+            generator = random.Random(seed)
+            try:
+                barrier.wait()
+                for _ in range(self.rounds):
+                    user_id, target_user_id = generator.choice(((first, second), (second, first)))
+                    action = generator.choice(actions)
+                    status_codes.append(action(user_id, target_user_id).status_code)
+                    # Время от времени пара снова становится свободной, чтобы гонки повторялись
+                    if generator.random() < 0.2:
+                        services.delete_friendship(user_id, target_user_id)
+            except Exception as error:
+                errors.append(error)
+            finally:
+                connection.close()
+
+        workers = [threading.Thread(target=worker, args=(seed,)) for seed in range(self.threads)]
+        for thread in workers:
+            thread.start()
+        for thread in workers:
+            thread.join()
+
+        self.assertEqual(errors, [])
+        self.assertEqual(set(status_codes) - {200, 201, 404, 409}, set())
+        friendships = Friendship.objects.filter(user1=first, user2=second).count()
+        self.assertLessEqual(friendships, 1)
+        self.assertEqual(FriendAdjacency.objects.count(), 2 * friendships)
+        self.assertLessEqual(FriendRequests.objects.count(), 1 - friendships)
+        self.assertEqual(services.recount_counters(self.user_ids), 0)
+
+    def test_concurrent_batches(self):
+        # Пакеты читают состояние перед записью: без начальной записи SQLite сразу отвечает "database is locked"
+        pairs = [(user_id, target_user_id) for user_id in self.user_ids for target_user_id in self.user_ids
+                 if user_id != target_user_id]
+        barrier = threading.Barrier(self.threads)
+        errors = []
+
+        def worker(index):
+            generator = random.Random(index)
+            try:
+                barrier.wait()
+                for _ in range(self.rounds):
+                    if index % 2:
+                        services.send_request(*generator.choice(pairs))
+                    else:
+                        services.apply_request_actions(
+                            [(*generator.choice(pairs), generator.choice(services.REQUEST_ACTIONS)) for _ in range(3)],
+                        )
+                    if generator.random() < 0.2:
+                        services.delete_friendship(*generator.choice(pairs))
+            except Exception as error:
+                errors.append(error)
+            finally:
+                connection.close()
+
+        workers = [threading.Thread(target=worker, args=(index,)) for index in range(self.threads)]
+        for thread in workers:
+            thread.start()
+        for thread in workers:
+            thread.join()
+
+        self.assertEqual(errors, [])
+        self.assertEqual(services.recount_counters(self.user_ids), 0)
+
+
+class FriendshipShardingTestCase(TransactionTestCase):
+    """Связи на двух шардах; пользователи, счётчики и журнал событий — в основной базе"""
+    SHARDS = ('shard_1', 'shard_2')
+
+    def setUp(self):
+        relationship_cache.clear()
+        self.directory = tempfile.TemporaryDirectory()
+        for alias in self.SHARDS:
+            connections.settings[alias] = {
+                **connection.settings_dict,
+                'NAME': Path(self.directory.name) / f'{alias}.sqlite3',
+                'OPTIONS': {
+                    **connection.settings_dict['OPTIONS'],
+                    'pragmas': {**connection.settings_dict['OPTIONS']['pragmas'], 'foreign_keys': 0},
+                },
+            }
+        settings_override = override_settings(FRIENDSHIP_SHARDS=list(self.SHARDS))
+        settings_override.enable()
+        self.addCleanup(settings_override.disable)
+        for alias in self.SHARDS:
+            call_command('migrate', database=alias, verbosity=0)
+            # Миграции снова включают внешние ключи в своём соединении
+            connections[alias].close()
+        self.users = [User.objects.create(username=f'user{index}').id for index in range(8)]
+
+    def tearDown(self):
+        sharding.shutdown()
+        for alias in self.SHARDS:
+            connections[alias].close()
+            del connections[alias]
+            del connections.settings[alias]
+        self.directory.cleanup()
+
+    def pairs(self, same_shard: bool) -> list[tuple[int, int]]:
+        return [
+            (user_id, target_user_id)
+            for index, user_id in enumerate(self.users)
+            for target_user_id in self.users[index + 1:]
+            if (sharding.shard_for(user_id) == sharding.shard_for(target_user_id)) == same_shard
+        ]
+
+    @staticmethod
+    def stored(alias: str) -> tuple[list, list, list]:
+        return (
+            sorted(FriendRequests.objects.using(alias).values_list('request_from', 'request_to')),
+            sorted(Friendship.objects.using(alias).values_list('user1', 'user2')),
+            sorted(FriendAdjacency.objects.using(alias).values_list('owner', 'friend')),
+        )
+
+    def test_sharded_relationships(self):
+        self.assertEqual({sharding.shard_for(user_id) for user_id in self.users}, set(self.SHARDS))
+        user_id, target_user_id = self.pairs(same_shard=False)[0]
+        shard, mirror = sharding.pair_shards(user_id, target_user_id)
+
+        response = self.client.post(f'/api/friendships/requests/{user_id}-{target_user_id}/send_request/')
+        self.assertEqual(response.status_code, 201)
+        # Запрос пары с разных шардов хранится в обоих
+        for alias in (shard, mirror):
+            self.assertEqual(self.stored(alias), ([(user_id, target_user_id)], [], []))
+        self.assertEqual(FriendRequests.objects.using('default').count(), 0)
+        response = self.client.post(f'/api/friendships/requests/{user_id}-{target_user_id}/send_request/')
+        self.assertEqual(response.status_code, 409)
+
+        for prefix in ('/api', '/api/async'):
+            response = self.client.get(f'{prefix}/friendships/status/{target_user_id}-{user_id}/')
+            self.assertEqual(response.json()['status'], FriendRequests.RequestStatus.INCOMING_REQUEST.name)
+            response = self.client.get(f'{prefix}/friendships/requests/{target_user_id}/incoming/')
+            self.assertEqual(response.json()['requests_users'],
+                             [{'id': user_id, 'username': User.objects.get(id=user_id).username}])
+        self.assertEqual(services.get_relationship_counts(target_user_id)['incoming_requests_count'], 1)
+
+        response = self.client.post(f'/api/friendships/requests/{target_user_id}-{user_id}/accept_request/')
+        self.assertEqual(response.status_code, 200)
+        # У каждого владельца запись FriendAdjacency в его шарде
+        self.assertEqual(self.stored(shard), ([], [(user_id, target_user_id)], [(user_id, target_user_id)]))
+        self.assertEqual(self.stored(mirror), ([], [(user_id, target_user_id)], [(target_user_id, user_id)]))
+        for prefix in ('/api', '/api/async'):
+            response = self.client.get(f'{prefix}/friendships/{target_user_id}/?fields=id')
+            self.assertEqual(response.json()['friends'], [{'id': user_id}])
+
+        other_id = next(other for other in self.users if other not in (user_id, target_user_id))
+        services.send_request(target_user_id, other_id)
+        services.accept_request(other_id, target_user_id)
+        self.assertEqual(list(services.get_mutual_friend_ids(user_id, other_id)), [target_user_id])
+        self.assertEqual(services.get_friend_recommendations(user_id, 10), [(other_id, 1)])
+        response = self.client.post('/api/friendships/status/batch/', data={
+            'user_id': target_user_id, 'target_ids': [user_id, other_id, self.users[-1] + 1],
+        }, format='json')
+        self.assertEqual([item['status'] for item in response.json()['statuses']],
+                         [FriendRequests.RequestStatus.ALREADY_FRIENDS.name] * 2
+                         + [FriendRequests.RequestStatus.EMPTY.name])
+
+        response = self.client.post(f'/api/friendships/delete/{user_id}-{target_user_id}/')
+        self.assertEqual(response.status_code, 200)
+        self.assertFalse(services.delete_friendship(user_id, target_user_id))
+        for alias in (shard, mirror):
+            self.assertNotIn((user_id, target_user_id), self.stored(alias)[1])
+        self.assertEqual(services.get_relationship_counts(target_user_id)['friends_count'], 1)
+        self.assertEqual(
+            list(FriendshipEvent.objects.order_by('id').values_list('type', flat=True)),
+            [FriendshipEvent.Type.REQUEST_CREATED, FriendshipEvent.Type.REQUEST_DELETED,
+             FriendshipEvent.Type.FRIENDSHIP_CREATED] * 2 + [FriendshipEvent.Type.FRIENDSHIP_DELETED],
+        )
+
+        User.objects.filter(id=user_id).update(friends_count=7)
+        self.assertEqual(services.recount_counters(self.users), 1)
+        self.assertEqual(services.get_relationship_counts(user_id)['friends_count'], 0)
+        with self.assertRaises(RuntimeError):
+            Friendship.objects.count()
+
+    def test_sharded_requests_batch(self):
+        user = dict(zip(range(1, 8), self.users))
+        user[999] = self.users[-1] + 1
+        services.send_request(user[2], user[1])
+        services.send_request(user[3], user[1])
+        services.send_request(user[1], user[4])
+        services.accept_request(user[4], user[1])
+        operations = [
+            (1, 2, 'accept_request'), (1, 3, 'decline_request'), (1, 4, 'send_request'), (1, 5, 'send_request'),
+            (1, 5, 'send_request'), (5, 1, 'accept_request'), (1, 6, 'send_request'), (1, 6, 'cancel_request'),
+            (7, 1, 'send_request'), (1, 7, 'send_request'), (1, 999, 'send_request'),
+        ]
+        outcomes = services.apply_request_actions(
+            [(user[user_id], user[target_user_id], action) for user_id, target_user_id, action in operations],
+        )
+        self.assertEqual([outcome.status for outcome in outcomes], [200, 200, 409, 201, 409, 200, 201, 200, 201, 201, 404])
+        self.assertEqual(sorted(services.get_user_friend_ids(user[1])), sorted(user[index] for index in (2, 4, 5, 7)))
+        for alias in self.SHARDS:
+            self.assertEqual(self.stored(alias)[0], [])
+        self.assertEqual(services.recount_counters(self.users), 0)
+
+        # Конфликт с параллельной вставкой: действие повторяется, второй конфликт отображается как без шардов
+        with mock.patch.object(services, '_insert_request', wraps=services._insert_request,
+                               side_effect=[IntegrityError, mock.DEFAULT]):
+            self.assertEqual(services.apply_request_actions([(user[2], user[3], 'send_request')]),
+                             [services.REQUEST_SENT])
+        self.assertTrue(request_exists(user[2], user[3]))
+        with mock.patch.object(services, '_create_shard_friendships', side_effect=IntegrityError):
+            self.assertEqual(services.apply_request_actions([(user[3], user[2], 'accept_request')]),
+                             [services.CONCURRENT_CHANGE])
+        with mock.patch.object(services, '_insert_request', side_effect=IntegrityError):
+            self.assertEqual(services.send_request(user[3], user[4]).status_code, 409)
+        self.assertTrue(request_exists(user[2], user[3]))
+        self.assertFalse(is_friends(user[2], user[3]))
+        self.assertEqual(services.recount_counters(self.users), 0)
+
+    def test_repair_shards(self):
+        cross_shard = self.pairs(same_shard=False)
+        user_id, target_user_id = cross_shard[0]
+        other_id, other_target_id = next(pair for pair in cross_shard if not {user_id, target_user_id} & set(pair))
+        services.send_request(user_id, target_user_id)
+        services.send_request(other_id, other_target_id)
+        services.accept_request(other_target_id, other_id)
+        expected = {alias: self.stored(alias) for alias in self.SHARDS}
+
+        # Сбой после коммита основной копии: зеркала и счётчики не обновлены
+        _, mirror = sharding.pair_shards(user_id, target_user_id)
+        FriendRequests.objects.using(mirror).filter(request_from=user_id).delete()
+        _, mirror = sharding.pair_shards(other_id, other_target_id)
+        Friendship.objects.using(mirror).filter(user1=other_id, user2=other_target_id).delete()
+        FriendAdjacency.objects.using(mirror).filter(owner=other_target_id).delete()
+        User.objects.filter(id=target_user_id).update(incoming_requests_count=0)
+        self.assertEqual(sharding.find_diverged_pairs(), {(user_id, target_user_id), (other_id, other_target_id)})
+
+        output = StringIO()
+        call_command('repair_shards', stdout=output)
+        self.assertIn('Repaired 2 pairs and counters of 1 users', output.getvalue())
+        self.assertEqual({alias: self.stored(alias) for alias in self.SHARDS}, expected)
+        self.assertTrue(request_exists(user_id, target_user_id))
+        self.assertEqual(services.get_relationship_status(target_user_id, user_id),
+                         FriendRequests.RequestStatus.INCOMING_REQUEST)
+        self.assertTrue(is_friends(other_target_id, other_id))
+
+        output = StringIO()
+        call_command('repair_shards', stdout=output)
+        self.assertIn('Repaired 0 pairs and counters of 0 users', output.getvalue())
+
+    def test_fan_out(self):
+        rows = sharding.fan_out(
+            lambda shard, user_ids: [(user_id, shard, threading.current_thread().name) for user_id in user_ids],
+            self.users,
+        )
+        self.assertEqual(sorted((user_id, shard) for user_id, shard, _ in rows),
+                         [(user_id, sharding.shard_for(user_id)) for user_id in sorted(self.users)])
+        # Шарды опрашиваются из потоков пула
+        self.assertTrue(all(thread.startswith('shard') for _, _, thread in rows))
+
+    def test_fan_out_metrics(self):
+        user_id, target_user_id = self.pairs(same_shard=False)[0]
+        route = ('api/friendships/<int:user_id>-<int:target_user_id>/mutual/', 'GET', 200)
+        queries = []
+        for _ in range(2):
+            metrics.registry.reset()
+            self.client.get(f'/api/friendships/{user_id}-{target_user_id}/mutual/')
+            queries.append(metrics.registry.collect()[route].queries)
+        # Промах кэша — по запросу к каждому шарду из потоков пула
+        self.assertEqual(queries[0] - queries[1], 2)
@@ -1,12 +1,30 @@
 from django.urls import path
 
+from friendship.async_views import AsyncFriendshipsListView, AsyncFriendshipRequestsListView, \
+    AsyncFriendshipStatusView
 from friendship.views import FriendshipStatusView, FriendshipRequestsView, FriendshipsListView, \
-    FriendshipRequestsListView, DeleteFriendView
+    FriendshipRequestsListView, DeleteFriendView, FriendshipBatchStatusView, FriendshipCacheStatsView, \
+    MutualFriendsView, MutualFriendsBatchView, FriendRecommendationsView, FriendshipRequestsBatchView, \
+    FriendshipCountsView, FriendshipEventsView, FriendshipPathView
 
 urlpatterns = [
+    path('friendships/requests/batch/', FriendshipRequestsBatchView.as_view(), name='friendship_requests_batch'),
     path('friendships/requests/<int:user_id>-<int:target_user_id>/<str:action>/', FriendshipRequestsView.as_view(), name='new_friendship_request'),
     path('friendships/requests/<int:user_id>/<str:requests_type>/', FriendshipRequestsListView.as_view(), name='new_friendship_request'),
     path('friendships/delete/<int:user_id>-<int:target_user_id>/', DeleteFriendView.as_view(), name='delete_friendship'),
     path('friendships/status/<int:user_id>-<int:target_user_id>/', FriendshipStatusView.as_view(), name='friendship_status'),
+    path('friendships/status/batch/', FriendshipBatchStatusView.as_view(), name='friendship_batch_status'),
+    path('friendships/events/', FriendshipEventsView.as_view(), name='friendship_events'),
+    path('friendships/cache/stats/', FriendshipCacheStatsView.as_view(), name='friendship_cache_stats'),
+    path('friendships/path/<int:user_id>-<int:target_user_id>/', FriendshipPathView.as_view(), name='friendship_path'),
+    path('friendships/mutual/batch/', MutualFriendsBatchView.as_view(), name='mutual_friends_batch'),
+    path('friendships/<int:user_id>-<int:target_user_id>/mutual/', MutualFriendsView.as_view(), name='mutual_friends'),
+    path('friendships/<int:user_id>/counts/', FriendshipCountsView.as_view(), name='friendship_counts'),
+    path('friendships/<int:user_id>/recommendations/', FriendRecommendationsView.as_view(), name='friend_recommendations'),
     path('friendships/<int:user_id>/', FriendshipsListView.as_view(), name='friendships_list'),
+    path('async/friendships/requests/<int:user_id>/<str:requests_type>/', AsyncFriendshipRequestsListView.as_view(),
+         name='async_friendship_requests_list'),
+    path('async/friendships/status/<int:user_id>-<int:target_user_id>/', AsyncFriendshipStatusView.as_view(),
+         name='async_friendship_status'),
+    path('async/friendships/<int:user_id>/', AsyncFriendshipsListView.as_view(), name='async_friendships_list'),
 ]
@@ -1,23 +1,73 @@
-from django.db.models import Q
+import hashlib
+
+from django.conf import settings
+from django.utils.cache import get_conditional_response
+from django.utils.http import quote_etag
 from drf_spectacular.utils import extend_schema, OpenApiParameter, OpenApiExample
 from rest_framework import status
-from rest_framework.exceptions import ValidationError
-from rest_framework.generics import ListAPIView
+from rest_framework.exceptions import NotFound, ValidationError
 from rest_framework.response import Response
 from rest_framework.views import APIView
 
-from friendship.models import Friendship, FriendRequests
-from friendship.services import send_request, accept_request, decline_request, cancel_request, is_friends, \
-    request_exists, get_incoming_requests, get_outgoing_requests, get_user_friends
+from friendship.services import send_request, accept_request, decline_request, cancel_request, \
+    get_incoming_request_ids, get_outgoing_request_ids, get_user_friend_ids, delete_friendship, \
+    get_relationship_status, get_relationship_statuses, get_mutual_friend_ids, count_mutual_friends, \
+    get_friend_recommendations, apply_request_actions, get_relationship_counts, get_relationship_versions, \
+    find_friendship_path
 from user.models import User
+from friendship import cache as relationship_cache, events
+from friendship.pagination import SortedIdsPagination
+from friendship.serializers import UserTargetsSerializer, RequestActionsBatchSerializer
 from user.serializers import UserSerializer
 
 
+def _etag(request, versions) -> str:
+    """ETag из версий связей и пути запроса: у каждой страницы и набора полей свой тег"""
+    digest = hashlib.blake2b(request.get_full_path().encode(), digest_size=8).hexdigest()
+    return quote_etag('-'.join(map(str, versions)) + f'-{digest}')
+
+
+def _conditional(request, versions, build_response) -> Response:
+    """Условный GET: 304 без построения ответа при совпадении If-None-Match"""
+    if versions is None:
+        return build_response()
+    etag = _etag(request, versions)
+    response = get_conditional_response(request, etag=etag)
+    if response is None:
+        response = build_response()
+        if response.status_code != status.HTTP_200_OK:
+            return response
+    response['ETag'] = etag
+    return response
+
+
+# Поля пользователя в списках; ?fields= выбирает их подмножество
+USER_FIELDS = ('id', 'username')
+
+
+def _user_fields(request) -> tuple[str, ...]:
+    fields = request.GET.get('fields')
+    if fields is None:
+        return USER_FIELDS
+    fields = tuple(dict.fromkeys(field.strip() for field in fields.split(',') if field.strip()))
+    if not fields or set(fields) - set(USER_FIELDS):
+        raise ValidationError(f'fields must be a comma-separated subset of: {", ".join(USER_FIELDS)}')
+    return fields
+
+
+def _user_page(page, fields) -> list[dict]:
+    """Пользователи страницы id в формате UserSerializer; при ?fields=id без запроса к базе"""
+    if fields == ('id',):
+        return [{'id': user_id} for user_id in page]
+    return list(User.objects.filter(id__in=page).order_by('id').values(*fields)) if page else []
+
+
 @extend_schema(
     summary='Отображение списка друзей пользователя',
     methods=['GET'],
     responses={
         status.HTTP_200_OK: dict,
+        status.HTTP_304_NOT_MODIFIED: None,
     },
     parameters=[
         OpenApiParameter(
@@ -27,6 +77,34 @@ from user.serializers import UserSerializer
             type=int,
             location='path',
         ),
+        OpenApiParameter(
+            name='fields',
+            description='Поля пользователей через запятую (id, username; по умолчанию все)',
+            required=False,
+            type=str,
+            location='query',
+        ),
+        OpenApiParameter(
+            name='limit',
+            description='Размер страницы',
+            required=False,
+            type=int,
+            location='query',
+        ),
+        OpenApiParameter(
+            name='cursor',
+            description='Курсор страницы из ссылок next/previous',
+            required=False,
+            type=str,
+            location='query',
+        ),
+        OpenApiParameter(
+            name='count',
+            description='Считать ли общее количество записей (по умолчанию false)',
+            required=False,
+            type=bool,
+            location='query',
+        ),
     ],
     examples=[
         OpenApiExample(
@@ -42,20 +120,32 @@ from user.serializers import UserSerializer
                         'username': 'Кирилл',
                     },
                 ],
+                'next': 'http://localhost:8000/api/friendships/3/?cursor=cD0y',
+                'previous': None,
             },
             status_codes=['200'],
         ),
     ],
 )
-class FriendshipsListView(ListAPIView):
+class FriendshipsListView(APIView):
     """Отображение списка друзей пользователя"""
-    serializer_class = UserSerializer
+    pagination_class = SortedIdsPagination
+
+    def get(self, request, user_id: int) -> Response:
+        fields = _user_fields(request)
+        # Счётчики и версия связей читаются одним запросом до списка: по версии строятся ETag и ключ кэша связей
+        counts = get_relationship_counts(user_id)
+        return _conditional(request, counts and (counts['relationship_version'],),
+                            lambda: self.list(request, user_id, fields, counts))
 
-    def list(self, request, *args, **kwargs):
-        user_id = self.kwargs.get('user_id')
-        friends = get_user_friends(user_id)
-        serializer = self.get_serializer(friends, many=True)
-        return Response({'friends': serializer.data})
+    def list(self, request, user_id: int, fields, counts) -> Response:
+        friend_ids = get_user_friend_ids(user_id, counts['relationship_version']) if counts else []
+        paginator = self.pagination_class()
+        page = paginator.paginate_ids(friend_ids, request)
+        data = {'friends': _user_page(page, fields), **paginator.get_links()}
+        if paginator.include_count(request):
+            data['count'] = counts['friends_count'] if counts else 0
+        return Response(data)
 
 
 @extend_schema(
@@ -63,6 +153,7 @@ class FriendshipsListView(ListAPIView):
     methods=['GET'],
     responses={
         status.HTTP_200_OK: dict,
+        status.HTTP_304_NOT_MODIFIED: None,
         status.HTTP_400_BAD_REQUEST: str,
     },
     parameters=[
@@ -80,6 +171,34 @@ class FriendshipsListView(ListAPIView):
             type=str,
             location='path',
         ),
+        OpenApiParameter(
+            name='fields',
+            description='Поля пользователей через запятую (id, username; по умолчанию все)',
+            required=False,
+            type=str,
+            location='query',
+        ),
+        OpenApiParameter(
+            name='limit',
+            description='Размер страницы',
+            required=False,
+            type=int,
+            location='query',
+        ),
+        OpenApiParameter(
+            name='cursor',
+            description='Курсор страницы из ссылок next/previous',
+            required=False,
+            type=str,
+            location='query',
+        ),
+        OpenApiParameter(
+            name='count',
+            description='Считать ли общее количество записей (по умолчанию true)',
+            required=False,
+            type=bool,
+            location='query',
+        ),
     ],
     examples=[
         OpenApiExample(
@@ -97,6 +216,8 @@ class FriendshipsListView(ListAPIView):
                 ],
                 'requests_type': 'incoming',
                 'count': 2,
+                'next': None,
+                'previous': None,
             },
             status_codes=['200'],
         ),
@@ -111,6 +232,8 @@ class FriendshipsListView(ListAPIView):
                 ],
                 'requests_type': 'outgoing',
                 'count': 1,
+                'next': None,
+                'previous': None,
             },
             status_codes=['200'],
         ),
@@ -122,29 +245,37 @@ class FriendshipsListView(ListAPIView):
     ],
 
 )
-class FriendshipRequestsListView(ListAPIView):
+class FriendshipRequestsListView(APIView):
     """Отображение списка входящих/исходящих запросов на дружбу"""
-    serializer_class = UserSerializer
-
-    def get_queryset(self):
-        user_id = self.kwargs.get('user_id')
-        action = self.kwargs.get('requests_type')
-        if action is None:
-            raise ValidationError('action must be specified')
-        match action:
-            case 'incoming':
-                users = get_incoming_requests(user_id)
-            case 'outgoing':
-                users = get_outgoing_requests(user_id)
-            case _:
-                raise ValidationError('action must be "incoming" or "outgoing"')
+    pagination_class = SortedIdsPagination
+
+    @staticmethod
+    def get_requests_type(requests_type: str) -> str:
+        requests_type = requests_type.lower()
+        if requests_type not in ('incoming', 'outgoing'):
+            raise ValidationError('action must be "incoming" or "outgoing"')
+        return requests_type
 
-        return User.objects.filter(id__in=users)
+    def get(self, request, user_id: int, requests_type: str) -> Response:
+        requests_type = self.get_requests_type(requests_type)
+        fields = _user_fields(request)
+        counts = get_relationship_counts(user_id)
+        return _conditional(request, counts and (counts['relationship_version'],),
+                            lambda: self.list(request, user_id, requests_type, fields, counts))
 
-    def list(self, request, *args, **kwargs):
-        action = self.kwargs.get('requests_type').lower()
-        data = UserSerializer(self.get_queryset(), many=True).data
-        return Response({"requests_users": data, "requests_type": action, "count": len(data)})
+    def list(self, request, user_id: int, requests_type: str, fields, counts) -> Response:
+        load_ids = get_incoming_request_ids if requests_type == 'incoming' else get_outgoing_request_ids
+        user_ids = load_ids(user_id, counts['relationship_version']) if counts else []
+        paginator = self.pagination_class()
+        page = paginator.paginate_ids(user_ids, request)
+        data = {
+            'requests_users': _user_page(page, fields),
+            'requests_type': requests_type,
+            **paginator.get_links(),
+        }
+        if paginator.include_count(request, default=True):
+            data['count'] = counts[f'{requests_type}_requests_count'] if counts else 0
+        return Response(data)
 
 
 @extend_schema(
@@ -287,9 +418,8 @@ class DeleteFriendView(APIView):
         if user_id == target_user_id:
             raise ValidationError('user_id must not be equal to target_user_id')
 
-        if not is_friends(user_id, target_user_id):
+        if not delete_friendship(user_id, target_user_id):
             raise ValidationError('users are not friends')
-        Friendship.objects.filter(Q(user1=user_id, user2=target_user_id) | Q(user1=target_user_id, user2=user_id)).delete()
         return Response({'status': 'Friend deleted'})
 
 
@@ -298,6 +428,7 @@ class DeleteFriendView(APIView):
     methods=['GET'],
     responses={
         status.HTTP_200_OK: dict,
+        status.HTTP_304_NOT_MODIFIED: None,
         status.HTTP_400_BAD_REQUEST: str,
     },
     parameters=[
@@ -351,28 +482,580 @@ class DeleteFriendView(APIView):
 class FriendshipStatusView(APIView):
     def get(self, request, user_id: int, target_user_id: int):
         """Проверка статуса дружбы для пользователя status_for к пользователю status_with"""
-        # Проверка на то, являются ли они друзьями
-        if is_friends(user_id, target_user_id):
-            return Response({
-                'status': FriendRequests.RequestStatus.ALREADY_FRIENDS.name,
-                'message': FriendRequests.RequestStatus.ALREADY_FRIENDS.value,
-            })
-
-        # Проверка на наличие исходящего запроса от status_for для status_with
-        if request_exists(request_from=user_id, request_to=target_user_id):
-            return Response({
-                'status': FriendRequests.RequestStatus.OUTGOING_REQUEST.name,
-                'message': FriendRequests.RequestStatus.OUTGOING_REQUEST.value,
-            })
-
-        # Проверка на наличие входящего запроса для status_for от status_with
-        if request_exists(request_from=user_id, request_to=target_user_id):
-            return Response({
-                'status': FriendRequests.RequestStatus.INCOMING_REQUEST.name,
-                'message': FriendRequests.RequestStatus.INCOMING_REQUEST.value,
-            })
+        if user_id == target_user_id:
+            raise ValidationError('user_id must not be equal to target_user_id')
+
+        versions = get_relationship_versions([user_id, target_user_id])
+        if len(versions) == 2:
+            versions = (versions[user_id], versions[target_user_id])
+        else:
+            versions = None
+        return _conditional(request, versions, lambda: self._status_response(user_id, target_user_id))
+
+    @staticmethod
+    def _status_response(user_id: int, target_user_id: int) -> Response:
+        relationship = get_relationship_status(user_id, target_user_id)
+        return Response({
+            'status': relationship.name,
+            'message': relationship.value,
+        })
+
+
+@extend_schema(
+    summary='Пакетная проверка статуса дружбы пользователя user_id к списку пользователей',
+    methods=['POST'],
+    request=UserTargetsSerializer,
+    responses={
+        status.HTTP_200_OK: dict,
+        status.HTTP_400_BAD_REQUEST: dict,
+    },
+    examples=[
+        OpenApiExample(
+            name='Пакетная проверка статуса дружбы',
+            value={
+                'user_id': 1,
+                'target_ids': [2, 3],
+            },
+            request_only=True,
+        ),
+        OpenApiExample(
+            name='Пакетная проверка статуса дружбы',
+            value={
+                'user_id': 1,
+                'statuses': [
+                    {
+                        'target_user_id': 2,
+                        'status': 'ALREADY_FRIENDS',
+                        'message': 'Already friends',
+                    },
+                    {
+                        'target_user_id': 3,
+                        'status': 'EMPTY',
+                        'message': 'There is nothing',
+                    },
+                ],
+            },
+            status_codes=['200'],
+            response_only=True,
+        ),
+    ],
+)
+class FriendshipBatchStatusView(APIView):
+    """Пакетная проверка статуса дружбы пользователя user_id к списку пользователей"""
+    def post(self, request) -> Response:
+        serializer = UserTargetsSerializer(data=request.data)
+        serializer.is_valid(raise_exception=True)
+        user_id = serializer.validated_data['user_id']
+        statuses = get_relationship_statuses(user_id, serializer.validated_data['target_ids'])
+        return Response({
+            'user_id': user_id,
+            'statuses': [
+                {
+                    'target_user_id': target_user_id,
+                    'status': relationship.name,
+                    'message': relationship.value,
+                }
+                for target_user_id, relationship in statuses.items()
+            ],
+        })
+
+
+@extend_schema(
+    summary='Статистика кэша связей пользователей в текущем процессе',
+    methods=['GET'],
+    responses={
+        status.HTTP_200_OK: dict,
+    },
+    examples=[
+        OpenApiExample(
+            name='Статистика кэша связей пользователей',
+            value={
+                'hits': 90,
+                'misses': 10,
+                'hit_ratio': 0.9,
+            },
+            status_codes=['200'],
+        ),
+    ],
+)
+class FriendshipCacheStatsView(APIView):
+    """Статистика кэша связей пользователей в текущем процессе"""
+    def get(self, request) -> Response:
+        return Response(relationship_cache.stats.as_dict())
+
 
+@extend_schema(
+    summary='Общие друзья двух пользователей',
+    methods=['GET'],
+    responses={
+        status.HTTP_200_OK: dict,
+        status.HTTP_400_BAD_REQUEST: str,
+    },
+    parameters=[
+        OpenApiParameter(
+            name='user_id',
+            description='ID первого пользователя',
+            required=True,
+            type=int,
+            location='path',
+        ),
+        OpenApiParameter(
+            name='target_user_id',
+            description='ID второго пользователя',
+            required=True,
+            type=int,
+            location='path',
+        ),
+        OpenApiParameter(
+            name='fields',
+            description='Поля пользователей через запятую (id, username; по умолчанию все)',
+            required=False,
+            type=str,
+            location='query',
+        ),
+        OpenApiParameter(
+            name='limit',
+            description='Размер страницы общих друзей',
+            required=False,
+            type=int,
+            location='query',
+        ),
+        OpenApiParameter(
+            name='cursor',
+            description='Курсор страницы из ссылки next',
+            required=False,
+            type=str,
+            location='query',
+        ),
+    ],
+    examples=[
+        OpenApiExample(
+            name='Общие друзья двух пользователей',
+            value={
+                'count': 3,
+                'users': [
+                    {
+                        'id': 4,
+                        'username': 'Иван',
+                    },
+                    {
+                        'id': 7,
+                        'username': 'Кирилл',
+                    },
+                ],
+                'next': 'http://localhost:8000/api/friendships/1-2/mutual/?cursor=cD03&limit=2',
+                'previous': None,
+            },
+            status_codes=['200'],
+        ),
+        OpenApiExample(
+            name='Общие друзья двух пользователей (ошибка: user_id равен target_user_id)',
+            value='user_id must not be equal to target_user_id',
+            status_codes=['400'],
+        ),
+    ],
+)
+class MutualFriendsView(APIView):
+    """Общие друзья двух пользователей: количество и страница пользователей"""
+    pagination_class = SortedIdsPagination
+
+    def get(self, request, user_id: int, target_user_id: int) -> Response:
+        if user_id == target_user_id:
+            raise ValidationError('user_id must not be equal to target_user_id')
+
+        fields = _user_fields(request)
+        mutual_ids = get_mutual_friend_ids(user_id, target_user_id)
+        paginator = self.pagination_class()
+        page = paginator.paginate_ids(mutual_ids, request)
+        return Response({
+            'count': len(mutual_ids),
+            'users': _user_page(page, fields),
+            **paginator.get_links(),
+        })
+
+
+@extend_schema(
+    summary='Количество общих друзей пользователя user_id с каждым из списка пользователей',
+    methods=['POST'],
+    request=UserTargetsSerializer,
+    responses={
+        status.HTTP_200_OK: dict,
+        status.HTTP_400_BAD_REQUEST: dict,
+    },
+    examples=[
+        OpenApiExample(
+            name='Количество общих друзей',
+            value={
+                'user_id': 1,
+                'mutual': [
+                    {
+                        'target_user_id': 2,
+                        'count': 5,
+                    },
+                    {
+                        'target_user_id': 3,
+                        'count': 0,
+                    },
+                ],
+            },
+            status_codes=['200'],
+            response_only=True,
+        ),
+    ],
+)
+class MutualFriendsBatchView(APIView):
+    """Количество общих друзей пользователя user_id с каждым из списка пользователей"""
+    def post(self, request) -> Response:
+        serializer = UserTargetsSerializer(data=request.data)
+        serializer.is_valid(raise_exception=True)
+        user_id = serializer.validated_data['user_id']
+        counts = count_mutual_friends(user_id, serializer.validated_data['target_ids'])
         return Response({
-            'status': FriendRequests.RequestStatus.EMPTY.name,
-            'message': FriendRequests.RequestStatus.EMPTY.value,
+            'user_id': user_id,
+            'mutual': [
+                {
+                    'target_user_id': target_user_id,
+                    'count': count,
+                }
+                for target_user_id, count in counts.items()
+            ],
         })
+
+
+@extend_schema(
+    summary='Рекомендации друзей по количеству общих друзей',
+    methods=['GET'],
+    responses={
+        status.HTTP_200_OK: dict,
+        status.HTTP_400_BAD_REQUEST: str,
+    },
+    parameters=[
+        OpenApiParameter(
+            name='user_id',
+            description='ID пользователя',
+            required=True,
+            type=int,
+            location='path',
+        ),
+        OpenApiParameter(
+            name='limit',
+            description='Количество рекомендаций',
+            required=False,
+            type=int,
+            location='query',
+        ),
+    ],
+    examples=[
+        OpenApiExample(
+            name='Рекомендации друзей',
+            value={
+                'recommendations': [
+                    {
+                        'id': 5,
+                        'username': 'Иван',
+                        'mutual_friends': 3,
+                    },
+                ],
+            },
+            status_codes=['200'],
+        ),
+    ],
+)
+class FriendRecommendationsView(APIView):
+    """Рекомендации друзей по количеству общих друзей"""
+    def get(self, request, user_id: int) -> Response:
+        limit = request.query_params.get('limit', settings.FRIENDSHIP_RECOMMENDATIONS_SIZE)
+        try:
+            limit = int(limit)
+        except ValueError:
+            raise ValidationError('limit must be an integer')
+        if not 0 < limit <= settings.FRIENDSHIP_RECOMMENDATIONS_SIZE:
+            raise ValidationError(f'limit must be between 1 and {settings.FRIENDSHIP_RECOMMENDATIONS_SIZE}')
+
+        candidates = get_friend_recommendations(user_id, limit)
+        users = User.objects.in_bulk([candidate for candidate, _ in candidates])
+        return Response({
+            'recommendations': [
+                {
+                    **UserSerializer(users[candidate]).data,
+                    'mutual_friends': score,
+                }
+                for candidate, score in candidates
+                if candidate in users
+            ],
+        })
+
+
+@extend_schema(
+    summary='Кратчайшая цепочка друзей между двумя пользователями',
+    methods=['GET'],
+    responses={
+        status.HTTP_200_OK: dict,
+        status.HTTP_400_BAD_REQUEST: str,
+        status.HTTP_404_NOT_FOUND: dict,
+    },
+    parameters=[
+        OpenApiParameter(
+            name='user_id',
+            description='ID первого пользователя',
+            required=True,
+            type=int,
+            location='path',
+        ),
+        OpenApiParameter(
+            name='target_user_id',
+            description='ID второго пользователя',
+            required=True,
+            type=int,
+            location='path',
+        ),
+        OpenApiParameter(
+            name='max_depth',
+            description='Максимальная длина цепочки (количество рукопожатий)',
+            required=False,
+            type=int,
+            location='query',
+        ),
+        OpenApiParameter(
+            name='fields',
+            description='Поля пользователей в цепочке через запятую: id, username',
+            required=False,
+            type=str,
+            location='query',
+        ),
+    ],
+    examples=[
+        OpenApiExample(
+            name='Цепочка найдена',
+            value={
+                'user_id': 1,
+                'target_user_id': 7,
+                'distance': 2,
+                'path': [{'id': 1, 'username': 'Вася'}, {'id': 4, 'username': 'Петя'}, {'id': 7, 'username': 'Иван'}],
+                'exhausted': False,
+            },
+            status_codes=['200'],
+        ),
+        OpenApiExample(
+            name='Поиск остановлен бюджетом',
+            value={'user_id': 1, 'target_user_id': 9, 'distance': None, 'path': [], 'exhausted': True},
+            status_codes=['200'],
+        ),
+        OpenApiExample(
+            name='Цепочка друзей (ошибка: пользователь не найден)',
+            value={'detail': 'User does not exist'},
+            status_codes=['404'],
+        ),
+    ],
+)
+class FriendshipPathView(APIView):
+    """Кратчайшая цепочка друзей двунаправленным поиском в ширину с ограничением глубины.
+
+    distance = null и пустой path: цепочки длиной не больше max_depth нет, либо при exhausted = true
+    поиск остановлен бюджетом посещённых пользователей или времени и ответ неизвестен.
+    """
+    def get(self, request, user_id: int, target_user_id: int) -> Response:
+        if user_id == target_user_id:
+            raise ValidationError('user_id must not be equal to target_user_id')
+        max_depth = request.query_params.get('max_depth', settings.FRIENDSHIP_PATH_MAX_DEPTH)
+        try:
+            max_depth = int(max_depth)
+        except ValueError:
+            raise ValidationError('max_depth must be an integer')
+        if not 0 < max_depth <= settings.FRIENDSHIP_PATH_MAX_DEPTH:
+            raise ValidationError(f'max_depth must be between 1 and {settings.FRIENDSHIP_PATH_MAX_DEPTH}')
+        fields = _user_fields(request)
+        if User.objects.filter(id__in=(user_id, target_user_id)).count() != 2:
+            raise NotFound('User does not exist')
+
+        search = find_friendship_path(user_id, target_user_id, max_depth)
+        path = search.path or []
+        if path and fields != ('id',):
+            users = {user['id']: user for user in User.objects.filter(id__in=path).values(*USER_FIELDS)}
+            path = [{field: users[path_user_id][field] for field in fields} for path_user_id in path]
+        else:
+            path = [{'id': path_user_id} for path_user_id in path]
+        return Response({
+            'user_id': user_id,
+            'target_user_id': target_user_id,
+            'distance': len(path) - 1 if path else None,
+            'path': path,
+            'exhausted': search.exhausted,
+        })
+
+
+@extend_schema(
+    summary='Пакетная отправка/принятие/отклонение/отмена запросов на дружбу',
+    methods=['POST'],
+    request=RequestActionsBatchSerializer,
+    responses={
+        status.HTTP_200_OK: dict,
+        status.HTTP_400_BAD_REQUEST: dict,
+    },
+    examples=[
+        OpenApiExample(
+            name='Пакетная обработка запросов на дружбу',
+            value={
+                'operations': [
+                    {
+                        'user_id': 1,
+                        'target_user_id': 2,
+                        'action': 'accept_request',
+                    },
+                    {
+                        'user_id': 1,
+                        'target_user_id': 3,
+                        'action': 'send_request',
+                    },
+                ],
+            },
+            request_only=True,
+        ),
+        OpenApiExample(
+            name='Пакетная обработка запросов на дружбу',
+            value={
+                'results': [
+                    {
+                        'user_id': 1,
+                        'target_user_id': 2,
+                        'action': 'accept_request',
+                        'status': 200,
+                        'success': True,
+                        'message': 'You have successfully accepted the request.',
+                    },
+                    {
+                        'user_id': 1,
+                        'target_user_id': 3,
+                        'action': 'send_request',
+                        'status': 409,
+                        'success': False,
+                        'message': 'This user is already your friend',
+                    },
+                ],
+            },
+            status_codes=['200'],
+            response_only=True,
+        ),
+    ],
+)
+class FriendshipRequestsBatchView(APIView):
+    """Пакетная отправка/принятие/отклонение/отмена запросов на дружбу в одной транзакции"""
+    def post(self, request) -> Response:
+        serializer = RequestActionsBatchSerializer(data=request.data)
+        serializer.is_valid(raise_exception=True)
+        operations = [
+            (operation['user_id'], operation['target_user_id'], operation['action'])
+            for operation in serializer.validated_data['operations']
+        ]
+        outcomes = apply_request_actions(operations)
+        return Response({
+            'results': [
+                {
+                    'user_id': user_id,
+                    'target_user_id': target_user_id,
+                    'action': action,
+                    'status': outcome.status,
+                    'success': outcome.success,
+                    'message': outcome.message,
+                }
+                for (user_id, target_user_id, action), outcome in zip(operations, outcomes)
+            ],
+        })
+
+
+@extend_schema(
+    summary='Количество друзей, входящих и исходящих запросов пользователя',
+    methods=['GET'],
+    responses={
+        status.HTTP_200_OK: dict,
+        status.HTTP_404_NOT_FOUND: dict,
+    },
+    parameters=[
+        OpenApiParameter(
+            name='user_id',
+            description='ID пользователя',
+            required=True,
+            type=int,
+            location='path',
+        ),
+    ],
+    examples=[
+        OpenApiExample(
+            name='Количество друзей и запросов',
+            value={
+                'user_id': 1,
+                'friends': 120,
+                'incoming_requests': 3,
+                'outgoing_requests': 0,
+            },
+            status_codes=['200'],
+        ),
+    ],
+)
+class FriendshipCountsView(APIView):
+    """Количество друзей и запросов пользователя из счётчиков, без загрузки списков"""
+    def get(self, request, user_id: int) -> Response:
+        counts = get_relationship_counts(user_id)
+        if counts is None:
+            raise NotFound('User does not exist')
+        return Response({
+            'user_id': user_id,
+            'friends': counts['friends_count'],
+            'incoming_requests': counts['incoming_requests_count'],
+            'outgoing_requests': counts['outgoing_requests_count'],
+        })
+
+
+@extend_schema(
+    summary='События изменения связей после курсора',
+    methods=['GET'],
+    responses={
+        status.HTTP_200_OK: dict,
+        status.HTTP_400_BAD_REQUEST: str,
+    },
+    parameters=[
+        OpenApiParameter(
+            name='since',
+            description='Курсор: номер последнего обработанного события (0 — с начала журнала)',
+            required=False,
+            type=int,
+            location='query',
+        ),
+        OpenApiParameter(
+            name='limit',
+            description=f'Количество событий в ответе (не больше {events.MAX_BATCH_SIZE})',
+            required=False,
+            type=int,
+            location='query',
+        ),
+    ],
+    examples=[
+        OpenApiExample(
+            name='События после курсора 41',
+            value={
+                'events': [
+                    {'sequence': 42, 'type': 'request_deleted', 'user_id': 2, 'target_user_id': 1},
+                    {'sequence': 43, 'type': 'friendship_created', 'user_id': 1, 'target_user_id': 2},
+                ],
+                'cursor': 43,
+                'has_more': False,
+            },
+            status_codes=['200'],
+        ),
+    ],
+)
+class FriendshipEventsView(APIView):
+    """Журнал изменений связей: потребитель читает события пачками, передавая полученный cursor в since"""
+    def get(self, request) -> Response:
+        try:
+            since = int(request.query_params.get('since', 0))
+            limit = int(request.query_params.get('limit', settings.FRIENDSHIP_EVENTS_PAGE_SIZE))
+        except ValueError:
+            raise ValidationError('since and limit must be integers')
+        if since < 0:
+            raise ValidationError('since must not be negative')
+        if not 0 < limit <= events.MAX_BATCH_SIZE:
+            raise ValidationError(f'limit must be between 1 and {events.MAX_BATCH_SIZE}')
+
+        batch, cursor, has_more = events.since(since, limit)
+        return Response({'events': batch, 'cursor': cursor, 'has_more': has_more})
@@ -0,0 +1,15 @@
+"""Настройки gunicorn для режима serve (см. entrypoint.sh); значения переопределяются переменными окружения"""
+import multiprocessing
+import os
+
+bind = os.environ.get('GUNICORN_BIND', '0.0.0.0:8000')
+# WEB_CONCURRENCY — стандартная переменная gunicorn для количества процессов
+workers = int(os.environ.get('WEB_CONCURRENCY', multiprocessing.cpu_count() * 2 + 1))
+threads = int(os.environ.get('GUNICORN_THREADS', 1))
+# Для ASGI (vk_internship.asgi:application) нужен worker_class uvicorn.workers.UvicornWorker
+worker_class = os.environ.get('GUNICORN_WORKER_CLASS', 'sync')
+timeout = int(os.environ.get('GUNICORN_TIMEOUT', 30))
+# Перезапуск процессов ограничивает рост памяти; разброс не даёт им перезапуститься одновременно
+max_requests = int(os.environ.get('GUNICORN_MAX_REQUESTS', 10_000))
+max_requests_jitter = max_requests // 10
+accesslog = '-'
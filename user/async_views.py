@@ -0,0 +1,19 @@
+"""Асинхронные версии эндпоинтов чтения пользователей для ASGI"""
+from django.http import HttpResponse
+from django.views import View
+from rest_framework import status
+
+from user.models import User
+from user.serializers import UserSerializer
+from vk_internship.renderers import render_json
+
+
+class AsyncUserDetailView(View):
+    """Асинхронная версия user_detail"""
+
+    async def get(self, request, user_id: int) -> HttpResponse:
+        try:
+            user = await User.objects.aget(id=user_id)
+        except User.DoesNotExist:
+            return HttpResponse(status=status.HTTP_404_NOT_FOUND)
+        return render_json(UserSerializer(user).data)
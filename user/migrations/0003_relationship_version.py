@@ -0,0 +1,18 @@
+# Generated by Django 4.2.1 on 2026-10-17 10:21
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('user', '0002_relationship_counters'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='user',
+            name='relationship_version',
+            field=models.PositiveBigIntegerField(default=0),
+        ),
+    ]
@@ -0,0 +1,89 @@
+from django.db import migrations, models
+
+# Размер пачки при заполнении username_normalized
+BATCH_SIZE = 10_000
+
+# Внешний FTS5-индекс над user_user.username_normalized: триграммы дают поиск подстрок длиной от 3 символов.
+# Имена уже в нижнем регистре, поэтому свёртка регистра токенизатора не нужна; индекс обновляют триггеры,
+# в том числе при bulk_create и удалении через QuerySet. Триггеры удаляются вместе с таблицей: миграция, которая
+# пересоздаёт user_user в SQLite (изменение полей User), должна создать их заново через drop_fts и create_fts
+CREATE_FTS_SQL = (
+    """
+    CREATE VIRTUAL TABLE user_username_fts USING fts5(
+        username_normalized, content='user_user', content_rowid='id', tokenize='trigram case_sensitive 1'
+    )
+    """,
+    """
+    CREATE TRIGGER user_username_fts_insert AFTER INSERT ON user_user BEGIN
+        INSERT INTO user_username_fts(rowid, username_normalized) VALUES (new.id, new.username_normalized);
+    END
+    """,
+    """
+    CREATE TRIGGER user_username_fts_delete AFTER DELETE ON user_user BEGIN
+        INSERT INTO user_username_fts(user_username_fts, rowid, username_normalized)
+        VALUES ('delete', old.id, old.username_normalized);
+    END
+    """,
+    """
+    CREATE TRIGGER user_username_fts_update AFTER UPDATE OF username_normalized ON user_user BEGIN
+        INSERT INTO user_username_fts(user_username_fts, rowid, username_normalized)
+        VALUES ('delete', old.id, old.username_normalized);
+        INSERT INTO user_username_fts(rowid, username_normalized) VALUES (new.id, new.username_normalized);
+    END
+    """,
+    "INSERT INTO user_username_fts(user_username_fts) VALUES ('rebuild')",
+)
+
+DROP_FTS_SQL = (
+    'DROP TRIGGER IF EXISTS user_username_fts_insert',
+    'DROP TRIGGER IF EXISTS user_username_fts_delete',
+    'DROP TRIGGER IF EXISTS user_username_fts_update',
+    'DROP TABLE IF EXISTS user_username_fts',
+)
+
+
+def fill_username_normalized(apps, schema_editor):
+    User = apps.get_model('user', 'User')
+    users = User.objects.using(schema_editor.connection.alias).only('id', 'username').order_by('id')
+    last_id = 0
+    while batch := list(users.filter(id__gt=last_id)[:BATCH_SIZE]):
+        for user in batch:
+            user.username_normalized = user.username.casefold()
+        User.objects.using(schema_editor.connection.alias).bulk_update(batch, ['username_normalized'])
+        last_id = batch[-1].id
+
+
+def create_fts(apps, schema_editor):
+    # FTS5 есть только в SQLite; на других СУБД user.search ищет подстроки без индекса
+    if schema_editor.connection.vendor == 'sqlite':
+        for sql in CREATE_FTS_SQL:
+            schema_editor.execute(sql)
+
+
+def drop_fts(apps, schema_editor):
+    if schema_editor.connection.vendor == 'sqlite':
+        for sql in DROP_FTS_SQL:
+            schema_editor.execute(sql)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('user', '0003_relationship_version'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='user',
+            name='username_normalized',
+            field=models.CharField(default='', editable=False, max_length=256),
+        ),
+        migrations.RunPython(fill_username_normalized, migrations.RunPython.noop),
+        # Индекс создаётся после заполнения, чтобы не перестраивать его на каждой пачке
+        migrations.AlterField(
+            model_name='user',
+            name='username_normalized',
+            field=models.CharField(db_index=True, default='', editable=False, max_length=256),
+        ),
+        migrations.RunPython(create_fts, drop_fts),
+    ]
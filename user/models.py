@@ -3,3 +3,24 @@ from django.db import models
 
 class User(models.Model):
     username = models.CharField(max_length=256)
+    # Имя в нижнем регистре для поиска (см. user.search): B-tree индекс для префиксов, FTS5-индекс для подстрок.
+    # Заполняется в save(); при bulk_create его задаёт вызывающий код через normalize_username
+    username_normalized = models.CharField(max_length=256, db_index=True, default='', editable=False)
+    # Денормализованные счётчики связей, обновляются в friendship.services вместе с самими связями
+    friends_count = models.PositiveIntegerField(default=0)
+    incoming_requests_count = models.PositiveIntegerField(default=0)
+    outgoing_requests_count = models.PositiveIntegerField(default=0)
+    # Увеличивается при каждом изменении друзей или запросов пользователя (ETag списков и статусов)
+    relationship_version = models.PositiveBigIntegerField(default=0)
+
+    @staticmethod
+    def normalize_username(username: str) -> str:
+        """Имя для поиска без учёта регистра; lower() SQLite меняет регистр только у ASCII"""
+        return username.casefold()
+
+    def save(self, *args, **kwargs):
+        self.username_normalized = self.normalize_username(self.username)
+        update_fields = kwargs.get('update_fields')
+        if update_fields is not None and 'username' in update_fields:
+            kwargs['update_fields'] = {*update_fields, 'username_normalized'}
+        super().save(*args, **kwargs)
@@ -0,0 +1,95 @@
+"""Поиск пользователей по имени без учёта регистра.
+
+Результаты ранжируются группами:
+1. друзья пользователя, от имени которого идёт поиск: сначала с именем, начинающимся с запроса, затем содержащим его;
+2. остальные с именем, начинающимся с запроса, — по алфавиту: диапазон B-tree индекса username_normalized
+   уже отсортирован, поэтому читается только нужное количество строк;
+3. остальные с именем, содержащим запрос не в начале, — по id: FTS5-индекс с триграммами (миграция
+   user.0004_username_search) отдаёт совпадения в порядке rowid, поэтому сортировки всех совпадений нет.
+
+Подстроки короче трёх символов триграммами не ищутся: для таких запросов есть только первые две группы.
+"""
+from django.conf import settings
+from django.db import connections, router
+
+from user.models import User
+
+MODE_CONTAINS = 'contains'
+MODE_PREFIX = 'prefix'
+MODES = (MODE_CONTAINS, MODE_PREFIX)
+
+# Минимальная длина подстроки для поиска по триграммам
+TRIGRAM_LENGTH = 3
+# Максимальное количество id в одном запросе при загрузке имён друзей
+FRIENDS_BATCH_SIZE = 500
+# Верхняя граница диапазона имён с заданным префиксом: больше любого символа после префикса
+_PREFIX_END = chr(0x10FFFF)
+
+
+def search_user_ids(query: str, limit: int, friend_ids=(), mode: str = MODE_CONTAINS) -> list[int]:
+    """Первые limit id пользователей, подходящих под запрос, в порядке ранжирования (см. описание модуля).
+
+    friend_ids — id друзей пользователя, от имени которого идёт поиск, уже загруженные вызывающим кодом.
+    Они поднимаются в начало, если их не больше USER_SEARCH_FRIENDS_LIMIT: имена друзей загружаются
+    по первичному ключу, и для пользователей с большим списком это дольше самого поиска.
+    """
+    term = User.normalize_username(query)
+    contains = mode == MODE_CONTAINS and len(term) >= TRIGRAM_LENGTH
+    if len(friend_ids) > settings.USER_SEARCH_FRIENDS_LIMIT:
+        friend_ids = ()
+
+    ranked = _friend_matches(friend_ids, term, contains)
+    # Друзья уже в начале списка: следующие группы читаются с запасом на их повторы
+    boosted = set(ranked)
+    loaders = [_prefix_matches]
+    if contains:
+        loaders.append(_substring_matches)
+    for load in loaders:
+        if len(ranked) >= limit:
+            break
+        ranked.extend(
+            match for match in load(term, limit - len(ranked) + len(boosted)) if match not in boosted
+        )
+    return ranked[:limit]
+
+
+def _friend_matches(friend_ids, term: str, contains: bool) -> list[int]:
+    prefix, substring = [], []
+    for start in range(0, len(friend_ids), FRIENDS_BATCH_SIZE):
+        names = User.objects.filter(id__in=list(friend_ids[start:start + FRIENDS_BATCH_SIZE])) \
+            .values_list('username_normalized', 'id')
+        for name, friend_id in names:
+            if name.startswith(term):
+                prefix.append((name, friend_id))
+            elif contains and term in name:
+                substring.append(friend_id)
+    return [friend_id for _, friend_id in sorted(prefix)] + sorted(substring)
+
+
+def _prefix_matches(term: str, limit: int) -> list[int]:
+    return list(
+        User.objects.filter(username_normalized__gte=term, username_normalized__lt=term + _PREFIX_END)
+        .order_by('username_normalized', 'id').values_list('id', flat=True)[:limit]
+    )
+
+
+def _substring_matches(term: str, limit: int) -> list[int]:
+    """Имена, содержащие term не в начале (совпадения с начала уже выбраны _prefix_matches)"""
+    using = router.db_for_read(User)
+    connection = connections[using]
+    if connection.vendor != 'sqlite':
+        return list(
+            User.objects.using(using).filter(username_normalized__contains=term)
+            .exclude(username_normalized__startswith=term).order_by('id').values_list('id', flat=True)[:limit]
+        )
+    with connection.cursor() as cursor:
+        # Фраза в кавычках: триграммный токенизатор ищет её как подстроку, кавычки внутри удваиваются
+        cursor.execute(
+            'SELECT "user_user"."id" FROM "user_username_fts" '
+            'JOIN "user_user" ON "user_user"."id" = "user_username_fts"."rowid" '
+            'WHERE "user_username_fts" MATCH %s '
+            'AND NOT ("user_user"."username_normalized" >= %s AND "user_user"."username_normalized" < %s) '
+            'ORDER BY "user_username_fts"."rowid" LIMIT %s',
+            ['"' + term.replace('"', '""') + '"', term, term + _PREFIX_END, limit],
+        )
+        return [row[0] for row in cursor.fetchall()]
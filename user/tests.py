@@ -1,5 +1,11 @@
+from django.db import connection
+from django.test.utils import CaptureQueriesContext
 from rest_framework.test import APITestCase
 
+from friendship import cache as relationship_cache
+from friendship.services import send_request, accept_request
+from user.models import User
+
 
 class UserTestCase(APITestCase):
     def test_user_create(self):
@@ -31,3 +37,74 @@ class UserTestCase(APITestCase):
     def test_user_detail_invalid(self):
         response = self.client.get('/api/users/999/')
         self.assertEqual(response.status_code, 404)
+
+    def test_async_user_detail(self):
+        response = self.client.post('/api/users/', data={'username': 'Вася'})
+        user_id = response.data['id']
+        for url in (f'/api/users/{user_id}/', '/api/users/999/'):
+            response = self.client.get(url)
+            async_response = self.client.get(url.replace('/api/', '/api/async/'))
+            self.assertEqual(async_response.status_code, response.status_code)
+            self.assertEqual(async_response.content, response.content)
+
+
+class UserSearchTestCase(APITestCase):
+    def setUp(self):
+        super().setUp()
+        relationship_cache.clear()
+        self.users = {}
+        for username in ('Анна', 'Жанна', 'анастасия', 'Иоанна', 'Аннушка', 'Вася', 'АН'):
+            response = self.client.post('/api/users/', data={'username': username})
+            self.users[username] = response.data['id']
+
+    def search(self, **params):
+        response = self.client.get('/api/users/search/', params)
+        self.assertEqual(response.status_code, 200)
+        return [user['username'] for user in response.data['users']]
+
+    def test_search_ranking(self):
+        # Сначала начинающиеся с запроса по алфавиту, затем содержащие его по id; регистр не учитывается
+        self.assertEqual(self.search(q='АН'), ['АН', 'анастасия', 'Анна', 'Аннушка'])
+        self.assertEqual(self.search(q='анн'), ['Анна', 'Аннушка', 'Жанна', 'Иоанна'])
+        self.assertEqual(self.search(q='анн', mode='prefix'), ['Анна', 'Аннушка'])
+        self.assertEqual(self.search(q='нна'), ['Анна', 'Жанна', 'Иоанна'])
+        self.assertEqual(self.search(q='"'), [])
+
+    def test_search_friends_first(self):
+        user_id = self.users['Вася']
+        send_request(user_id, self.users['Иоанна'])
+        accept_request(self.users['Иоанна'], user_id)
+        with CaptureQueriesContext(connection) as queries:
+            response = self.client.get('/api/users/search/', {'q': 'анн', 'user_id': user_id})
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(
+            [(user['username'], user['is_friend']) for user in response.data['users']],
+            [('Иоанна', True), ('Анна', False), ('Аннушка', False), ('Жанна', False)],
+        )
+        # Друзья загружаются один раз и передаются в поиск
+        self.assertEqual(sum('friendadjacency' in query['sql'] or 'relationship_version' in query['sql']
+                             for query in queries.captured_queries), 2)
+
+    def test_search_pagination(self):
+        response = self.client.get('/api/users/search/', {'q': 'анн', 'limit': 3})
+        self.assertEqual([user['username'] for user in response.data['users']], ['Анна', 'Аннушка', 'Жанна'])
+        self.assertIsNone(response.data['previous'])
+        response = self.client.get(response.data['next'])
+        self.assertEqual([user['username'] for user in response.data['users']], ['Иоанна'])
+        self.assertIsNone(response.data['next'])
+
+    def test_search_index_follows_changes(self):
+        user = User.objects.get(id=self.users['Вася'])
+        user.username = 'Иван'
+        user.save()
+        User.objects.bulk_create([User(username='Диван', username_normalized=User.normalize_username('Диван'))])
+        self.assertEqual(self.search(q='ван'), ['Иван', 'Диван'])
+        User.objects.filter(username='Иван').delete()
+        self.assertEqual(self.search(q='ван'), ['Диван'])
+
+    def test_search_invalid(self):
+        for params in ({}, {'q': ' '}, {'q': 'ан', 'mode': 'suffix'}, {'q': 'ан', 'user_id': 'x'}):
+            response = self.client.get('/api/users/search/', params)
+            self.assertEqual(response.status_code, 400)
+        response = self.client.get('/api/users/search/', {'q': 'ан', 'user_id': 999})
+        self.assertEqual((response.status_code, response.json()), (404, {'detail': 'User does not exist'}))
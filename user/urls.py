@@ -1,8 +1,11 @@
 from django.urls import path
 
-from user.views import user_detail, user_create
+from user.async_views import AsyncUserDetailView
+from user.views import user_detail, user_create, user_search
 
 urlpatterns = [
     path('users/', user_create, name='user_detail'),
+    path('users/search/', user_search, name='user_search'),
     path('users/<int:user_id>/', user_detail, name='user_create'),
+    path('async/users/<int:user_id>/', AsyncUserDetailView.as_view(), name='async_user_detail'),
 ]
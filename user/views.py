@@ -1,12 +1,25 @@
-from drf_spectacular.utils import extend_schema, OpenApiParameter
+from array import array
+
+from django.conf import settings
+from drf_spectacular.utils import extend_schema, OpenApiParameter, OpenApiExample
 from rest_framework import status
 from rest_framework.decorators import api_view
+from rest_framework.exceptions import NotFound, ValidationError
 from rest_framework.response import Response
 
+from friendship import cache as relationship_cache
+from friendship.pagination import RankedIdsPagination
+from friendship.services import get_relationship_versions, get_user_friend_ids
+from user import search
 from user.models import User
 from user.serializers import UserSerializer
 
 
+class UserSearchPagination(RankedIdsPagination):
+    page_size = settings.USER_SEARCH_PAGE_SIZE
+    max_page_size = settings.USER_SEARCH_MAX_PAGE_SIZE
+
+
 @extend_schema(
     summary='Получение пользователя по id',
     methods=['GET'],
@@ -51,3 +64,122 @@ def user_create(request):
         serializer.save()
         return Response(serializer.data, status=status.HTTP_201_CREATED)
     return Response(status=status.HTTP_400_BAD_REQUEST)
+
+
+@extend_schema(
+    summary='Поиск пользователей по имени',
+    methods=['GET'],
+    responses={
+        status.HTTP_200_OK: dict,
+        status.HTTP_400_BAD_REQUEST: str,
+        status.HTTP_404_NOT_FOUND: dict,
+    },
+    parameters=[
+        OpenApiParameter(
+            name='q',
+            description='Начало или часть имени пользователя, регистр не учитывается',
+            required=True,
+            type=str,
+            location='query',
+        ),
+        OpenApiParameter(
+            name='mode',
+            description='contains — имена, начинающиеся с q, затем содержащие q (от 3 символов); '
+                        'prefix — только начинающиеся с q (автодополнение)',
+            required=False,
+            type=str,
+            enum=search.MODES,
+            default=search.MODE_CONTAINS,
+            location='query',
+        ),
+        OpenApiParameter(
+            name='user_id',
+            description='ID пользователя, который ищет: его друзья показываются первыми',
+            required=False,
+            type=int,
+            location='query',
+        ),
+        OpenApiParameter(
+            name='limit',
+            description=f'Количество пользователей на странице (не больше {settings.USER_SEARCH_MAX_PAGE_SIZE})',
+            required=False,
+            type=int,
+            location='query',
+        ),
+        OpenApiParameter(
+            name='cursor',
+            description='Курсор следующей страницы из поля next',
+            required=False,
+            type=str,
+            location='query',
+        ),
+    ],
+    examples=[
+        OpenApiExample(
+            name='Поиск пользователей',
+            value={
+                'users': [
+                    {
+                        'id': 7,
+                        'username': 'Анна',
+                        'is_friend': True,
+                    },
+                    {
+                        'id': 3,
+                        'username': 'Анастасия',
+                        'is_friend': False,
+                    },
+                    {
+                        'id': 12,
+                        'username': 'Жанна',
+                        'is_friend': False,
+                    },
+                ],
+                'next': 'http://localhost:8000/api/users/search/?cursor=bz0z&limit=3&q=%D0%B0%D0%BD&user_id=1',
+                'previous': None,
+            },
+            status_codes=['200'],
+        ),
+        OpenApiExample(
+            name='Поиск пользователей (ошибка: пустой запрос)',
+            value='q must not be empty',
+            status_codes=['400'],
+        ),
+    ],
+)
+@api_view(['GET'])
+def user_search(request):
+    """Поиск пользователей по началу или части имени, друзья пользователя user_id — первыми"""
+    query = request.GET.get('q', '').strip()
+    if not query:
+        raise ValidationError('q must not be empty')
+    mode = request.GET.get('mode', search.MODE_CONTAINS)
+    if mode not in search.MODES:
+        raise ValidationError(f'mode must be one of: {", ".join(search.MODES)}')
+    user_id = request.GET.get('user_id')
+    friend_ids = array('q')
+    if user_id is not None:
+        try:
+            user_id = int(user_id)
+        except ValueError:
+            raise ValidationError('user_id must be an integer')
+        # Версия связей проверяет существование пользователя и служит ключом кэша связей
+        version = get_relationship_versions([user_id]).get(user_id)
+        if version is None:
+            raise NotFound('User does not exist')
+        friend_ids = get_user_friend_ids(user_id, version)
+
+    paginator = UserSearchPagination()
+    page = paginator.paginate_ranked(lambda limit: search.search_user_ids(query, limit, friend_ids, mode), request)
+    usernames = dict(User.objects.filter(id__in=page).values_list('id', 'username')) if page else {}
+    return Response({
+        'users': [
+            {
+                'id': found_id,
+                'username': usernames[found_id],
+                'is_friend': relationship_cache.contains(friend_ids, found_id),
+            }
+            for found_id in page
+        ],
+        **paginator.get_links(),
+    })
@@ -0,0 +1,164 @@
+"""Чтение с реплик: маршрутизатор баз данных и middleware, включающее реплики для запросов только на чтение.
+
+Реплики перечисляются в settings.DATABASE_REPLICAS. Чтения уходят на реплику только внутри
+запроса с безопасным методом (GET, HEAD, OPTIONS); всё остальное — записи, чтения в транзакции
+основной базы, управляющие команды, тесты — работает с основной базой.
+
+Read-your-writes: после запроса с изменениями клиент получает cookie REPLICA_PIN_COOKIE, а
+пользователи, чьи связи изменились, закрепляются в кэше settings.FRIENDSHIP_CACHE_ALIAS (pin_users
+вызывает слой сервисов, поэтому закрепляются и пользователи из тела пакетных запросов); в течение
+REPLICA_STICKY_SECONDS их чтения идут в основную базу.
+"""
+import random
+import time
+from contextlib import contextmanager
+from contextvars import ContextVar
+
+from asgiref.sync import iscoroutinefunction, markcoroutinefunction, sync_to_async
+from django.conf import settings
+from django.core.cache import caches
+from django.db import DEFAULT_DB_ALIAS, connections
+from django.urls import Resolver404, get_resolver
+
+REPLICA_PIN_COOKIE = 'replica_pin'
+
+# Параметры URL с id пользователей, чьи данные читает запрос
+USER_ID_KWARGS = ('user_id', 'target_user_id')
+
+
+class _ReadState:
+    """Разрешены ли чтения с реплик в блоке use_replicas.
+
+    Изменяемый объект, а не значение ContextVar: sync_to_async выполняет код в копии контекста,
+    и запись, сделанная там, иначе не запретила бы реплики последующим чтениям async-представления.
+    """
+    __slots__ = ('replicas', 'parent')
+
+    def __init__(self, replicas: bool, parent: '_ReadState | None'):
+        self.replicas = replicas
+        self.parent = parent
+
+
+_read_state: ContextVar[_ReadState | None] = ContextVar('read_state', default=None)
+
+
+@contextmanager
+def use_replicas(enabled: bool = True):
+    """Разрешение (или запрет) чтения с реплик в текущем контексте"""
+    token = _read_state.set(_ReadState(enabled, _read_state.get()))
+    try:
+        yield
+    finally:
+        _read_state.reset(token)
+
+
+def primary():
+    """Чтения в блоке идут в основную базу"""
+    return use_replicas(False)
+
+
+class PrimaryReplicaRouter:
+    """Записи и миграции — в основную базу, чтения — на случайную реплику, если они разрешены в контексте"""
+
+    def db_for_read(self, model, **hints):
+        replicas = settings.DATABASE_REPLICAS
+        # Внутри транзакции основной базы читаем из неё же, иначе проверки перед записью увидят устаревшие данные
+        state = _read_state.get()
+        if not replicas or state is None or not state.replicas or connections[DEFAULT_DB_ALIAS].in_atomic_block:
+            return DEFAULT_DB_ALIAS
+        return random.choice(replicas)
+
+    def db_for_write(self, model, **hints):
+        # Последующие чтения этого запроса, в том числе вне вложенных блоков, должны видеть запись
+        state = _read_state.get()
+        while state is not None:
+            state.replicas = False
+            state = state.parent
+        return DEFAULT_DB_ALIAS
+
+    def allow_relation(self, obj1, obj2, **hints):
+        return True
+
+    def allow_migrate(self, db, app_label, model_name=None, **hints):
+        # Реплики — копии основной базы (sync_replicas), схема в них приходит вместе с данными
+        return db not in settings.DATABASE_REPLICAS
+
+
+def _pin_key(user_id) -> str:
+    return f'replica-pin:{user_id}'
+
+
+def pin_users(user_ids):
+    """Закрепление пользователей за основной базой на REPLICA_STICKY_SECONDS"""
+    if not settings.DATABASE_REPLICAS:
+        return
+    caches[settings.FRIENDSHIP_CACHE_ALIAS].set_many(
+        {_pin_key(user_id): True for user_id in user_ids}, settings.REPLICA_STICKY_SECONDS,
+    )
+
+
+def pinned_users(user_ids) -> set:
+    return {key.split(':')[1] for key in caches[settings.FRIENDSHIP_CACHE_ALIAS].get_many(
+        [_pin_key(user_id) for user_id in user_ids]
+    )}
+
+
+class ReplicaRoutingMiddleware:
+    """Включает чтение с реплик для безопасных запросов без закрепления за основной базой"""
+    sync_capable = True
+    async_capable = True
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+        if iscoroutinefunction(get_response):
+            markcoroutinefunction(self)
+
+    def __call__(self, request):
+        if iscoroutinefunction(self):
+            return self.__acall__(request)
+        if not settings.DATABASE_REPLICAS:
+            return self.get_response(request)
+        with use_replicas(self._allow_replicas(request)):
+            response = self.get_response(request)
+        self._pin(request, response)
+        return response
+
+    async def __acall__(self, request):
+        if not settings.DATABASE_REPLICAS:
+            return await self.get_response(request)
+        with use_replicas(await sync_to_async(self._allow_replicas)(request)):
+            response = await self.get_response(request)
+        await sync_to_async(self._pin)(request, response)
+        return response
+
+    @staticmethod
+    def _user_ids(request) -> list[str]:
+        match = request.resolver_match
+        kwargs = match.kwargs if match is not None else {}
+        return [str(kwargs[name]) for name in USER_ID_KWARGS if name in kwargs]
+
+    def _allow_replicas(self, request) -> bool:
+        if request.method not in ('GET', 'HEAD', 'OPTIONS'):
+            return False
+        try:
+            if float(request.COOKIES.get(REPLICA_PIN_COOKIE, 0)) > time.time():
+                return False
+        except ValueError:
+            pass
+        # resolver_match ещё не заполнен: маршрут разрешается позже, в обработчике
+        request.resolver_match = request.resolver_match or self._resolve(request)
+        return not pinned_users(self._user_ids(request))
+
+    @staticmethod
+    def _resolve(request):
+        try:
+            return get_resolver(getattr(request, 'urlconf', None)).resolve(request.path_info)
+        except Resolver404:
+            return None
+
+    def _pin(self, request, response):
+        if request.method in ('GET', 'HEAD', 'OPTIONS') or response.status_code >= 400:
+            return
+        until = time.time() + settings.REPLICA_STICKY_SECONDS
+        response.set_cookie(REPLICA_PIN_COOKIE, f'{until:.3f}', max_age=settings.REPLICA_STICKY_SECONDS,
+                            httponly=True, samesite='Lax')
@@ -0,0 +1,23 @@
+"""SQLite-бэкенд с настройкой соединения через PRAGMA (журнал WAL, mmap, synchronous)"""
+from django.core.exceptions import ImproperlyConfigured
+from django.db.backends.sqlite3 import base
+
+
+class DatabaseWrapper(base.DatabaseWrapper):
+    """SQLite, применяющий OPTIONS['pragmas'] к каждому новому соединению.
+
+    Остальные OPTIONS, как и в стандартном бэкенде, передаются в sqlite3.connect (например, timeout).
+    """
+
+    def get_connection_params(self):
+        params = super().get_connection_params()
+        params.pop('pragmas', None)
+        return params
+
+    def get_new_connection(self, conn_params):
+        connection = super().get_new_connection(conn_params)
+        for name, value in self.settings_dict['OPTIONS'].get('pragmas', {}).items():
+            if not name.isidentifier() or not str(value).lstrip('-').isalnum():
+                raise ImproperlyConfigured(f'invalid SQLite pragma {name} = {value}')
+            connection.execute(f'PRAGMA {name} = {value}')
+        return connection
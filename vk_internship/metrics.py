@@ -0,0 +1,244 @@
+"""Метрики HTTP-запросов: латентность по маршрутам, количество и время SQL-запросов в формате Prometheus"""
+import logging
+import threading
+import time
+from bisect import bisect_left
+from contextlib import ExitStack
+from contextvars import ContextVar
+
+from asgiref.sync import iscoroutinefunction, markcoroutinefunction, sync_to_async
+from django.conf import settings
+from django.db import connections
+from django.http import HttpResponse
+
+from friendship import cache as relationship_cache, notifications
+
+logger = logging.getLogger(__name__)
+
+# Верхние границы корзин гистограммы латентности, в секундах
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0)
+
+CONTENT_TYPE = 'text/plain; version=0.0.4; charset=utf-8'
+
+
+class RouteStats:
+    """Накопленные значения для одной комбинации (маршрут, метод, код ответа)"""
+    __slots__ = ('buckets', 'count', 'latency', 'queries', 'query_time', 'over_budget')
+
+    def __init__(self):
+        self.buckets = [0] * (len(LATENCY_BUCKETS) + 1)
+        self.count = 0
+        self.latency = 0.0
+        self.queries = 0
+        self.query_time = 0.0
+        self.over_budget = 0
+
+    def merge(self, other: 'RouteStats'):
+        self.buckets = [total + value for total, value in zip(self.buckets, other.buckets)]
+        self.count += other.count
+        self.latency += other.latency
+        self.queries += other.queries
+        self.query_time += other.query_time
+        self.over_budget += other.over_budget
+
+
+class Registry:
+    """Агрегация без блокировок: каждый поток пишет только в свой словарь, словари сливаются при чтении.
+
+    Словари завершившихся потоков остаются в списке, поэтому счётчики не уменьшаются.
+    """
+
+    def __init__(self):
+        self._local = threading.local()
+        self._shards: list[dict] = []
+
+    def _shard(self) -> dict:
+        shard = getattr(self._local, 'shard', None)
+        if shard is None:
+            shard = self._local.shard = {}
+            # list.append атомарен под GIL
+            self._shards.append(shard)
+        return shard
+
+    def observe(self, route: str, method: str, status_code: int, latency: float,
+                queries: int, query_time: float, over_budget: bool):
+        shard = self._shard()
+        key = (route, method, status_code)
+        stats = shard.get(key)
+        if stats is None:
+            stats = shard[key] = RouteStats()
+        stats.buckets[bisect_left(LATENCY_BUCKETS, latency)] += 1
+        stats.count += 1
+        stats.latency += latency
+        stats.queries += queries
+        stats.query_time += query_time
+        stats.over_budget += over_budget
+
+    def collect(self) -> dict[tuple[str, str, int], RouteStats]:
+        merged = {}
+        for shard in list(self._shards):
+            for key, stats in list(shard.items()):
+                merged.setdefault(key, RouteStats()).merge(stats)
+        return merged
+
+    def reset(self):
+        self._local = threading.local()
+        self._shards = []
+
+
+registry = Registry()
+
+
+class QueryTracker:
+    """Обёртка выполнения SQL (connection.execute_wrapper): количество и суммарное время запросов.
+
+    Запросы одного HTTP-запроса могут выполняться параллельно в потоках пула (propagate), поэтому под блокировкой.
+    """
+    __slots__ = ('count', 'time', '_lock')
+
+    def __init__(self):
+        self.count = 0
+        self.time = 0.0
+        self._lock = threading.Lock()
+
+    def __call__(self, execute, sql, params, many, context):
+        started = time.perf_counter()
+        try:
+            return execute(sql, params, many, context)
+        finally:
+            elapsed = time.perf_counter() - started
+            with self._lock:
+                self.time += elapsed
+                self.count += 1
+
+
+# Трекер обрабатываемого HTTP-запроса; sync_to_async копирует его в поток синхронного кода
+_current_tracker: ContextVar[QueryTracker | None] = ContextVar('query_tracker', default=None)
+
+
+def _install_wrappers(stack: ExitStack, tracker: QueryTracker):
+    for connection in connections.all():
+        stack.enter_context(connection.execute_wrapper(tracker))
+
+
+def propagate(function):
+    """function для вызова в другом потоке с учётом её SQL-запросов в метриках текущего HTTP-запроса.
+
+    Обёртки выполнения ставятся на соединения потока, а у потоков пула соединения свои.
+    """
+    tracker = _current_tracker.get()
+    if tracker is None:
+        return function
+
+    def tracked(*args, **kwargs):
+        with ExitStack() as stack:
+            _install_wrappers(stack, tracker)
+            return function(*args, **kwargs)
+    return tracked
+
+
+class MetricsMiddleware:
+    """Учёт латентности и SQL-запросов каждого HTTP-запроса по шаблону маршрута (WSGI и ASGI)"""
+    sync_capable = True
+    async_capable = True
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+        if iscoroutinefunction(get_response):
+            markcoroutinefunction(self)
+
+    def __call__(self, request):
+        if iscoroutinefunction(self):
+            return self.__acall__(request)
+        tracker = QueryTracker()
+        token = _current_tracker.set(tracker)
+        started = time.perf_counter()
+        try:
+            with ExitStack() as stack:
+                _install_wrappers(stack, tracker)
+                response = self.get_response(request)
+        finally:
+            _current_tracker.reset(token)
+        self._observe(request, response, tracker, time.perf_counter() - started)
+        return response
+
+    async def __acall__(self, request):
+        tracker = QueryTracker()
+        token = _current_tracker.set(tracker)
+        started = time.perf_counter()
+        # Async ORM выполняет запросы в потоке sync_to_async этого запроса, у которого свои соединения
+        stack = ExitStack()
+        await sync_to_async(_install_wrappers)(stack, tracker)
+        try:
+            response = await self.get_response(request)
+        finally:
+            await sync_to_async(stack.close)()
+            _current_tracker.reset(token)
+        self._observe(request, response, tracker, time.perf_counter() - started)
+        return response
+
+    @staticmethod
+    def _observe(request, response, tracker: QueryTracker, latency: float):
+        match = request.resolver_match
+        route = match.route if match is not None else 'unmatched'
+        budget = settings.METRICS_QUERY_BUDGET
+        over_budget = budget is not None and tracker.count > budget
+        if over_budget:
+            logger.warning(
+                '%s %s issued %d SQL queries (budget %d) in %.1f ms, route %s',
+                request.method, request.path, tracker.count, budget, tracker.time * 1000, route,
+            )
+        registry.observe(route, request.method, response.status_code, latency,
+                         tracker.count, tracker.time, over_budget)
+
+
+def _labels(**labels) -> str:
+    def escape(value) -> str:
+        return str(value).replace('\\', r'\\').replace('"', r'\"').replace('\n', r'\n')
+    return '{' + ','.join(f'{name}="{escape(value)}"' for name, value in labels.items()) + '}'
+
+
+def render() -> str:
+    """Текущие значения метрик в текстовом формате Prometheus"""
+    routes = sorted(registry.collect().items())
+    lines = [
+        '# HELP http_request_duration_seconds HTTP request latency by route.',
+        '# TYPE http_request_duration_seconds histogram',
+    ]
+    for (route, method, status_code), stats in routes:
+        labels = {'route': route, 'method': method, 'status': status_code}
+        cumulative = 0
+        for bound, count in zip((*LATENCY_BUCKETS, '+Inf'), stats.buckets):
+            cumulative += count
+            lines.append(f'http_request_duration_seconds_bucket{_labels(**labels, le=bound)} {cumulative}')
+        lines.append(f'http_request_duration_seconds_sum{_labels(**labels)} {stats.latency}')
+        lines.append(f'http_request_duration_seconds_count{_labels(**labels)} {stats.count}')
+
+    counters = (
+        ('db_queries_total', 'SQL queries issued while handling requests.', 'queries'),
+        ('db_query_duration_seconds_total', 'Time spent executing SQL queries.', 'query_time'),
+        ('http_requests_over_query_budget_total', 'Requests that exceeded METRICS_QUERY_BUDGET.', 'over_budget'),
+    )
+    for name, description, attribute in counters:
+        lines += [f'# HELP {name} {description}', f'# TYPE {name} counter']
+        lines += [
+            f'{name}{_labels(route=route, method=method, status=status_code)} {getattr(stats, attribute)}'
+            for (route, method, status_code), stats in routes
+        ]
+
+    cache_stats = relationship_cache.stats.as_dict()
+    lines += [
+        '# HELP friendship_cache_requests_total Relationship cache lookups by result.',
+        '# TYPE friendship_cache_requests_total counter',
+        f'friendship_cache_requests_total{_labels(result="hit")} {cache_stats["hits"]}',
+        f'friendship_cache_requests_total{_labels(result="miss")} {cache_stats["misses"]}',
+        '# HELP friendship_notification_subscribers Open notification streams in this process.',
+        '# TYPE friendship_notification_subscribers gauge',
+        f'friendship_notification_subscribers {notifications.get_broker().subscriber_count}',
+    ]
+    return '\n'.join(lines) + '\n'
+
+
+def metrics_view(request):
+    """Эндпоинт для сбора метрик Prometheus"""
+    return HttpResponse(render(), content_type=CONTENT_TYPE)
@@ -0,0 +1,43 @@
+"""Быстрый JSON-рендерер DRF на orjson (необязательная зависимость)"""
+from django.http import HttpResponse
+from rest_framework.renderers import JSONRenderer
+
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
+
+# Типы, которые encoder DRF выводит иначе, чем orjson (даты в UTC с Z, подклассы, dataclasses):
+# orjson отказывается их сериализовать, и они уходят в JSONRenderer
+ORJSON_OPTIONS = (orjson.OPT_PASSTHROUGH_DATETIME | orjson.OPT_PASSTHROUGH_DATACLASS
+                  | orjson.OPT_PASSTHROUGH_SUBCLASS) if orjson else 0
+
+# JSONRenderer экранирует разделители строк и абзацев, чтобы ответ оставался подмножеством JavaScript
+LINE_SEPARATORS = ((b'\xe2\x80\xa8', b'\\u2028'), (b'\xe2\x80\xa9', b'\\u2029'))
+
+
+class FastJSONRenderer(JSONRenderer):
+    """Рендерер JSON через orjson, если он установлен; вывод совпадает с компактным JSONRenderer.
+
+    Запросы с отступами (Accept: application/json; indent=N) и недоступный orjson обрабатываются JSONRenderer.
+    Единственное отличие: NaN и бесконечности orjson выводит как null, а JSONRenderer отклоняет с ValueError.
+    """
+
+    def render(self, data, accepted_media_type=None, renderer_context=None):
+        if orjson is None or data is None or self.get_indent(accepted_media_type, renderer_context or {}):
+            return super().render(data, accepted_media_type, renderer_context)
+        try:
+            content = orjson.dumps(data, option=ORJSON_OPTIONS)
+        except TypeError:
+            # Типы, которые orjson не поддерживает (Decimal, ленивые строки, даты), сериализует encoder DRF
+            return super().render(data, accepted_media_type, renderer_context)
+        if b'\xe2\x80' in content:
+            for separator, escaped in LINE_SEPARATORS:
+                content = content.replace(separator, escaped)
+        return content
+
+
+def render_json(data, status: int = 200) -> HttpResponse:
+    """JSON-ответ для представлений вне DRF (async-представления)"""
+    return HttpResponse(FastJSONRenderer().render(data), content_type='application/json', status=status)
@@ -1,13 +1,20 @@
+import os
 from pathlib import Path
 
 BASE_DIR = Path(__file__).resolve().parent.parent
 
-SECRET_KEY = 'django-insecure-q#u1p(h-i#*x9vhc9l-n+5xaqa-m@_wqc_!3ysevqn3qll!_6)'
+
+def env_bool(name: str, default: bool) -> bool:
+    return os.environ.get(name, str(default)).lower() in ('1', 'true', 'yes', 'on')
+
+
+SECRET_KEY = os.environ.get('DJANGO_SECRET_KEY', 'django-insecure-q#u1p(h-i#*x9vhc9l-n+5xaqa-m@_wqc_!3ysevqn3qll!_6)')
 
 # SECURITY WARNING: don't run with debug turned on in production!
-DEBUG = True
+# В режиме DEBUG Django хранит в памяти все выполненные SQL-запросы
+DEBUG = env_bool('DJANGO_DEBUG', True)
 
-ALLOWED_HOSTS = ['*']
+ALLOWED_HOSTS = os.environ.get('DJANGO_ALLOWED_HOSTS', '*').split(',')
 
 
 # Application definition
@@ -28,6 +35,8 @@ INSTALLED_APPS = [
 ]
 
 MIDDLEWARE = [
+    'vk_internship.metrics.MetricsMiddleware',
+    'vk_internship.db.replicas.ReplicaRoutingMiddleware',
     'django.middleware.security.SecurityMiddleware',
     'django.contrib.sessions.middleware.SessionMiddleware',
     'django.middleware.common.CommonMiddleware',
@@ -64,11 +73,88 @@ WSGI_APPLICATION = 'vk_internship.wsgi.application'
 
 DATABASES = {
     'default': {
-        'ENGINE': 'django.db.backends.sqlite3',
-        'NAME': BASE_DIR / 'db.sqlite3',
+        # Стандартный SQLite-бэкенд с PRAGMA из OPTIONS['pragmas'] на каждом соединении
+        'ENGINE': 'vk_internship.db.sqlite3',
+        'NAME': os.environ.get('SQLITE_PATH', BASE_DIR / 'db.sqlite3'),
+        'OPTIONS': {
+            # Ожидание блокировки записи другим соединением (busy timeout), в секундах
+            'timeout': float(os.environ.get('SQLITE_BUSY_TIMEOUT', 10)),
+            'pragmas': {
+                # WAL: читатели не блокируют писателя и наоборот
+                'journal_mode': os.environ.get('SQLITE_JOURNAL_MODE', 'wal'),
+                # NORMAL в режиме WAL не повреждает базу при сбое процесса, теряя лишь последние транзакции при сбое ОС
+                'synchronous': os.environ.get('SQLITE_SYNCHRONOUS', 'normal'),
+                'mmap_size': int(os.environ.get('SQLITE_MMAP_SIZE', 256 * 1024 * 1024)),
+                # Отрицательное значение — размер кэша страниц в КиБ
+                'cache_size': int(os.environ.get('SQLITE_CACHE_SIZE', -64 * 1024)),
+            },
+        },
+        # Файловая тестовая база: в памяти SQLite не даёт проверить параллельные транзакции из потоков
+        'TEST': {
+            'NAME': BASE_DIR / 'test_db.sqlite3',
+        },
     }
 }
 
+# Реплики только для чтения — файлы-копии основной базы (python manage.py sync_replicas), через запятую
+DATABASE_REPLICAS = []
+for index, path in enumerate(filter(None, os.environ.get('SQLITE_REPLICAS', '').split(',')), start=1):
+    DATABASE_REPLICAS.append(f'replica_{index}')
+    DATABASES[f'replica_{index}'] = {
+        **DATABASES['default'],
+        'NAME': path.strip(),
+        'OPTIONS': {
+            **DATABASES['default']['OPTIONS'],
+            'pragmas': {**DATABASES['default']['OPTIONS']['pragmas'], 'query_only': 1},
+        },
+        # В тестах реплики указывают на тестовую основную базу
+        'TEST': {'MIRROR': 'default'},
+    }
+
+# Шарды связей (см. friendship.sharding) — файлы SQLite через запятую; без них связи хранятся в основной базе.
+# Количество шардов после заполнения менять нельзя
+FRIENDSHIP_SHARDS = []
+for index, path in enumerate(filter(None, os.environ.get('SQLITE_SHARDS', '').split(',')), start=1):
+    FRIENDSHIP_SHARDS.append(f'shard_{index}')
+    DATABASES[f'shard_{index}'] = {
+        **DATABASES['default'],
+        'NAME': path.strip(),
+        'OPTIONS': {
+            **DATABASES['default']['OPTIONS'],
+            # Пользователи в основной базе: внешние ключи шарда ссылаться не на что
+            'pragmas': {**DATABASES['default']['OPTIONS']['pragmas'], 'foreign_keys': 0},
+        },
+        'TEST': {'NAME': BASE_DIR / f'test_shard_{index}.sqlite3'},
+    }
+
+# Потоки параллельного чтения с шардов
+FRIENDSHIP_SHARD_WORKERS = int(os.environ.get('FRIENDSHIP_SHARD_WORKERS', 8))
+
+DATABASE_ROUTERS = ['friendship.sharding.ShardRouter', 'vk_internship.db.replicas.PrimaryReplicaRouter']
+
+# Сколько секунд после изменения клиент и затронутые пользователи читают из основной базы
+REPLICA_STICKY_SECONDS = float(os.environ.get('REPLICA_STICKY_SECONDS', 5))
+
+
+# Cache
+# https://docs.djangoproject.com/en/4.2/topics/cache/
+
+CACHES = {
+    'default': {
+        'BACKEND': 'django.core.cache.backends.locmem.LocMemCache',
+    },
+    # Ключи кэша связей включают версию связей пользователя, поэтому локальный кэш процесса не устаревает;
+    # общий кэш (например, redis) избавляет процессы от повторной загрузки одних и тех же списков
+    'friendship': {
+        'BACKEND': os.environ.get('FRIENDSHIP_CACHE_BACKEND', 'django.core.cache.backends.locmem.LocMemCache'),
+        'LOCATION': os.environ.get('FRIENDSHIP_CACHE_LOCATION', 'friendship'),
+        'TIMEOUT': 300,
+        'OPTIONS': {
+            'MAX_ENTRIES': 100_000,
+        },
+    },
+}
+
 
 # Password validation
 # https://docs.djangoproject.com/en/4.2/ref/settings/#auth-password-validators
@@ -90,8 +176,62 @@ AUTH_PASSWORD_VALIDATORS = [
 
 REST_FRAMEWORK = {
     'DEFAULT_SCHEMA_CLASS': 'drf_spectacular.openapi.AutoSchema',
+    'DEFAULT_RENDERER_CLASSES': [
+        'vk_internship.renderers.FastJSONRenderer',
+        'rest_framework.renderers.BrowsableAPIRenderer',
+    ],
+}
+
+# Friendship service
+
+# Максимальное количество пользователей в одном пакетном запросе
+FRIENDSHIP_BATCH_MAX_SIZE = 500
+
+# Алиас кэша для множеств связей пользователей (см. friendship.cache)
+FRIENDSHIP_CACHE_ALIAS = 'friendship'
+
+# Максимальное количество рекомендаций в ответе и размер хранимого top-K кандидатов
+FRIENDSHIP_RECOMMENDATIONS_SIZE = 20
+FRIENDSHIP_RECOMMENDATIONS_CAPACITY = 100
+
+# CSR-снимок графа дружбы (см. friendship.snapshot; без пути снимок не используется), период обновления дельты
+# из базы в секундах и максимальное количество событий в дельте, после которого снимок не используется до экспорта
+FRIENDSHIP_GRAPH_SNAPSHOT_PATH = os.environ.get('FRIENDSHIP_GRAPH_SNAPSHOT_PATH') or None
+FRIENDSHIP_GRAPH_SNAPSHOT_DELTA_TTL = 5
+FRIENDSHIP_GRAPH_SNAPSHOT_MAX_DELTA = 100_000
+
+# Поиск цепочки друзей (friendships/path/): максимальная глубина, бюджеты посещённых пользователей и времени в секундах
+FRIENDSHIP_PATH_MAX_DEPTH = 6
+FRIENDSHIP_PATH_MAX_VISITED = 100_000
+FRIENDSHIP_PATH_TIMEOUT = 0.2
+
+# Поиск пользователей по имени (users/search/): размер страницы по умолчанию и максимальный (?limit=),
+# максимальное количество друзей, при котором друзья поднимаются в начало результатов
+USER_SEARCH_PAGE_SIZE = 20
+USER_SEARCH_MAX_PAGE_SIZE = 100
+USER_SEARCH_FRIENDS_LIMIT = 5000
+
+# Количество событий журнала изменений в ответе по умолчанию
+FRIENDSHIP_EVENTS_PAGE_SIZE = 1000
+
+# SSE-уведомления (см. friendship.notifications). InProcessBroker работает в пределах одного процесса,
+# при нескольких воркерах нужен friendship.notifications.EventLogBroker
+FRIENDSHIP_NOTIFICATIONS = {
+    'BACKEND': os.environ.get('FRIENDSHIP_NOTIFICATIONS_BACKEND', 'friendship.notifications.InProcessBroker'),
+    'OPTIONS': {},
+    # Период комментариев-heartbeat в неактивном потоке, в секундах
+    'HEARTBEAT': 15,
 }
 
+# Размер страницы списков друзей и запросов по умолчанию и максимально допустимый (?limit=)
+FRIENDSHIP_PAGE_SIZE = 100
+FRIENDSHIP_MAX_PAGE_SIZE = 1000
+
+# Metrics (см. vk_internship.metrics, эндпоинт /metrics)
+
+# Запросы, выполнившие больше SQL-запросов, логируются с уровнем WARNING; None отключает проверку
+METRICS_QUERY_BUDGET = None
+
 # Internationalization
 # https://docs.djangoproject.com/en/4.2/topics/i18n/
 
@@ -0,0 +1,157 @@
+import asyncio
+import tempfile
+import threading
+from io import StringIO
+from pathlib import Path
+
+from asgiref.sync import async_to_sync
+from django.core.exceptions import ImproperlyConfigured
+from django.core.management import call_command
+from django.db import OperationalError, connection, connections, router
+
+from django.test import TransactionTestCase, override_settings
+from rest_framework.test import APIClient, APITestCase
+
+from friendship import cache as relationship_cache
+from user.models import User
+from vk_internship import metrics
+from vk_internship.db import replicas
+
+
+class MetricsTestCase(APITestCase):
+    def setUp(self):
+        super().setUp()
+        metrics.registry.reset()
+
+    def test_route_metrics(self):
+        self.client.post('/api/users/', data={'username': 'Вася'})
+        self.client.get('/api/users/1/')
+        self.client.get('/api/users/2/')
+        self.client.get('/api/unknown/')
+
+        stats = metrics.registry.collect()
+        detail = stats[('api/users/<int:user_id>/', 'GET', 200)]
+        self.assertEqual(detail.count, 1)
+        self.assertEqual(detail.queries, 1)
+        self.assertEqual(sum(detail.buckets), 1)
+        self.assertEqual(stats[('api/users/<int:user_id>/', 'GET', 404)].count, 1)
+        self.assertEqual(stats[('unmatched', 'GET', 404)].queries, 0)
+
+        response = self.client.get('/metrics')
+        self.assertEqual(response.status_code, 200)
+        self.assertTrue(response['Content-Type'].startswith('text/plain; version=0.0.4'))
+        body = response.content.decode()
+        labels = 'route="api/users/<int:user_id>/",method="GET",status="200"'
+        self.assertIn(f'http_request_duration_seconds_bucket{{{labels},le="+Inf"}} 1', body)
+        self.assertIn(f'http_request_duration_seconds_count{{{labels}}} 1', body)
+        self.assertIn(f'db_queries_total{{{labels}}} 1', body)
+        self.assertIn('friendship_cache_requests_total{result="hit"}', body)
+
+    @override_settings(METRICS_QUERY_BUDGET=0)
+    def test_query_budget(self):
+        with self.assertLogs('vk_internship.metrics', 'WARNING') as logs:
+            self.client.get('/api/users/1/')
+        self.assertIn('issued 1 SQL queries (budget 0)', logs.output[0])
+        self.assertEqual(metrics.registry.collect()[('api/users/<int:user_id>/', 'GET', 404)].over_budget, 1)
+
+    def test_thread_shards(self):
+        def worker():
+            for _ in range(100):
+                metrics.registry.observe('route', 'GET', 200, 0.001, 2, 0.0005, False)
+
+        threads = [threading.Thread(target=worker) for _ in range(4)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        stats = metrics.registry.collect()[('route', 'GET', 200)]
+        self.assertEqual(stats.count, 400)
+        self.assertEqual(stats.queries, 800)
+        self.assertEqual(stats.buckets[0], 400)
+
+
+class SQLiteBackendTestCase(APITestCase):
+    def test_connection_pragmas(self):
+        with connection.cursor() as cursor:
+            for pragma, value in (('journal_mode', 'wal'), ('synchronous', 1), ('foreign_keys', 1),
+                                  ('cache_size', -64 * 1024)):
+                cursor.execute(f'PRAGMA {pragma}')
+                self.assertEqual(cursor.fetchone()[0], value)
+        self.assertNotIn('pragmas', connection.get_connection_params())
+
+    def test_invalid_pragma(self):
+        wrapper = type(connections['default'])({
+            **connection.settings_dict,
+            'OPTIONS': {'pragmas': {'journal_mode': 'wal; DROP TABLE user_user'}},
+        })
+        with self.assertRaises(ImproperlyConfigured):
+            wrapper.get_new_connection(wrapper.get_connection_params())
+
+
+class ReplicaRoutingTestCase(TransactionTestCase):
+    """Чтение с реплики, которая копируется из основной базы только по sync_replicas"""
+
+    def setUp(self):
+        relationship_cache.clear()
+        self.directory = tempfile.TemporaryDirectory()
+        connections.settings['replica_1'] = {
+            **connection.settings_dict,
+            'NAME': Path(self.directory.name) / 'replica.sqlite3',
+            'OPTIONS': {
+                **connection.settings_dict['OPTIONS'],
+                'pragmas': {**connection.settings_dict['OPTIONS']['pragmas'], 'query_only': 1},
+            },
+        }
+        settings_override = override_settings(DATABASE_REPLICAS=['replica_1'], REPLICA_STICKY_SECONDS=60)
+        settings_override.enable()
+        self.addCleanup(settings_override.disable)
+
+    def tearDown(self):
+        connections['replica_1'].close()
+        del connections['replica_1']
+        del connections.settings['replica_1']
+        self.directory.cleanup()
+
+    def test_replica_reads(self):
+        writer, reader = APIClient(), APIClient()
+        first_id = writer.post('/api/users/', data={'username': 'Вася'}).data['id']
+        call_command('sync_replicas', stdout=StringIO())
+        second_id = User.objects.create(username='Петя').id
+
+        # Реплика отстаёт: второго пользователя на ней ещё нет
+        self.assertEqual(reader.get(f'/api/users/{first_id}/').status_code, 200)
+        self.assertEqual(reader.get(f'/api/users/{second_id}/').status_code, 404)
+        self.assertEqual(reader.get(f'/api/async/users/{second_id}/').status_code, 404)
+        # Клиент, который только что писал, читает из основной базы
+        self.assertEqual(writer.get(f'/api/users/{second_id}/').status_code, 200)
+
+        # Пользователи, чьи связи изменились, закрепляются за основной базой и для других клиентов
+        response = writer.post(f'/api/friendships/requests/{first_id}-{second_id}/send_request/')
+        self.assertEqual(response.status_code, 201)
+        response = reader.get(f'/api/friendships/requests/{second_id}/incoming/')
+        self.assertEqual([user['id'] for user in response.data['requests_users']], [first_id])
+        # В том числе пользователи из тела пакетного запроса
+        third_id, fourth_id = (User.objects.create(username=username).id for username in ('Коля', 'Саша'))
+        call_command('sync_replicas', stdout=StringIO())
+        response = writer.post('/api/friendships/requests/batch/', data={'operations': [
+            {'user_id': third_id, 'target_user_id': fourth_id, 'action': 'send_request'},
+        ]}, format='json')
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(reader.get(f'/api/friendships/{fourth_id}/counts/').data['incoming_requests'], 1)
+
+        call_command('sync_replicas', stdout=StringIO())
+        self.assertEqual(reader.get(f'/api/users/{second_id}/').status_code, 200)
+
+        # Запись в копии контекста (в отдельной задаче asyncio) запрещает реплики всему запросу
+        async def view():
+            await asyncio.ensure_future(User.objects.acreate(username='Гоша'))
+            return router.db_for_read(User)
+
+        with replicas.use_replicas():
+            self.assertEqual(router.db_for_read(User), 'replica_1')
+            self.assertEqual(async_to_sync(view)(), 'default')
+
+        # Вне запросов на чтение всё идёт в основную базу; реплика открыта только для чтения
+        self.assertEqual(User.objects.db, 'default')
+        with self.assertRaises(OperationalError):
+            User.objects.using('replica_1').create(username='Коля')